@@ -0,0 +1,199 @@
+import json
+import time
+import threading
+
+class CallRecorder:
+  # Counts the simulated REST calls and sleeps for the configured latency on each of them
+  def __init__(self, latency_seconds=0.0):
+    self.latency_seconds = latency_seconds
+    self.counts = {}
+    self._lock = threading.Lock()
+
+  def call(self, name):
+    with self._lock:
+      self.counts[name] = self.counts.get(name, 0) + 1
+    if self.latency_seconds:
+      time.sleep(self.latency_seconds)
+
+  def total(self):
+    with self._lock:
+      return sum(self.counts.values())
+
+  def reset(self):
+    with self._lock:
+      self.counts = {}
+
+class FakeListItem(dict):
+  # list_recipes/list_datasets return dict items
+  pass
+
+class FakeZoneItem:
+  def __init__(self, recipe_name=None, dataset_name=None):
+    if recipe_name is not None:
+      self.recipe_name = recipe_name
+    if dataset_name is not None:
+      self.dataset_name = dataset_name
+
+class FakeFlowZone:
+  def __init__(self, project, zone_id, name):
+    self._project = project
+    self.id = zone_id
+    self.name = name
+
+  @property
+  def items(self):
+    self._project.recorder.call("zone.get_items")
+    items = [FakeZoneItem(recipe_name=name) for name, recipe in self._project.fixture["recipes"].items() if recipe.get("zone") == self.name]
+    items += [FakeZoneItem(dataset_name=name) for name, dataset in self._project.fixture["datasets"].items() if dataset.get("zone") == self.name]
+    return items
+
+class FakeFlowGraph:
+  def __init__(self, nodes):
+    self.nodes = nodes
+
+class FakeFlow:
+  def __init__(self, project):
+    self._project = project
+
+  def get_graph(self):
+    self._project.recorder.call("flow.get_graph")
+    fixture = self._project.fixture
+    nodes = {name: {"ref": name, "type": "COMPUTABLE_DATASET", "predecessors": [], "successors": []} for name in fixture["datasets"]}
+    for name, recipe in fixture["recipes"].items():
+      nodes[name] = {"ref": name, "type": "RUNNABLE_RECIPE", "predecessors": list(recipe["inputs"]), "successors": list(recipe["outputs"])}
+      for input_name in recipe["inputs"]:
+        nodes[input_name]["successors"].append(name)
+      for output_name in recipe["outputs"]:
+        nodes[output_name]["predecessors"].append(name)
+    return FakeFlowGraph(nodes)
+
+  def list_zones(self):
+    self._project.recorder.call("flow.list_zones")
+    zone_names = sorted({recipe.get("zone") for recipe in self._project.fixture["recipes"].values() if recipe.get("zone")})
+    return [FakeFlowZone(self._project, "default" if zone_name == "Default" else zone_name, zone_name) for zone_name in zone_names]
+
+class FakeDSSRecipe:
+  def __init__(self, project, name):
+    self._project = project
+    self.project_key = project.project_key
+    self.name = name
+
+  def get_settings(self):
+    from dataikuapi.dss.recipe import DSSRecipeSettings
+
+    self._project.recorder.call("recipe.get_settings")
+    recipe = self._project.fixture["recipes"][self.name]
+    data = {
+      "recipe": {
+        "name": self.name,
+        "projectKey": self.project_key,
+        "type": recipe["type"],
+        "inputs": {"main": {"items": [{"ref": name} for name in recipe["inputs"]]}},
+        "outputs": {"main": {"items": [{"ref": name} for name in recipe["outputs"]]}},
+        "params": {},
+      },
+      "payload": recipe.get("payload", ""),
+    }
+    return DSSRecipeSettings(self, json.loads(json.dumps(data)))
+
+class FakeDSSDataset:
+  def __init__(self, project, name):
+    self._project = project
+    self.project_key = project.project_key
+    self.name = name
+
+  def get_settings(self):
+    from dataikuapi.dss.dataset import DSSDatasetSettings
+
+    self._project.recorder.call("dataset.get_settings")
+    return DSSDatasetSettings(self, json.loads(json.dumps(self._project.dataset_raw(self.name))))
+
+  def get_usages(self):
+    self._project.recorder.call("dataset.get_usages")
+    return [{"type": "RECIPE", "objectId": recipe_name, "projectKey": self.project_key}
+            for recipe_name, recipe in self._project.fixture["recipes"].items() if self.name in recipe["inputs"]]
+
+  def get_schema(self):
+    self._project.recorder.call("dataset.get_schema")
+    return self._project.fixture["datasets"][self.name].get("schema", {"columns": [{"name": "id", "type": "bigint"}, {"name": "value", "type": "double"}]})
+
+  def get_last_metric_values(self):
+    from dataikuapi.dss.metrics import ComputedMetrics
+
+    self._project.recorder.call("dataset.get_last_metric_values")
+    dataset = self._project.fixture["datasets"][self.name]
+    metrics = [{"metric": {"id": metric_id}, "lastValues": [{"partition": "NP", "value": str(dataset[key])}]}
+               for metric_id, key in (("records:COUNT_RECORDS", "records"), ("basic:SIZE", "bytes")) if key in dataset]
+    return ComputedMetrics({"metrics": metrics})
+
+  def iter_rows(self):
+    self._project.recorder.call("dataset.iter_rows")
+    return iter(self._project.fixture["datasets"][self.name].get("rows", []))
+
+class FakeDSSProject:
+  # Serves a fixture {"recipes": {name: {type, inputs, outputs, payload, zone}}, "datasets": {name: {type, managed, params, zone}}, "variables": {}}
+  # like dataikuapi's DSSProject: handles are free, every settings/listing access is one simulated REST call
+  def __init__(self, project_key, fixture, recorder=None):
+    self.project_key = project_key
+    self.fixture = fixture
+    self.recorder = recorder or CallRecorder()
+
+  def dataset_raw(self, name):
+    dataset = self.fixture["datasets"][name]
+    return {"name": name, "projectKey": self.project_key, "type": dataset["type"], "managed": dataset["managed"], "params": dataset.get("params", {})}
+
+  def get_flow(self):
+    return FakeFlow(self)
+
+  def list_recipes(self):
+    self.recorder.call("project.list_recipes")
+    return [FakeListItem(name=name, type=recipe["type"], versionTag={"versionNumber": recipe.get("version", 1)})
+            for name, recipe in self.fixture["recipes"].items()]
+
+  def list_datasets(self):
+    self.recorder.call("project.list_datasets")
+    return [FakeListItem(**self.dataset_raw(name), versionTag={"versionNumber": dataset.get("version", 1)})
+            for name, dataset in self.fixture["datasets"].items()]
+
+  def get_recipe(self, recipe_name):
+    if recipe_name not in self.fixture["recipes"]:
+      raise Exception(f"Recipe {recipe_name} does not exist in {self.project_key}")
+    return FakeDSSRecipe(self, recipe_name)
+
+  def get_dataset(self, dataset_name):
+    return FakeDSSDataset(self, dataset_name)
+
+  def list_jobs(self):
+    self.recorder.call("project.list_jobs")
+    return list(self.fixture.get("jobs", []))
+
+  def get_variables(self):
+    self.recorder.call("project.get_variables")
+    return {"standard": dict(self.fixture.get("variables", {})), "local": {}}
+
+class FakeDSSClient:
+  def __init__(self, projects, recorder=None):
+    self.recorder = recorder or CallRecorder()
+    self._projects = {project_key: FakeDSSProject(project_key, fixture, self.recorder) for project_key, fixture in projects.items()}
+
+  def get_project(self, project_key):
+    return self._projects[project_key]
+
+class FakeWorkspaceApi:
+  # the slice of databricks_cli's WorkspaceApi used by WorkspaceOutput
+  def __init__(self, recorder=None):
+    self.recorder = recorder or CallRecorder()
+    self.client = self
+    self.imported = {}
+    self._lock = threading.Lock()
+
+  def mkdirs(self, path):
+    self.recorder.call("workspace.mkdirs")
+
+  def delete(self, path, is_recursive):
+    self.recorder.call("workspace.delete")
+
+  def import_workspace(self, path, fmt, language, content, overwrite):
+    self.recorder.call("workspace.import")
+    with self._lock:
+      self.imported[path] = len(content)
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migration_pipeline import SharedResources, ZoneMigration, load_settings, zone_settings
+from benchmarks.fake_dss import CallRecorder, FakeDSSClient, FakeWorkspaceApi
+from benchmarks.synthetic_flows import FLOW_SHAPES, generate_flow, get_sink_recipes
+
+# the phases of ZoneMigration.run up to, but excluding, the job creation that needs a real workspace
+BENCHMARKED_PHASES = ("prepare", "traverse", "size_clusters", "plan_partitioning", "plan_job_split", "plan_materialization", "plan_fusion",
+                      "generate_recipe_notebooks", "lint_sql", "create_snowflake_source_notebooks", "create_uploaded_source_notebook",
+                      "create_metrics_report", "upload", "build_tasks", "optimize_tasks", "split_tasks")
+
+def benchmark_settings(work_dir, traversal_workers=8, transpile_workers=1, sql_fusion=False, cluster_sizing=False, sql_lint=False,
+                       max_tasks_per_job=None):
+  settings = load_settings()
+  settings.update({
+    "dataiku_uri": "offline", "dataiku_token": "offline", "dbx_uri": "offline", "dbx_token": "offline",
+    "dbx_output_dir": "/Shared/benchmark",
+    "local_output_root": os.path.join(work_dir, "notebooks"),
+    "dump_local_notebooks": False,
+    "workspace_import_mode": "batch",
+    "metadata_cache_dir": None,
+    "traversal_workers": traversal_workers,
+    "incremental_migration": False,
+    "migration_manifest_dir": os.path.join(work_dir, "manifests"),
+    # the transpile cache is kept in memory, every scenario starts cold
+    "transpile_cache_dir": None,
+    "transpile_workers": transpile_workers,
+    "uploaded_files_format": "excel",
+    "sql_fusion": sql_fusion,
+    "cluster_sizing": cluster_sizing,
+    "sql_lint": sql_lint,
+  })
+  if max_tasks_per_job:
+    settings["max_tasks_per_job"] = max_tasks_per_job
+  return settings
+
+def run_scenario(shape, recipe_count, settings, latency_seconds=0.0, seed=0, zone_count=4, trace_memory=False):
+  fixture = generate_flow(shape, recipe_count, seed=seed, zone_count=zone_count)
+  recorder = CallRecorder(latency_seconds)
+  workspace_recorder = CallRecorder()
+  resources = SharedResources(settings,
+                              dss_client=FakeDSSClient({"BENCH": fixture}, recorder),
+                              dbx_ws_api=FakeWorkspaceApi(workspace_recorder))
+  migration = ZoneMigration(resources, zone_settings(settings, "BENCH", shape), "BENCH", shape, get_sink_recipes(fixture))
+
+  phase_seconds = {}
+  # tracemalloc gives the exact peak of the scenario but slows Python down several times, timings are only
+  # meaningful without it
+  if trace_memory:
+    tracemalloc.start()
+  started = time.perf_counter()
+  for phase in BENCHMARKED_PHASES:
+    phase_started = time.perf_counter()
+    getattr(migration, phase)()
+    phase_seconds[phase] = round(time.perf_counter() - phase_started, 4)
+  total_seconds = time.perf_counter() - started
+  peak_bytes = None
+  if trace_memory:
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  return {
+    "shape": shape,
+    "recipes": len(fixture["recipes"]),
+    "migrated_recipes": len(migration.recipes_list),
+    "latency_ms": latency_seconds * 1000,
+    "total_seconds": round(total_seconds, 4),
+    "traversal_seconds": phase_seconds["traverse"],
+    "transpile_seconds": phase_seconds["generate_recipe_notebooks"],
+    "phase_seconds": phase_seconds,
+    "dataiku_calls": recorder.total(),
+    "dataiku_calls_by_endpoint": dict(sorted(recorder.counts.items())),
+    "workspace_calls": workspace_recorder.total(),
+    "job_tasks": len(migration.tasks),
+    "job_clusters": sorted({task["job_cluster_key"] for task in migration.tasks}),
+    "sub_jobs": len(migration.sub_jobs),
+    "critical_path_length": migration.report["job_dag"]["critical_path_length"],
+    "sql_lint": migration.report.get("sql_lint", {}).get("summary"),
+    "peak_memory_mb": round(peak_bytes / 1024 / 1024, 1) if peak_bytes is not None else None,
+    # high-water mark of the whole process (kilobytes on Linux), it only grows from one scenario to the next
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+  }
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the migration pipeline against an offline Dataiku stand-in")
+  parser.add_argument("--shapes", nargs="+", default=list(FLOW_SHAPES), choices=FLOW_SHAPES)
+  parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+  parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated latency of every Dataiku REST call")
+  parser.add_argument("--traversal-workers", type=int, default=8)
+  parser.add_argument("--transpile-workers", type=int, default=1)
+  parser.add_argument("--sql-fusion", action="store_true", help="Fuse chains of SQL recipes into single queries")
+  parser.add_argument("--cluster-sizing", action="store_true", help="Size the job clusters from the synthetic dataset metrics")
+  parser.add_argument("--sql-lint", action="store_true", help="Lint the converted queries")
+  parser.add_argument("--max-tasks-per-job", type=int, help="Split the zones into sub-jobs of at most this many tasks")
+  parser.add_argument("--zones", type=int, default=4, help="Zones the synthetic recipes are spread over")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--trace-memory", action="store_true", help="Measure the peak memory of each scenario with tracemalloc (slow)")
+  parser.add_argument("--output", help="Write the results to this JSON file")
+  args = parser.parse_args(argv)
+
+  results = []
+  with tempfile.TemporaryDirectory() as work_dir:
+    settings = benchmark_settings(work_dir, args.traversal_workers, args.transpile_workers, args.sql_fusion, args.cluster_sizing, args.sql_lint,
+                                  args.max_tasks_per_job)
+    for shape in args.shapes:
+      for size in args.sizes:
+        result = run_scenario(shape, size, settings, args.latency_ms / 1000, seed=args.seed, zone_count=args.zones,
+                              trace_memory=args.trace_memory)
+        results.append(result)
+        print(f"{shape:>8} {result['recipes']:>6} recipes: total {result['total_seconds']:>8.2f}s, "
+              f"traversal {result['traversal_seconds']:>7.2f}s, transpile {result['transpile_seconds']:>7.2f}s, "
+              f"{result['dataiku_calls']:>6} Dataiku calls, peak {result['peak_memory_mb'] or result['max_rss_mb']:>7.1f} MB")
+
+  if args.output:
+    with open(args.output, 'w') as fh:
+      json.dump(results, fh, indent=2)
+  return results
+
+if __name__ == "__main__":
+  main()
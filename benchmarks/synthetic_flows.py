@@ -0,0 +1,113 @@
+import json
+import random
+
+FLOW_SHAPES = ("chain", "fan_out", "fan_in", "layered")
+
+def _sql_payload(project_key, input_names, datasets):
+  tables = []
+  for input_name in input_names:
+    dataset = datasets[input_name]
+    tables.append(dataset["params"]["table"] if not dataset["managed"] else f"{project_key}_{input_name}")
+
+  query = f"SELECT t0.id, t0.value * 2 AS value, '${{run_date}}' AS run_date\nFROM {tables[0]} AS t0"
+  for position, table in enumerate(tables[1:], start=1):
+    query += f"\nLEFT JOIN {table} AS t{position} ON t0.id = t{position}.id"
+  return query + "\nWHERE t0.value > 0"
+
+def _pivot_payload():
+  return json.dumps({
+    "explicitIdentifiers": ["id"],
+    "pivots": [{"keyColumns": ["category"], "valueColumns": [{"column": "value", "$agg": "sum"}]}],
+  })
+
+class FlowBuilder:
+  def __init__(self, project_key, seed=0, zone_count=1, pivot_ratio=0.05, python_ratio=0.05):
+    self.project_key = project_key
+    self.random = random.Random(seed)
+    self.zone_count = zone_count
+    self.pivot_ratio = pivot_ratio
+    self.python_ratio = python_ratio
+    self.recipes = {}
+    self.datasets = {}
+
+  def zone_name(self, position, total):
+    # contiguous blocks of recipes per zone, so every edge between two blocks crosses a zone
+    return f"Zone_{position * self.zone_count // max(total, 1)}"
+
+  def dataset_metrics(self):
+    # log-uniform sizes from a few KB to a few hundred GB, served as the last computed Dataiku metrics
+    size = int(10 ** self.random.uniform(3, 11.5))
+    return {"bytes": size, "records": size // 100}
+
+  def add_source(self):
+    name = f"SRC_{len(self.datasets)}"
+    self.datasets[name] = {"type": "Snowflake", "managed": False,
+                           "params": {"catalog": "RAW", "schema": "PUBLIC", "table": name}, "zone": "Zone_0",
+                           **self.dataset_metrics()}
+    return name
+
+  def add_recipe(self, input_names, zone):
+    position = len(self.recipes)
+    name = f"recipe_{position}"
+    output_name = f"dataset_{position}"
+    self.datasets[output_name] = {"type": "Snowflake", "managed": True,
+                                  "params": {"catalog": "WORK", "schema": "PUBLIC", "table": f"{self.project_key}_{output_name}"},
+                                  "zone": zone, **self.dataset_metrics()}
+
+    draw = self.random.random()
+    if draw < self.pivot_ratio and len(input_names) == 1:
+      recipe_type, payload = "pivot", _pivot_payload()
+    elif draw < self.pivot_ratio + self.python_ratio:
+      recipe_type, payload = "python", f"# synthetic recipe {name}\nprint('{name}')\n"
+    else:
+      recipe_type, payload = "sql_query", _sql_payload(self.project_key, input_names, self.datasets)
+
+    self.recipes[name] = {"type": recipe_type, "inputs": list(input_names), "outputs": [output_name], "payload": payload, "zone": zone}
+    return output_name
+
+  def fixture(self):
+    return {"recipes": self.recipes, "datasets": self.datasets, "variables": {"run_date": "2024-01-01"}}
+
+def _chain(builder, recipe_count, **_):
+  output_name = builder.add_source()
+  for position in range(recipe_count):
+    output_name = builder.add_recipe([output_name], builder.zone_name(position, recipe_count))
+
+def _fan_out(builder, recipe_count, **_):
+  root_output = builder.add_recipe([builder.add_source()], builder.zone_name(0, recipe_count))
+  for position in range(1, recipe_count):
+    builder.add_recipe([root_output], builder.zone_name(position, recipe_count))
+
+def _fan_in(builder, recipe_count, width=20, **_):
+  # a tree of joins: every recipe reads up to `width` outputs of the level below
+  level = [builder.add_recipe([builder.add_source()], builder.zone_name(position, recipe_count))
+           for position in range(max(recipe_count * (width - 1) // width, 1))]
+  while len(level) > 1 and len(builder.recipes) < recipe_count:
+    level = [builder.add_recipe(level[start:start + width], builder.zone_name(len(builder.recipes), recipe_count))
+             for start in range(0, len(level), width)]
+
+def _layered(builder, recipe_count, width=50, max_inputs=3, source_count=20, **_):
+  sources = [builder.add_source() for _ in range(source_count)]
+  previous_outputs = []
+  while len(builder.recipes) < recipe_count:
+    layer_outputs = []
+    for _ in range(min(width, recipe_count - len(builder.recipes))):
+      candidates = previous_outputs or sources
+      input_names = builder.random.sample(candidates, min(len(candidates), builder.random.randint(1, max_inputs)))
+      layer_outputs.append(builder.add_recipe(input_names, builder.zone_name(len(builder.recipes), recipe_count)))
+    # readers pick from the last two layers, edges skip a layer now and then
+    previous_outputs = previous_outputs[-width:] + layer_outputs
+
+def generate_flow(shape, recipe_count, project_key="BENCH", seed=0, zone_count=1, **options):
+  generators = {"chain": _chain, "fan_out": _fan_out, "fan_in": _fan_in, "layered": _layered}
+  if shape not in generators:
+    raise Exception(f"Unknown flow shape {shape}, expected one of {FLOW_SHAPES}")
+  builder = FlowBuilder(project_key, seed=seed, zone_count=zone_count,
+                        pivot_ratio=options.pop("pivot_ratio", 0.05), python_ratio=options.pop("python_ratio", 0.05))
+  generators[shape](builder, recipe_count, **options)
+  return builder.fixture()
+
+def get_sink_recipes(fixture):
+  # the recipes nobody reads from, the entry points of a migration
+  consumed = {input_name for recipe in fixture["recipes"].values() for input_name in recipe["inputs"]}
+  return [name for name, recipe in fixture["recipes"].items() if not any(output in consumed for output in recipe["outputs"])]
@@ -0,0 +1,172 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from materialization import PLANNED_RECIPE_TYPES
+
+RECORDS_METRIC = "records:COUNT_RECORDS"
+SIZE_METRIC = "basic:SIZE"
+
+# Smallest tier first, a recipe gets the first tier its data (bytes and records) and its last Dataiku run duration fit in.
+# The record count catches the datasets without a size metric (SQL tables) and the wide shuffles of many small rows.
+# A missing or None limit accepts anything, new_cluster holds the overrides applied on top of the base job cluster
+DEFAULT_CLUSTER_TIERS = [
+  {
+    "job_cluster_key": "small",
+    "max_bytes": 1024 ** 3,
+    "max_records": 50 * 1000 ** 2,
+    "max_duration_seconds": 10 * 60,
+    "new_cluster": {"node_type_id": "c4.2xlarge", "num_workers": 1},
+  },
+  {
+    "job_cluster_key": "medium",
+    "max_bytes": 50 * 1024 ** 3,
+    "max_records": 1000 ** 3,
+    "max_duration_seconds": 60 * 60,
+    "new_cluster": {"node_type_id": "c4.4xlarge", "num_workers": 4, "custom_tags": {"ResourceClass": "Default"}},
+  },
+  {
+    "job_cluster_key": "large",
+    "max_bytes": None,
+    "max_records": None,
+    "max_duration_seconds": None,
+    "new_cluster": {"node_type_id": "i3.4xlarge", "num_workers": None, "autoscale": {"min_workers": 4, "max_workers": 16},
+                    "custom_tags": {"ResourceClass": "Default"}},
+  },
+]
+
+def _metric_value(metrics, metric_id):
+  try:
+    value = metrics.get_global_value(metric_id)
+  except Exception:
+    return None
+  return int(value) if value not in (None, "") else None
+
+def get_dataset_metrics(dss_project, dataset_names, max_workers=1):
+  # last computed record count and size of each dataset, datasets without metrics are left out
+  def fetch(dataset_name):
+    try:
+      metrics = dss_project.get_dataset(dataset_name).get_last_metric_values()
+    except Exception as e:
+      print(f"Could not read the metrics of {dataset_name}: {e}")
+      return dataset_name, None
+    return dataset_name, {"records": _metric_value(metrics, RECORDS_METRIC), "bytes": _metric_value(metrics, SIZE_METRIC)}
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    return {dataset_name: metrics for dataset_name, metrics in executor.map(fetch, dataset_names) if metrics}
+
+def get_job_durations(dss_project):
+  # duration of the last successful Dataiku job that built each dataset
+  try:
+    dss_jobs = dss_project.list_jobs()
+  except Exception as e:
+    print(f"Could not list the Dataiku jobs of {dss_project.project_key}: {e}")
+    return {}
+
+  durations = {}
+  last_start = {}
+  for dss_job in dss_jobs:
+    if dss_job.get("state") != "DONE" or not dss_job.get("startTime") or not dss_job.get("endTime"):
+      continue
+    for output in dss_job.get("def", {}).get("outputs", []):
+      dataset_name = output.get("targetDataset")
+      if dataset_name and dss_job["startTime"] > last_start.get(dataset_name, 0):
+        last_start[dataset_name] = dss_job["startTime"]
+        durations[dataset_name] = (dss_job["endTime"] - dss_job["startTime"]) / 1000
+  return durations
+
+def get_recipe_duration(recipe_name, flow_index, job_durations):
+  # the recipe ran in the Dataiku job that built its slowest output, None when it never ran
+  durations = [job_durations[name] for name in flow_index.get_recipe(recipe_name)["outputs"] if name in job_durations]
+  return max(durations) if durations else None
+
+def get_task_durations(task_recipes, flow_index, job_durations):
+  # {task key: seconds} for the tasks whose recipes (task_recipes: {task key: [recipes]}) all ran in Dataiku
+  task_durations = {}
+  for task_key, recipe_names in task_recipes.items():
+    durations = [get_recipe_duration(recipe_name, flow_index, job_durations) for recipe_name in recipe_names]
+    if durations and None not in durations:
+      task_durations[task_key] = sum(durations)
+  return task_durations
+
+def estimate_recipe_load(recipe_name, flow_index, dataset_metrics, job_durations):
+  recipe = flow_index.get_recipe(recipe_name)
+  load = {"input_bytes": 0, "output_bytes": 0, "records": 0, "duration_seconds": None, "measured": False}
+  for key, dataset_names in (("input_bytes", recipe["inputs"]), ("output_bytes", recipe["outputs"])):
+    for dataset_name in dataset_names:
+      metrics = dataset_metrics.get(dataset_name)
+      if metrics:
+        load[key] += metrics["bytes"] or 0
+        load["records"] += metrics["records"] or 0
+        load["measured"] = load["measured"] or metrics["bytes"] is not None
+  load["duration_seconds"] = get_recipe_duration(recipe_name, flow_index, job_durations)
+  return load
+
+def _fits(value, limit):
+  return limit is None or value is None or value <= limit
+
+def choose_cluster_tier(load, tiers):
+  for tier in tiers:
+    if (_fits(load["input_bytes"] + load["output_bytes"], tier.get("max_bytes")) and _fits(load["records"], tier.get("max_records"))
+        and _fits(load["duration_seconds"], tier.get("max_duration_seconds"))):
+      return tier["job_cluster_key"]
+  return tiers[-1]["job_cluster_key"]
+
+def plan_cluster_sizing(recipes_map, flow_index, dataset_metrics, job_durations, tiers=None):
+  tiers = tiers or DEFAULT_CLUSTER_TIERS
+  tier_rank = {tier["job_cluster_key"]: rank for rank, tier in enumerate(tiers)}
+  plan = {}
+  for recipe_name in recipes_map:
+    load = estimate_recipe_load(recipe_name, flow_index, dataset_metrics, job_durations)
+    plan[recipe_name] = {**load, "job_cluster_key": choose_cluster_tier(load, tiers)}
+
+  # Global temp views only live on the cluster that created them. Recipes publishing their outputs themselves
+  # (python, sync...) run on the same cluster as their migrated readers, on the largest tier any of them needs
+  parents = {recipe_name: recipe_name for recipe_name in recipes_map}
+  def find(recipe_name):
+    while parents[recipe_name] != recipe_name:
+      parents[recipe_name] = parents[parents[recipe_name]]
+      recipe_name = parents[recipe_name]
+    return recipe_name
+  for recipe_name, recipe_obj in recipes_map.items():
+    # uploaded files are registered on every cluster reading them, like the Snowflake sources
+    if flow_index.get_recipe_type(recipe_name) in PLANNED_RECIPE_TYPES or recipe_obj.get("source_uploaded"):
+      continue
+    for reader_name in flow_index.get_downstream_recipes(recipe_name):
+      if reader_name in recipes_map:
+        parents[find(reader_name)] = find(recipe_name)
+
+  group_tiers = {}
+  for recipe_name, entry in plan.items():
+    root = find(recipe_name)
+    if root not in group_tiers or tier_rank[entry["job_cluster_key"]] > tier_rank[group_tiers[root]]:
+      group_tiers[root] = entry["job_cluster_key"]
+  for recipe_name, entry in plan.items():
+    entry["job_cluster_key"] = group_tiers[find(recipe_name)]
+  return plan
+
+def get_cross_cluster_outputs(sizing_plan, recipes_map, flow_index):
+  # outputs read on another cluster than the one computing them, they are materialized as Delta tables
+  return {recipe_name for recipe_name, entry in sizing_plan.items()
+          if any(reader_name in recipes_map and sizing_plan[reader_name]["job_cluster_key"] != entry["job_cluster_key"]
+                 for reader_name in flow_index.get_downstream_recipes(recipe_name))}
+
+def get_job_clusters(base_cluster, cluster_keys, tiers=None):
+  job_clusters = []
+  for tier in tiers or DEFAULT_CLUSTER_TIERS:
+    if tier["job_cluster_key"] not in cluster_keys:
+      continue
+    new_cluster = copy.deepcopy(base_cluster)
+    for key, value in tier["new_cluster"].items():
+      if value is None:
+        new_cluster.pop(key, None)
+      else:
+        new_cluster[key] = copy.deepcopy(value)
+    job_clusters.append({"job_cluster_key": tier["job_cluster_key"], "new_cluster": new_cluster})
+  return job_clusters
+
+def sizing_summary(sizing_plan):
+  summary = {}
+  for entry in sizing_plan.values():
+    summary[entry["job_cluster_key"]] = summary.get(entry["job_cluster_key"], 0) + 1
+  summary["unmeasured"] = sum(1 for entry in sizing_plan.values() if not entry["measured"] and entry["duration_seconds"] is None)
+  return summary
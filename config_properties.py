@@ -49,14 +49,125 @@ dataiku_token = ""
 dbx_uri = ""
 dbx_output_dir = ""
 dbx_token = ""
-local_output_dir = f"/tmp/{project_name}/{zone_name}"
+# Local copies of the generated notebooks are written under <local_output_root>/<project>/<zone>
+local_output_root = "/tmp"
+# Also write the generated notebooks under local_output_dir, for debugging only
+dump_local_notebooks = False
+# "batch" imports each notebook in parallel, "archive" replaces dbx_output_dir with a single DBC import
+workspace_import_mode = "batch"
 
 # COMMAND ----------
 
+# Dataiku metadata cache, set the directory to None to disable persisting it across runs
+metadata_cache_dir = "/tmp/dataiku_metadata_cache"
+metadata_cache_ttl_seconds = 7 * 24 * 3600
+
+# COMMAND ----------
+
+# Number of recipes traversed concurrently, 1 keeps the traversal serial
+traversal_workers = 8
+# Upper bound on Dataiku REST calls per second shared by all workers
+dataiku_max_calls_per_second = 20
+
+# COMMAND ----------
+
+# Incremental re-migration, only recipes whose definition changed are regenerated and the existing job is updated in place
+incremental_migration = False
+# One manifest per project zone, keep them on persistent storage (e.g. /dbfs or a volume) so they survive cluster restarts
+migration_manifest_dir = "/dbfs/dataiku_migration/manifests"
+
+# COMMAND ----------
+
+# On-disk cache of transpiled SQL, set to None to keep it in memory only
+transpile_cache_dir = "/dbfs/dataiku_migration/transpile_cache"
+# Processes used to transpile the cache misses, None uses every core
+transpile_workers = None
+
+# COMMAND ----------
+
+# "single" registers every Snowflake table in one task, "per_table" creates one task per table
+# and "grouped" one task per snowflake_registration_group_size tables
+snowflake_registration_mode = "single"
+snowflake_registration_group_size = 5
+# Read only the columns and common filters used by the migrated SQL recipes from each Snowflake table
+snowflake_pushdown = False
+
+# COMMAND ----------
+
+# Snowflake tables kept as Delta snapshots in snowflake_snapshot_schema, each run only pulls the rows changed since the last one
+# and merges them on key_columns. The changes are found with a watermark_column (inserts and updates) or with Snowflake change
+# tracking (also deletes, ALTER TABLE ... SET CHANGE_TRACKING = TRUE). Without key_columns the new rows are appended
+# e.g. {"ORDERS": {"key_columns": ["ORDER_ID"], "watermark_column": "UPDATED_AT"}, "CUSTOMERS": {"key_columns": ["ID"], "change_tracking": True}}
+snowflake_source_sync = {}
+snowflake_snapshot_schema = "dataiku_migration_snapshots"
+
+# COMMAND ----------
+
+# Outputs read by at least materialization_cache_fan_out migrated recipes are cached in memory,
+# from materialization_delta_fan_out readers on they are written to Delta tables in materialization_schema
+# e.g. 2 and 3. None keeps every output a global temp view recomputed by each reader
+materialization_cache_fan_out = None
+materialization_delta_fan_out = None
+materialization_schema = "dataiku_migration"
+
+# COMMAND ----------
+
+# Chains of SQL recipes whose intermediate outputs have a single reader are fused into one query and one task
+sql_fusion = False
+
+# COMMAND ----------
+
+# Recipes building a partitioned Dataiku dataset only compute the partition given in the DKU_DST_<dimension> job parameters
+# and replace it in a Delta table, an empty parameter rebuilds every partition
+partition_processing = False
+
+# COMMAND ----------
+
+# Flag cross joins, SELECT * over wide sources, large DISTINCTs, functions on join/filter keys and correlated subqueries
+# in the converted queries, the findings are written to reports/sql_lint.json in dbx_output_dir.
+# sql_lint_fail_severity "warning" or "error" fails the migration on any finding of that severity or above
+sql_lint = False
+sql_lint_fail_severity = None
+
+# COMMAND ----------
+
+# "parquet" converts the uploaded files to Parquet during the migration (requires pyarrow),
+# "excel" keeps reading the original .xlsx files with pandas on every run
+uploaded_files_format = "excel"
+
 snowflake_connection = {
   "url": "",
-  "user": ""
+  "user": "",
   "password": "",
   "role": "",
   "warehouse": ""
 }
+
+# COMMAND ----------
+
+# Job clusters of the generated jobs, None uses the default single worker cluster
+job_clusters = None
+# Size the clusters from the Dataiku dataset metrics (records, bytes) and job history: each task runs on the
+# smallest tier its data fits in, the tiers are applied on top of the first job cluster.
+# cluster_tiers None uses cluster_sizing.DEFAULT_CLUSTER_TIERS
+cluster_sizing = False
+cluster_tiers = None
+# Zones with more tasks are split into sub-jobs run in order by a parent job, the outputs read across sub-jobs are Delta tables
+max_tasks_per_job = 1000
+# Zones migrated concurrently by the command line, they share the connection pool and the caches
+zone_workers = 4
+
+# COMMAND ----------
+
+# The generated notebooks append their wall time, output rows and bytes and Spark stage metrics to runtime_metrics_table,
+# keyed by job run and recipe. reports/runtime_comparison in dbx_output_dir compares them with the last Dataiku builds
+runtime_metrics = False
+runtime_metrics_table = "dataiku_migration.runtime_metrics"
+
+# COMMAND ----------
+
+# Phase timings, per-endpoint API latencies and the slowest SQL conversions are written here as JSON and CSV
+# at the end of each run, set to None to skip it
+profile_output_dir = "/dbfs/dataiku_migration/profiles"
+# Print each phase and the traversal progress as the migration runs
+profile_progress = False
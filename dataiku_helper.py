@@ -1,6 +1,22 @@
 import os
+import io
 import re
-import sqlglot
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+# Bump whenever the generated runtime module changes, each version is uploaded to its own folder so the
+# notebooks of jobs that were not migrated again keep importing the version they were generated with
+RUNTIME_VERSION = 8
+RUNTIME_MODULE_NAME = "dataiku_migration_runtime"
+# job parameters the runtime metrics are keyed by, resolved by the jobs service on every run
+RUNTIME_METRICS_PARAMETERS = {"migration_job_id": "{{job.id}}", "migration_run_id": "{{job.run_id}}"}
+MAX_TASK_KEY_LENGTH = 100
+# package standing in for the dataiku module in migrated Python recipes, uploaded next to the runtime module
+COMPAT_PACKAGE_NAME = "dataiku_compat"
 
 def mkdir_local(path):
   if not os.path.exists(path):
@@ -8,9 +24,216 @@ def mkdir_local(path):
 
 def write_to_local_path(payload, output_path):
   mkdir_local(os.path.dirname(output_path))
-  with open(output_path, 'w') as fh:
+  with open(output_path, 'wb' if isinstance(payload, bytes) else 'w') as fh:
     fh.write(payload)
 
+class RateLimiter:
+  def __init__(self, max_calls_per_second):
+    self.interval = 1.0 / max_calls_per_second
+    self._lock = threading.Lock()
+    self._next_slot = 0.0
+
+  def acquire(self):
+    with self._lock:
+      now = time.monotonic()
+      slot = max(now, self._next_slot)
+      self._next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+class PooledHTTPAdapter(HTTPAdapter):
+  def __init__(self, rate_limiter=None, profile=None, api_name=None, **kwargs):
+    self.rate_limiter = rate_limiter
+    self.profile = profile
+    self.api_name = api_name
+    super().__init__(**kwargs)
+
+  def send(self, request, **kwargs):
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire()
+    if self.profile is None:
+      return super().send(request, **kwargs)
+
+    # timed after the rate limiter, only the time spent on the wire is recorded
+    started = time.perf_counter()
+    failed = True
+    try:
+      response = super().send(request, **kwargs)
+      failed = response.status_code >= 400
+      return response
+    finally:
+      self.profile.record_http(self.api_name, request.method, request.url, time.perf_counter() - started, failed)
+
+def configure_connection_pool(session, pool_size, max_calls_per_second=None, profile=None, api_name=None):
+  rate_limiter = RateLimiter(max_calls_per_second) if max_calls_per_second else None
+  adapter = PooledHTTPAdapter(rate_limiter=rate_limiter,
+                              profile=profile,
+                              api_name=api_name,
+                              pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=session.get_adapter("https://").max_retries)
+  session.mount("https://", adapter)
+  session.mount("http://", adapter)
+  return adapter
+
+class MetadataStore:
+  def __init__(self, cache_dir, project_key, ttl_seconds=7 * 24 * 3600, max_entries=20000):
+    self.path = os.path.join(cache_dir, f"{project_key}.json")
+    self.ttl_seconds = ttl_seconds
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._entries = {}
+    if os.path.exists(self.path):
+      with open(self.path) as fh:
+        self._entries = json.load(fh).get("entries", {})
+
+  def _is_expired(self, entry, now):
+    return self.ttl_seconds is not None and now - entry["cached_at"] > self.ttl_seconds
+
+  def get(self, key, version):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry["version"] != version or self._is_expired(entry, time.time()):
+        return None
+      return entry["value"]
+
+  def put(self, key, version, value):
+    with self._lock:
+      self._entries[key] = {"version": version, "cached_at": time.time(), "value": value}
+
+  def save(self):
+    with self._lock:
+      now = time.time()
+      entries = {key: entry for key, entry in self._entries.items() if not self._is_expired(entry, now)}
+      if len(entries) > self.max_entries:
+        newest = sorted(entries.items(), key=lambda item: item[1]["cached_at"], reverse=True)[:self.max_entries]
+        entries = dict(newest)
+      self._entries = entries
+      mkdir_local(os.path.dirname(self.path))
+      tmp_path = self.path + ".tmp"
+      with open(tmp_path, 'w') as fh:
+        json.dump({"entries": entries}, fh)
+      os.replace(tmp_path, self.path)
+
+class CachedDSSRecipe:
+  def __init__(self, cached_project, dss_recipe):
+    self._cached_project = cached_project
+    self._recipe = dss_recipe
+    self._settings = None
+
+  def __getattr__(self, name):
+    return getattr(self._recipe, name)
+
+  def get_settings(self):
+    if self._settings is None:
+      self._settings = self._cached_project._get_recipe_settings(self._recipe)
+    return self._settings
+
+class CachedDSSDataset:
+  def __init__(self, cached_project, dss_dataset):
+    self._cached_project = cached_project
+    self._dataset = dss_dataset
+    self._settings = None
+    self._usages = None
+
+  def __getattr__(self, name):
+    return getattr(self._dataset, name)
+
+  def get_settings(self):
+    if self._settings is None:
+      self._settings = self._cached_project._get_dataset_settings(self._dataset)
+    return self._settings
+
+  def get_usages(self):
+    if self._usages is None:
+      self._usages = self._cached_project._get_dataset_usages(self._dataset)
+    return self._usages
+
+class CachedDSSProject:
+  def __init__(self, dss_project, cache_dir=None, ttl_seconds=7 * 24 * 3600, max_entries=20000):
+    self._project = dss_project
+    self.project_key = dss_project.project_key
+    self._store = MetadataStore(cache_dir, self.project_key, ttl_seconds, max_entries) if cache_dir else None
+    self._lock = threading.RLock()
+    self._recipes = {}
+    self._datasets = {}
+    self._listings = {}
+    self._versions = {}
+
+  def __getattr__(self, name):
+    return getattr(self._project, name)
+
+  def _listing(self, kind):
+    with self._lock:
+      if kind not in self._listings:
+        items = self._project.list_recipes() if kind == "RECIPE" else self._project.list_datasets()
+        self._listings[kind] = items
+        self._versions[kind] = {item["name"]: item.get("versionTag", {}).get("versionNumber") for item in items}
+      return self._listings[kind]
+
+  def _version(self, kind, name):
+    self._listing(kind)
+    return self._versions[kind].get(name)
+
+  def _flow_version(self):
+    self._listing("RECIPE")
+    return hashlib.sha1(json.dumps(sorted(self._versions["RECIPE"].items())).encode()).hexdigest()
+
+  def _cached_fetch(self, key, version, fetch):
+    if self._store is not None and version is not None:
+      value = self._store.get(key, version)
+      if value is not None:
+        return value
+    value = fetch()
+    if self._store is not None and version is not None:
+      self._store.put(key, version, value)
+    return value
+
+  def _get_recipe_settings(self, dss_recipe):
+    from dataikuapi.dss.recipe import DSSRecipeSettings
+
+    name = dss_recipe.name
+    data = self._cached_fetch(f"recipe/{name}/settings", self._version("RECIPE", name),
+                              lambda: json.loads(json.dumps(dss_recipe.get_settings().data)))
+    return DSSRecipeSettings(dss_recipe, data)
+
+  def _get_dataset_settings(self, dss_dataset):
+    from dataikuapi.dss.dataset import DSSDatasetSettings
+
+    name = dss_dataset.name
+    raw = self._cached_fetch(f"dataset/{name}/settings", self._version("DATASET", name),
+                             lambda: json.loads(json.dumps(dss_dataset.get_settings().get_raw())))
+    return DSSDatasetSettings(dss_dataset, raw)
+
+  def _get_dataset_usages(self, dss_dataset):
+    name = dss_dataset.name
+    version = self._version("DATASET", name)
+    if version is not None:
+      version = f"{version}/{self._flow_version()}"
+    return self._cached_fetch(f"dataset/{name}/usages", version, dss_dataset.get_usages)
+
+  def list_recipes(self):
+    return self._listing("RECIPE")
+
+  def list_datasets(self):
+    return self._listing("DATASET")
+
+  def get_recipe(self, recipe_name):
+    with self._lock:
+      if recipe_name not in self._recipes:
+        self._recipes[recipe_name] = CachedDSSRecipe(self, self._project.get_recipe(recipe_name))
+      return self._recipes[recipe_name]
+
+  def get_dataset(self, dataset_name):
+    with self._lock:
+      if dataset_name not in self._datasets:
+        self._datasets[dataset_name] = CachedDSSDataset(self, self._project.get_dataset(dataset_name))
+      return self._datasets[dataset_name]
+
+  def save_cache(self):
+    if self._store is not None:
+      self._store.save()
+
 def get_zone(dss_project, zone_name):
   dss_flow = dss_project.get_flow()
   dss_zone = None
@@ -24,61 +247,95 @@ def get_zone(dss_project, zone_name):
   
   return dss_zone
 
-def create_notebook_from_recipe(recipe, variables, output_path):
-  config_payload = _add_parameter_payload(variables)
-  recipe_payload = recipe.get_settings().get_payload()
-  converted_query = convert_snowflake_to_databricks_query(recipe_payload)
-  cleaned_query = _clean_query(converted_query)
+def _partition_values_payload(partitioning):
+  # {dimension: value} in the generated code, the values are bound by the parameter cell
+  return "{" + ", ".join(f'"{dimension}": {parameter}' for dimension, parameter in partitioning["parameters"].items()) + "}"
+
+def _partition_variables(variables, partitioning=None):
+  # the partition parameters are bound like the project variables, queries keep using ${DKU_DST_<dimension>}
+  if not partitioning:
+    return variables
+  return {**variables, **{parameter: "" for parameter in partitioning["parameters"].values()}}
+
+def _write_output_payload(df_expression, output_name, materialization=None, indent="", partitioning=None):
+  # materialization is an entry of the materialization plan, outputs are global temp views without one
+  if partitioning:
+    # partitioned outputs are always Delta tables, only the partition of the run is replaced
+    schema_name = materialization["location"].split(".", 1)[0]
+    return (f'{indent}spark.sql("CREATE SCHEMA IF NOT EXISTS {schema_name}")\n'
+            f'{indent}write_partitions(spark, {df_expression}, "{materialization["location"]}", {_partition_values_payload(partitioning)})')
+  if materialization and materialization["materialization"] == "delta":
+    schema_name = materialization["location"].split(".", 1)[0]
+    return (f'{indent}spark.sql("CREATE SCHEMA IF NOT EXISTS {schema_name}")\n'
+            f'{indent}{df_expression}.write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable("{materialization["location"]}")')
+  payload = f'{indent}{df_expression}.createOrReplaceGlobalTempView("{output_name}")'
+  if materialization and materialization["materialization"] == "cache":
+    # CACHE TABLE is eager, the output is computed once here instead of once per reader
+    payload += f'\n{indent}spark.sql("CACHE TABLE global_temp.{output_name}")'
+  return payload
+
+def _task_metrics_payloads(metrics_table, project_key, task_name, kind, output_locations):
+  # (start cell, line put back at the top of the cells running Spark jobs, record cell), empty without metrics_table
+  if not metrics_table:
+    return "", "", ""
+  start = f'\n# COMMAND ----------\n\ntask_metrics = start_task_metrics(spark, dbutils, "{project_key}", "{task_name}", "{kind}")'
+  record = f'\n# COMMAND ----------\n\nrecord_task_metrics(spark, task_metrics, "{metrics_table}", {output_locations})'
+  return start, "track_task_metrics(spark, task_metrics)\n", record
+
+def _metrics_runtime_names(metrics_table):
+  return ["start_task_metrics", "track_task_metrics", "record_task_metrics"] if metrics_table else []
+
+def create_notebook_from_recipe(recipe, variables, runtime_dir, output_path=None, converted_query=None, materialization=None, partitioning=None,
+                                metrics_table=None):
+  if converted_query is None:
+    converted_query = convert_snowflake_to_databricks_query(recipe.get_settings().get_payload())
 
   output_name = f"{recipe.project_key}_{recipe.get_settings().get_flat_output_refs()[0]}"
+  write_payload = _write_output_payload(f'spark.sql(rf\"\"\"\n{converted_query}\n\"\"\")', output_name, materialization, indent="  ",
+                                        partitioning=partitioning)
+  output_location = materialization["location"] if materialization else f"global_temp.{output_name}"
+  metrics_start, metrics_track, metrics_record = _task_metrics_payloads(metrics_table, recipe.project_key, recipe.name, "sql", [output_location])
 
   payload = f"""
-%run ../config
+{_runtime_import_payload(runtime_dir, ["get_variables"] + (["write_partitions"] if partitioning else []) + _metrics_runtime_names(metrics_table))}
 # COMMAND ----------\n
-{config_payload}
+{_add_parameter_payload(_partition_variables(variables, partitioning))}{metrics_start}
 # COMMAND ----------\n
 def {recipe.name.lower()}():
-  spark.sql(f\"\"\"\n{cleaned_query}\n\"\"\").createOrReplaceGlobalTempView("{output_name}")
+{write_payload}
 # COMMAND ----------\n
-{recipe.name.lower()}()
+{metrics_track}{recipe.name.lower()}(){metrics_record}
 """
-  write_to_local_path(payload, output_path)
-    
-def _clean_query(payload):
-  cleaned_payload = payload.replace("\"", "").replace("$", "")
-  return cleaned_payload
-    
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
+
+def _variable_default(value):
+  if isinstance(value, str):
+    return value.replace("::timestamp", "")
+  return str(value)
+
+def get_job_parameters(variables):
+  # project variables are job parameters, the jobs service passes them to every notebook task
+  return [{"name": key, "default": _variable_default(value)} for key, value in variables.items()]
+
 def _add_parameter_payload(variables):
   payload = "(\n"
   indent = "    "
   for key in variables.keys():
     payload += f"{indent}{key},\n"
-  payload += ") = set_up_variables(dbutils, spark)"
+  defaults = {key: _variable_default(value) for key, value in variables.items()}
+  payload += f") = get_variables(dbutils, {defaults})"
+  return payload
+
+def _runtime_import_payload(runtime_dir, names):
+  # the runtime module is a workspace file, it is imported once per task instead of running helper notebooks
+  payload = f"""import sys
+if "/Workspace{runtime_dir}" not in sys.path:
+  sys.path.insert(0, "/Workspace{runtime_dir}")"""
+  if names:
+    payload += f"\nfrom {RUNTIME_MODULE_NAME} import {', '.join(names)}"
   return payload
-    
-def create_config_notebook(variables, output_path):
-  payload = "def set_up_variables(dbutils, spark):\n"
-  #setting up the widgets
-  for key, value in variables.items():
-    if(isinstance(value, str)):
-      value = value.replace("::timestamp", "")
-      payload += f"    dbutils.widgets.text(\"{key}\", \"{value}\")\n"
-    else:
-      payload += f"    dbutils.widgets.text(\"{key}\", \"{value}\")\n"
-  
-  #parsing the widgets
-  payload += "\n"
-  for key in variables.keys():
-    payload += f"    {key} = dbutils.widgets.get(\"{key}\")\n"
-    
-  #returning the tuple
-  payload += "\n"
-  payload += "    return ("
-  for key in variables.keys():
-    payload += f"{key},"
-  payload += ")\n"
-  
-  write_to_local_path(payload, output_path)
 
 def import_notebook_to_dbx(dbx_ws_api, local_path, dbx_import_path, overwrite=True):
   dbx_ws_api.mkdirs(os.path.dirname(dbx_import_path))
@@ -101,39 +358,32 @@ def is_python_recipe(recipe):
 def is_pivot_recipe(recipe):
   return recipe.get_settings().type == 'pivot'
 
-def convert_snowflake_to_databricks_query(query):
-  parsed_query = sqlglot.parse_one(query, read="snowflake")
-
-  tables_to_skip = [cte.alias for cte in parsed_query.find_all(sqlglot.exp.CTE)]
+def convert_snowflake_to_databricks_query(query, table_locations=None):
+  # sqlglot is only loaded when a query is actually transpiled
+  import sqlglot
+  from sql_rewrite import protect_variables, apply_rewrite_rules
 
-  for table in parsed_query.find_all(sqlglot.exp.Table):
-    if table.name not in tables_to_skip:
-      new_table_alias = f"AS {table.alias}" if table.alias else ""
-      new_table_name = f"global_temp.{table.name} {new_table_alias}"
-      table.replace(sqlglot.exp.Table(this=new_table_name))
+  parsed_query = sqlglot.parse_one(protect_variables(query), read="snowflake")
+  return apply_rewrite_rules(parsed_query, {"table_locations": table_locations or {}}).sql(dialect="databricks", pretty=True)
 
-  transpiled_query = parsed_query.sql(dialect="databricks", pretty=True)
-  results = re.compile(re.escape("DATEDIFF(days"), re.IGNORECASE).sub("DATEDIFF(day", transpiled_query)
-  results = re.compile(re.escape("DATEADD(days"), re.IGNORECASE).sub("DATEADD(day", transpiled_query)
-  
-  return results
-
-def get_recipe_source_datasets(recipe, dss_project):
+def get_source_datasets(input_datasets, output_refs, recipe_type, project_key):
   datasets = {"UploadedFiles":{}, "Snowflake": {}}
-  recipe_settings = recipe.get_settings()
-  input_datasets = recipe_settings.get_flat_input_refs()
-  
-  for dataset_name in input_datasets:
-    dataset = dss_project.get_dataset(dataset_name).get_settings().get_raw()
+
+  for dataset in input_datasets:
     if not dataset["managed"]:
-      if dataset["type"] == "UploadedFiles" and is_sync_recipe(recipe):
-        dataset_name = recipe_settings.get_flat_output_refs()[0]
-        datasets[dataset["type"]][dataset_name] = {"dataset_name": dataset_name, "table_name": f"{recipe.project_key}_{dataset_name}"}
+      if dataset["type"] == "UploadedFiles" and recipe_type == 'sync':
+        dataset_name = output_refs[0]
+        datasets[dataset["type"]][dataset_name] = {"dataset_name": dataset_name, "table_name": f"{project_key}_{dataset_name}", "source_dataset_name": dataset["name"]}
       elif dataset["type"] == "Snowflake":
         datasets[dataset["type"]][dataset["name"]] = {"database_name":dataset["params"]["catalog"], "schema_name":dataset["params"]["schema"], "table_name":dataset["params"]["table"]}
-  
+
   return datasets
 
+def get_recipe_source_datasets(recipe, dss_project):
+  recipe_settings = recipe.get_settings()
+  input_datasets = [dss_project.get_dataset(dataset_name).get_settings().get_raw() for dataset_name in recipe_settings.get_flat_input_refs()]
+  return get_source_datasets(input_datasets, recipe_settings.get_flat_output_refs(), recipe_settings.type, recipe.project_key)
+
 def get_upstream_recipes_for_managed_dataset(recipe, dss_project):
   input_datasets = recipe.get_settings().get_flat_input_refs()
   upstream_recipes = []
@@ -146,35 +396,67 @@ def get_upstream_recipes_for_managed_dataset(recipe, dss_project):
 
   return upstream_recipes
 
-def create_snowflake_source_dataset_notebook(dataset_list, snowflake_connection, output_path):
+def create_snowflake_source_dataset_notebook(dataset_list, snowflake_connection, runtime_dir, output_path=None, metrics_table=None,
+                                             project_key=None, task_name=None):
+  # synced tables are measured on their snapshot, the others are views read by the recipes
+  output_locations = [dataset["sync"]["snapshot"] if dataset.get("sync") else f"global_temp.{dataset['table_name']}" for dataset in dataset_list]
+  metrics_start, metrics_track, metrics_record = _task_metrics_payloads(metrics_table, project_key, task_name, "snowflake_source", output_locations)
   payload = f"""
-def read_snowflake_table(database_name, schema_name, table_name, snowflake_connection):
-  snowflake_connection_options = {{
-    "sfUrl": snowflake_connection["url"],
-    "sfUser": dbutils.secrets.get(snowflake_connection["user"]["secret_scope"], snowflake_connection["user"]["secret_key"]),
-    "sfPassword": dbutils.secrets.get(snowflake_connection["password"]["secret_scope"], snowflake_connection["password"]["secret_key"]),
-    "sfRole": snowflake_connection["role"],
-    "sfWarehouse": snowflake_connection["warehouse"],
-  }}
-
-  return (spark.read
-    .format("snowflake")
-    .options(**snowflake_connection_options)
-    .option("sfDatabase", database_name)
-    .option("sfSchema", schema_name)
-    .option("dbtable", table_name)
-    .load()
-  ).createOrReplaceGlobalTempView(table_name)
+{_runtime_import_payload(runtime_dir, ["read_snowflake_table", "sync_snowflake_table"] + _metrics_runtime_names(metrics_table))}
 # COMMAND ----------\n
 dataset_list = {dataset_list}
 # COMMAND ----------\n
-snowflake_connection = {snowflake_connection}
+snowflake_connection = {snowflake_connection}{metrics_start}
 # COMMAND ----------\n
-for dataset in dataset_list:
-  read_snowflake_table(dataset["database_name"], dataset["schema_name"], dataset["table_name"], snowflake_connection)
+{metrics_track}for dataset in dataset_list:
+  if dataset.get("sync"):
+    # the table is registered from its Delta snapshot, only the rows changed since the last run are pulled
+    sync_snowflake_table(spark, dbutils, dataset["database_name"], dataset["schema_name"], dataset["table_name"], snowflake_connection,
+                         dataset["sync"], dataset.get("partitions"))
+  else:
+    read_snowflake_table(spark, dbutils, dataset["database_name"], dataset["schema_name"], dataset["table_name"], snowflake_connection,
+                         dataset.get("columns"), dataset.get("predicate"), dataset.get("partitions")){metrics_record}
 """
 
-  write_to_local_path(payload, output_path)
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
+
+def create_runtime_metrics_report_notebook(runtime_dir, metrics_table, baseline, output_path=None):
+  # baseline: the last Dataiku build of the recipes of each task, the notebook is run on demand after the job
+  payload = f"""
+{_runtime_import_payload(runtime_dir, ["compare_runtime_metrics"])}
+# COMMAND ----------\n
+baseline = {baseline}
+# COMMAND ----------\n
+display(compare_runtime_metrics(spark, "{metrics_table}", baseline))
+"""
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
+
+def to_task_key(name):
+  # Databricks rejects task keys longer than MAX_TASK_KEY_LENGTH, a hash of the full key keeps truncated keys unique
+  task_key = re.sub(r"[^\w-]", "_", name)
+  if len(task_key) <= MAX_TASK_KEY_LENGTH:
+    return task_key
+  return f"{task_key[:MAX_TASK_KEY_LENGTH - 9]}_{hashlib.sha1(task_key.encode()).hexdigest()[:8]}"
+
+def group_snowflake_source_datasets(snowflake_source_datasets, mode="single", group_size=1):
+  dataset_names = list(snowflake_source_datasets.keys())
+  if mode == "single":
+    return {"SOURCE_DATASETS": dataset_names}
+  if mode == "per_table":
+    group_size = 1
+  elif mode != "grouped":
+    raise Exception(f"Unknown Snowflake registration mode {mode}")
+
+  groups = {}
+  for start in range(0, len(dataset_names), group_size):
+    group = dataset_names[start:start + group_size]
+    group_name = group[0] if len(group) == 1 else f"GROUP_{start // group_size + 1}"
+    groups[to_task_key(group_name)] = group
+  return groups
 
 def get_runnable_recipes(items):
   res = []
@@ -184,20 +466,121 @@ def get_runnable_recipes(items):
       res.append(obj)
   return(res)
 
-def create_pyspark_notebook_from_recipe(recipe, output_path):
-  recipe_payload = recipe.get_settings().get_payload()
+def get_computable_datasets(items):
+  res = []
+  for sub in items:
+    if sub['type']=='COMPUTABLE_DATASET':
+      obj = {'name': sub['ref'], 'type': sub['type'], 'pre': sub['predecessors'], 'sucs': sub['successors']}
+      res.append(obj)
+  return(res)
+
+def create_pyspark_notebook_from_recipe(recipe, variables, runtime_dir, dataset_locations, output_path=None, recipe_code=None, partitioning=None,
+                                        metrics_table=None):
+  # recipe_code is the recipe with its dataiku imports pointing to the compatibility package
+  if recipe_code is None:
+    recipe_code = recipe.get_settings().get_payload()
+  defaults = {key: _variable_default(value) for key, value in variables.items()}
+  if partitioning:
+    # the package filters the partitioned inputs and replaces the partition of the outputs
+    partitioning = {"parameters": partitioning["parameters"], "inputs": partitioning["inputs"], "outputs": [partitioning["output"]]}
+  output_locations = [dataset_locations[name] for name in recipe.get_settings().get_flat_output_refs() if name in dataset_locations]
+  metrics_start, metrics_track, metrics_record = _task_metrics_payloads(metrics_table, recipe.project_key, recipe.name, "python", output_locations)
 
   payload = f"""
-  {recipe_payload}
-  """
-  write_to_local_path(payload, output_path)
+{_runtime_import_payload(runtime_dir, _metrics_runtime_names(metrics_table))}
+import {COMPAT_PACKAGE_NAME}
+# COMMAND ----------\n
+{COMPAT_PACKAGE_NAME}.configure(spark, dbutils, "{recipe.project_key}", {dataset_locations}, {defaults}, {partitioning}){metrics_start}
+# COMMAND ----------\n
+{metrics_track}{recipe_code}{metrics_record}
+"""
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
+
+
+# Dataiku storage types to (pyarrow type name, Spark DDL type), anything else is kept as a string
+DATAIKU_COLUMN_TYPES = {
+  "tinyint": ("int8", "TINYINT"),
+  "smallint": ("int16", "SMALLINT"),
+  "int": ("int32", "INT"),
+  "bigint": ("int64", "BIGINT"),
+  "float": ("float32", "FLOAT"),
+  "double": ("float64", "DOUBLE"),
+  "boolean": ("bool_", "BOOLEAN"),
+  "date": ("timestamp", "TIMESTAMP"),
+}
+
+def _parse_dataiku_value(value, column_type):
+  # rows are exported as text, empty cells are nulls
+  if value is None or value == "":
+    return None
+  if column_type in ("tinyint", "smallint", "int", "bigint"):
+    return int(value)
+  if column_type in ("float", "double"):
+    return float(value)
+  if column_type == "boolean":
+    return value.lower() == "true"
+  if column_type == "date":
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+  return value
 
+def _quote_spark_column(column_name):
+  return "`" + column_name.replace("`", "``") + "`"
+
+def get_spark_schema_ddl(dataiku_schema):
+  return ", ".join(f"{_quote_spark_column(column['name'])} {DATAIKU_COLUMN_TYPES.get(column['type'], (None, 'STRING'))[1]}"
+                   for column in dataiku_schema["columns"])
+
+def export_dataset_to_parquet(dss_dataset):
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  columns = dss_dataset.get_schema()["columns"]
+  values = [[] for _ in columns]
+  for row in dss_dataset.iter_rows():
+    for position, column in enumerate(columns):
+      values[position].append(_parse_dataiku_value(row[position], column["type"]))
+
+  arrays = []
+  for column, column_values in zip(columns, values):
+    arrow_type_name = DATAIKU_COLUMN_TYPES.get(column["type"], ("string", None))[0]
+    arrow_type = pa.timestamp("us", tz="UTC") if arrow_type_name == "timestamp" else getattr(pa, arrow_type_name)()
+    arrays.append(pa.array(column_values, type=arrow_type))
+
+  buffer = io.BytesIO()
+  pq.write_table(pa.Table.from_arrays(arrays, names=[column["name"] for column in columns]), buffer, compression="snappy")
+  return buffer.getvalue()
+
+def create_uploaded_source_dataset_notebook(dataset_list, output_path=None, file_format="parquet", runtime_dir=None, metrics_table=None,
+                                            project_key=None, task_name=None):
+  output_locations = [f"global_temp.{dataset['table_name'].upper()}" for dataset in dataset_list]
+  metrics_start, metrics_track, metrics_record = _task_metrics_payloads(metrics_table, project_key, task_name, "uploaded_source", output_locations)
+  # the runtime module is only needed to record the metrics
+  runtime_import = f"{_runtime_import_payload(runtime_dir, _metrics_runtime_names(metrics_table))}\n# COMMAND ----------\n\n" if metrics_table else ""
+  if file_format == "parquet":
+    # files are converted at migration time, each run is a plain distributed read with the schema known upfront
+    payload = f"""
+{runtime_import}def read_parquet_file(dataset):
+  (
+    spark.read
+      .schema(dataset["schema"])
+      .parquet(dataset["path"])
+  ).createOrReplaceGlobalTempView(dataset["table_name"].upper())
+# COMMAND ----------\n
+dataset_list = {dataset_list}{metrics_start}
+# COMMAND ----------\n
+{metrics_track}for dataset in dataset_list:
+  read_parquet_file(dataset){metrics_record}
+"""
+    if output_path:
+      write_to_local_path(payload, output_path)
+    return payload
 
-def create_uploaded_source_dataset_notebook(dataset_list, output_path):
   payload = f"""
 %pip install openpyxl
 # COMMAND ----------\n
-import pyspark.pandas as pypd
+{runtime_import}import pyspark.pandas as pypd
 # COMMAND ----------\n
 def read_excel_file(dataset):
   return (
@@ -206,43 +589,434 @@ def read_excel_file(dataset):
       .to_spark()
   ).createOrReplaceGlobalTempView(dataset["table_name"].upper())
 # COMMAND ----------\n
-dataset_list = {dataset_list}
+dataset_list = {dataset_list}{metrics_start}
 # COMMAND ----------\n
-for dataset in dataset_list:
-  read_excel_file(dataset)
+{metrics_track}for dataset in dataset_list:
+  read_excel_file(dataset){metrics_record}
 """
 
-  write_to_local_path(payload, output_path)
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
 
-def create_pivot_function_notebook(output_path):
-  payload = f"""
-  from pyspark.sql.functions import expr
+def create_runtime_module(output_path=None):
+  payload = f"""# Helpers shared by the notebooks of a migrated zone, generated by the Dataiku migration
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from numbers import Number
+from urllib.request import urlopen
+
+from pyspark.sql import functions as F
+from pyspark.sql.functions import expr
+
+RUNTIME_VERSION = {RUNTIME_VERSION}
+
+# Dataiku aggregation names that differ from the pyspark function names
+AGG_FUNCTIONS = {{"countd": "count_distinct", "average": "avg"}}
+# Dataiku identifiers of the time partitions
+PARTITION_FORMATS = {{"YEAR": "%Y", "MONTH": "%Y-%m", "DAY": "%Y-%m-%d", "HOUR": "%Y-%m-%d-%H"}}
+# Snapshots of synced Snowflake tables record the end of their last change tracking sync in this table property
+SYNC_PROPERTY = "dataiku_migration.synced_until"
+SYNC_DELETED_COLUMN = "_dataiku_migration_deleted"
+SNOWFLAKE_TIMESTAMP_FORMAT = "YYYY-MM-DD HH24:MI:SS.FF9 TZHTZM"
+SYNC_ATTEMPTS = 3
+# Job parameters holding the ids of the job run, the jobs service resolves them
+METRICS_RUN_PARAMETERS = {tuple(RUNTIME_METRICS_PARAMETERS)}
+# Stage metrics of the Spark UI summed per task, by their column in the metrics table
+STAGE_METRICS = {{"inputBytes": "input_bytes", "inputRecords": "input_records", "outputBytes": "written_bytes", "outputRecords": "written_records",
+                 "shuffleReadBytes": "shuffle_read_bytes", "shuffleWriteBytes": "shuffle_write_bytes",
+                 "executorRunTime": "executor_run_time_ms", "diskBytesSpilled": "spilled_bytes"}}
+RUNTIME_METRICS_COLUMNS = [("job_id", "STRING"), ("run_id", "STRING"), ("project_key", "STRING"), ("task_name", "STRING"), ("kind", "STRING"),
+                           ("started_at", "TIMESTAMP"), ("wall_seconds", "DOUBLE"), ("output_rows", "BIGINT"), ("output_bytes", "BIGINT"),
+                           ("spark_jobs", "INT"), ("stages", "INT"), ("tasks", "BIGINT"), ("failed_tasks", "BIGINT")]
+RUNTIME_METRICS_COLUMNS += [(name, "BIGINT") for name in STAGE_METRICS.values()]
+BASELINE_COLUMNS = [("project_key", "STRING"), ("task_name", "STRING"), ("recipes", "ARRAY<STRING>"), ("dataiku_seconds", "DOUBLE"),
+                    ("dataiku_records", "BIGINT"), ("dataiku_bytes", "BIGINT")]
+
+def get_variables(dbutils, defaults):
+  # project variables are job parameters, the defaults are only used when a notebook runs outside of its job
+  values = []
+  for name, default in defaults.items():
+    try:
+      values.append(dbutils.widgets.get(name))
+    except Exception:
+      values.append(default)
+  return tuple(values)
+
+def _shift_partition(partition_id, granularity, offset):
+  partition_format = PARTITION_FORMATS[granularity]
+  # the partition of the run may be finer than the granularity, a day shifted by months keeps its month
+  moment = datetime.strptime(partition_id[:len(datetime(2000, 1, 1).strftime(partition_format))], partition_format)
+  if granularity in ("DAY", "HOUR"):
+    moment -= timedelta(**{{f"{{granularity.lower()}}s": offset}})
+  else:
+    months = moment.year * 12 + moment.month - 1 - offset * (12 if granularity == "YEAR" else 1)
+    moment = moment.replace(year=months // 12, month=months % 12 + 1)
+  return moment.strftime(partition_format)
+
+def _spark_string(value):
+  # Spark SQL escapes quotes and backslashes of string literals with a backslash, two quotes are two literals
+  return "'" + str(value).replace("\\\\", "\\\\\\\\").replace("'", "\\\\'") + "'"
+
+def partition_predicate(dependency, partition_values):
+  # SQL predicate on the partitions of an input a Dataiku dependency reads, None reads all of them
+  value = partition_values.get(dependency["output_dimension"])
+  if not value:
+    return None
+  if dependency["func"] == "equals":
+    return f"`{{dependency['column']}}` = {{_spark_string(value)}}"
+  if dependency["func"] == "time_range":
+    start = _shift_partition(value, dependency["granularity"], dependency["from"])
+    end = _shift_partition(value, dependency["granularity"], dependency["to"])
+    return f"`{{dependency['column']}}` BETWEEN {{_spark_string(min(start, end))}} AND {{_spark_string(max(start, end))}}"
+  return None
+
+def filter_partitions(df, dependencies, partition_values):
+  for dependency in dependencies or []:
+    predicate = partition_predicate(dependency, partition_values)
+    if predicate:
+      df = df.where(predicate)
+  return df
+
+def write_partitions(spark, df, location, partition_values):
+  # Only the partitions of the run are replaced, every partition when none is given (a full rebuild).
+  # The table is always partitioned on every dimension: a dimension the recipe does not output is added with the
+  # value of the run, a full rebuild has no value to add and needs the column
+  values = {{column: value for column, value in partition_values.items() if value}}
+  for column in partition_values:
+    if column in df.columns:
+      continue
+    if column not in values:
+      raise Exception(f"The output {{location}} has no {{column}} column, it can only be built one partition at a time")
+    df = df.withColumn(column, F.lit(values[column]))
+  writer = df.write.format("delta").partitionBy(*partition_values)
+  if values and spark.catalog.tableExists(location):
+    predicate = " AND ".join(f"`{{column}}` = {{_spark_string(value)}}" for column, value in values.items())
+    writer.mode("overwrite").option("replaceWhere", predicate).saveAsTable(location)
+  else:
+    writer.mode("overwrite").option("overwriteSchema", "true").saveAsTable(location)
+
+def _snowflake_reader(spark, dbutils, database_name, schema_name, snowflake_connection):
+  snowflake_connection_options = {{
+    "sfUrl": snowflake_connection["url"],
+    "sfUser": dbutils.secrets.get(snowflake_connection["user"]["secret_scope"], snowflake_connection["user"]["secret_key"]),
+    "sfPassword": dbutils.secrets.get(snowflake_connection["password"]["secret_scope"], snowflake_connection["password"]["secret_key"]),
+    "sfRole": snowflake_connection["role"],
+    "sfWarehouse": snowflake_connection["warehouse"],
+  }}
+
+  return (spark.read
+    .format("snowflake")
+    .options(**snowflake_connection_options)
+    .option("sfDatabase", database_name)
+    .option("sfSchema", schema_name)
+  )
+
+def read_snowflake_table(spark, dbutils, database_name, schema_name, table_name, snowflake_connection, columns=None, predicate=None, partitions=None):
+  # partitions: {{column: job parameter}}, only the partition of the run is read when the parameter is set
+  for column, parameter in (partitions or {{}}).items():
+    value = get_variables(dbutils, {{parameter: ""}})[0]
+    if value:
+      predicate = f"({{predicate}}) AND {{column}} = '{{value}}'" if predicate else f"{{column}} = '{{value}}'"
+  reader = _snowflake_reader(spark, dbutils, database_name, schema_name, snowflake_connection)
+  # only the columns and filters used by the migrated recipes are pulled from Snowflake
+  if columns or predicate:
+    select_list = ", ".join(columns) if columns else "*"
+    query = f"SELECT {{select_list}} FROM {{table_name}}"
+    if predicate:
+      query += f" WHERE {{predicate}}"
+    reader = reader.option("query", query)
+  else:
+    reader = reader.option("dbtable", table_name)
+
+  return reader.load().createOrReplaceGlobalTempView(table_name)
+
+def _sql_literal(value):
+  # watermarks come back from the snapshot as Python values, numbers are compared unquoted
+  if isinstance(value, Number):
+    return str(value)
+  return "'" + str(value).replace("'", "''") + "'"
+
+def _watermark_changes(spark, new_reader, table_name, snapshot, sync):
+  # rows at or past the last synced watermark, the ones at the watermark itself may have been committed after the last sync
+  watermark_column = sync["watermark_column"]
+  last_watermark = spark.table(snapshot).agg(F.max(F.col(f"`{{watermark_column}}`"))).first()[0]
+  if last_watermark is None:
+    return None
+  operator = ">=" if sync.get("key_columns") else ">"
+  changes = new_reader().option("query", f"SELECT * FROM {{table_name}} WHERE {{watermark_column}} {{operator}} {{_sql_literal(last_watermark)}}").load()
+  return changes.withColumn(SYNC_DELETED_COLUMN, F.lit(False))
+
+def _tracked_changes(spark, new_reader, table_name, snapshot, sync_started):
+  # net changes Snowflake recorded since the last sync, an update is a DELETE and an INSERT of which only the INSERT is kept
+  synced_until = spark.sql(f"DESCRIBE DETAIL {{snapshot}}").first()["properties"].get(SYNC_PROPERTY)
+  if not synced_until:
+    return None
+  query = (f"SELECT * FROM {{table_name}} CHANGES(INFORMATION => DEFAULT) "
+           f"AT(TIMESTAMP => TO_TIMESTAMP_TZ('{{synced_until}}', '{{SNOWFLAKE_TIMESTAMP_FORMAT}}')) "
+           f"END(TIMESTAMP => TO_TIMESTAMP_TZ('{{sync_started}}', '{{SNOWFLAKE_TIMESTAMP_FORMAT}}'))")
+  try:
+    changes = new_reader().option("query", query).load()
+    action = F.col("`METADATA$ACTION`")
+    changes = changes.where(~((action == "DELETE") & F.col("`METADATA$ISUPDATE`"))).withColumn(SYNC_DELETED_COLUMN, action == "DELETE")
+    return changes.drop("METADATA$ACTION", "METADATA$ISUPDATE", "METADATA$ROW_ID")
+  except Exception as e:
+    # past the change tracking retention of the table
+    print(f"Change tracking of {{table_name}} not readable, reloading it in full: {{e}}")
+    return None
+
+def _apply_changes(spark, snapshot, changes, key_columns):
+  columns = [f"`{{column}}`" for column in changes.columns if column != SYNC_DELETED_COLUMN]
+  if not key_columns:
+    changes.select(*columns).write.format("delta").mode("append").saveAsTable(snapshot)
+    return
+  changes.createOrReplaceTempView("snowflake_changes")
+  condition = " AND ".join(f"t.`{{column}}` <=> s.`{{column}}`" for column in key_columns)
+  updates = ", ".join(f"t.{{column}} = s.{{column}}" for column in columns)
+  values = ", ".join(f"s.{{column}}" for column in columns)
+  spark.sql(f"MERGE INTO {{snapshot}} t USING snowflake_changes s ON {{condition}} "
+            f"WHEN MATCHED AND s.{{SYNC_DELETED_COLUMN}} THEN DELETE "
+            f"WHEN MATCHED THEN UPDATE SET {{updates}} "
+            f"WHEN NOT MATCHED AND NOT s.{{SYNC_DELETED_COLUMN}} THEN INSERT ({{', '.join(columns)}}) VALUES ({{values}})")
+
+def _sync_snapshot(spark, new_reader, table_name, sync):
+  snapshot = sync["snapshot"]
+  sync_started = None
+  if sync.get("change_tracking"):
+    # the end of this sync is the start of the next one, it is taken on the Snowflake clock
+    sync_started = new_reader().option("query", f"SELECT TO_VARCHAR(CURRENT_TIMESTAMP(), '{{SNOWFLAKE_TIMESTAMP_FORMAT}}') AS NOW").load().first()[0]
+
+  changes = None
+  if spark.catalog.tableExists(snapshot):
+    if sync.get("change_tracking"):
+      changes = _tracked_changes(spark, new_reader, table_name, snapshot, sync_started)
+    else:
+      changes = _watermark_changes(spark, new_reader, table_name, snapshot, sync)
+    # a column added in Snowflake is only picked up by a full reload
+    if changes is not None and not set(changes.columns) - {{SYNC_DELETED_COLUMN}} <= set(spark.table(snapshot).columns):
+      changes = None
+
+  if changes is None:
+    new_reader().option("dbtable", table_name).load().write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable(snapshot)
+  else:
+    _apply_changes(spark, snapshot, changes, sync.get("key_columns"))
+  if sync_started:
+    spark.sql(f"ALTER TABLE {{snapshot}} SET TBLPROPERTIES ('{{SYNC_PROPERTY}}' = '{{sync_started}}')")
+
+def sync_snowflake_table(spark, dbutils, database_name, schema_name, table_name, snowflake_connection, sync, partitions=None):
+  # Keeps a Delta snapshot of the table up to date with the rows changed since the last run and registers the snapshot
+  # in place of the table. sync: {{"snapshot", "key_columns", "watermark_column", "change_tracking"}}
+  spark.sql(f"CREATE SCHEMA IF NOT EXISTS {{sync['snapshot'].split('.', 1)[0]}}")
+  new_reader = lambda: _snowflake_reader(spark, dbutils, database_name, schema_name, snowflake_connection)
+  for attempt in range(SYNC_ATTEMPTS):
+    try:
+      _sync_snapshot(spark, new_reader, table_name, sync)
+      break
+    except Exception as e:
+      # the registration tasks of several clusters may sync the same snapshot, the changes are applied again on the new version
+      if attempt == SYNC_ATTEMPTS - 1 or "Concurrent" not in f"{{type(e).__name__}} {{e}}":
+        raise
+  df = spark.table(sync["snapshot"])
+  # the whole table is synced, only the partition of the run is registered
+  for column, parameter in (partitions or {{}}).items():
+    value = get_variables(dbutils, {{parameter: ""}})[0]
+    if value:
+      df = df.where(F.col(column.strip('"')) == value)
+  df.createOrReplaceGlobalTempView(table_name)
+
+def start_task_metrics(spark, dbutils, project_key, task_name, kind):
+  # Start of the instrumented part of a notebook, record_task_metrics appends its metrics to the metrics table
+  job_id, run_id = get_variables(dbutils, {{name: "" for name in METRICS_RUN_PARAMETERS}})
+  task_metrics = {{"job_id": job_id, "run_id": run_id, "project_key": project_key, "task_name": task_name, "kind": kind,
+                  "started_at": datetime.now(), "started": time.perf_counter(), "job_group": f"dataiku_migration_{{uuid.uuid4().hex}}"}}
+  track_task_metrics(spark, task_metrics)
+  return task_metrics
+
+def track_task_metrics(spark, task_metrics):
+  # Databricks gives every cell its own job group, the cells running Spark jobs put them back in the group of the task
+  if not task_metrics["job_group"]:
+    return
+  try:
+    spark.sparkContext.setJobGroup(task_metrics["job_group"], f"Dataiku migration {{task_metrics['task_name']}}")
+  except Exception:
+    # shared access mode clusters do not expose the SparkContext, only the wall time and the outputs are recorded
+    task_metrics["job_group"] = None
+
+def _stage_metrics(spark, job_group):
+  metrics = {{"spark_jobs": None, "stages": None, "tasks": None, "failed_tasks": None, **{{name: None for name in STAGE_METRICS.values()}}}}
+  if not job_group:
+    return metrics
+  sc = spark.sparkContext
+  tracker = sc.statusTracker()
+  job_ids = tracker.getJobIdsForGroup(job_group)
+  stage_ids = sorted({{stage_id for job_id in job_ids for stage_id in getattr(tracker.getJobInfo(job_id), "stageIds", None) or []}})
+  metrics.update(spark_jobs=len(job_ids), stages=len(stage_ids), tasks=0, failed_tasks=0)
+  for stage_id in stage_ids:
+    try:
+      # every attempt of the stage with its task metrics, from the REST API of the Spark UI on the driver
+      with urlopen(f"{{sc.uiWebUrl}}/api/v1/applications/{{sc.applicationId}}/stages/{{stage_id}}", timeout=10) as response:
+        attempts = json.load(response)
+    except Exception:
+      # without the UI only the task counts are known
+      stage_info = tracker.getStageInfo(stage_id)
+      if stage_info:
+        metrics["tasks"] += stage_info.numCompletedTasks
+        metrics["failed_tasks"] += stage_info.numFailedTasks
+      continue
+    for attempt in attempts:
+      metrics["tasks"] += attempt.get("numCompleteTasks", 0)
+      metrics["failed_tasks"] += attempt.get("numFailedTasks", 0)
+      for key, name in STAGE_METRICS.items():
+        metrics[name] = (metrics[name] or 0) + attempt.get(key, 0)
+  return metrics
+
+def _output_metrics(spark, output_locations, started_at):
+  # rows and bytes of the outputs written by the task, views are computed by their readers and only cached ones are counted
+  rows = size = None
+  for location in output_locations:
+    location_rows = location_bytes = None
+    try:
+      if location.startswith("global_temp."):
+        if spark.catalog.isCached(location):
+          location_rows = spark.table(location).count()
+      else:
+        for commit in spark.sql(f"DESCRIBE HISTORY {{location}} LIMIT 10").collect():
+          operation_metrics = commit["operationMetrics"] or {{}}
+          if commit["timestamp"] >= started_at and "numOutputRows" in operation_metrics:
+            location_rows = int(operation_metrics["numOutputRows"])
+            location_bytes = int(operation_metrics["numOutputBytes"]) if "numOutputBytes" in operation_metrics else None
+            break
+    except Exception as e:
+      print(f"Could not measure the output {{location}}: {{e}}")
+    if location_rows is not None:
+      rows = (rows or 0) + location_rows
+    if location_bytes is not None:
+      size = (size or 0) + location_bytes
+  return rows, size
+
+def record_task_metrics(spark, task_metrics, metrics_table, output_locations=()):
+  # Appends the metrics of the task to metrics_table, a metric that cannot be recorded never fails the task
+  wall_seconds = time.perf_counter() - task_metrics["started"]
+  try:
+    row = {{key: task_metrics[key] for key in ("job_id", "run_id", "project_key", "task_name", "kind", "started_at")}}
+    row["wall_seconds"] = round(wall_seconds, 3)
+    row.update(_stage_metrics(spark, task_metrics["job_group"]))
+    row["output_rows"], row["output_bytes"] = _output_metrics(spark, output_locations, task_metrics["started_at"])
+    spark.sql(f"CREATE SCHEMA IF NOT EXISTS {{metrics_table.rsplit('.', 1)[0]}}")
+    schema = ", ".join(f"{{name}} {{column_type}}" for name, column_type in RUNTIME_METRICS_COLUMNS)
+    (spark.createDataFrame([tuple(row[name] for name, _ in RUNTIME_METRICS_COLUMNS)], schema)
+      .write.format("delta").mode("append").option("mergeSchema", "true").saveAsTable(metrics_table))
+  except Exception as e:
+    print(f"Could not record the metrics of {{task_metrics['task_name']}}: {{e}}")
+
+def compare_runtime_metrics(spark, metrics_table, baseline, regression_threshold=0.5):
+  # Latest run of each task next to its previous run and to the last Dataiku build of its recipes.
+  # baseline: [{{"project_key", "task_name", "dataiku_seconds", "dataiku_records", "dataiku_bytes"}}]
+  from pyspark.sql import Window
+
+  keys = ["project_key", "task_name"]
+  baseline_df = spark.createDataFrame([tuple(entry.get(name) for name, _ in BASELINE_COLUMNS) for entry in baseline],
+                                      ", ".join(f"{{name}} {{column_type}}" for name, column_type in BASELINE_COLUMNS))
+  project_keys = sorted({{entry["project_key"] for entry in baseline}})
+  runs = (spark.table(metrics_table)
+    .where(F.col("project_key").isin(project_keys))
+    .withColumn("run_rank", F.row_number().over(Window.partitionBy(*keys).orderBy(F.col("started_at").desc())))
+  )
+  history = runs.groupBy(*keys).agg(F.count("*").alias("runs"), F.avg("wall_seconds").alias("average_wall_seconds"))
+  previous = runs.where("run_rank = 2").select(*keys, F.col("wall_seconds").alias("previous_wall_seconds"))
+  return (runs.where("run_rank = 1").drop("run_rank")
+    .join(baseline_df, keys, "full")
+    .join(history, keys, "left")
+    .join(previous, keys, "left")
+    .withColumn("speedup_vs_dataiku", F.round(F.col("dataiku_seconds") / F.col("wall_seconds"), 2))
+    .withColumn("change_vs_previous_run", F.round(F.col("wall_seconds") / F.col("previous_wall_seconds") - 1, 2))
+    .withColumn("regression", F.col("change_vs_previous_run") > regression_threshold)
+    .orderBy(F.col("regression").desc_nulls_last(), F.col("wall_seconds").desc_nulls_last())
+  )
+
+def pivot_table(df, identifiers, pivot_column, aggs, values=None):
+  
+  expr_list = [expr(f"{{fn['agg']}}({{fn['col']}}) AS {{fn['col']}}_{{fn['agg']}}") for fn in aggs if fn['col'] != '*']
+  expr_list += [expr(f"{{fn['agg']}}({{fn['col']}}) AS {{fn['agg']}}") for fn in aggs if fn['col'] == '*']
+  
+  # without values Spark runs an extra job to find the distinct values of the pivot column
+  df = (df
+    .groupBy(identifiers)
+    .pivot(pivot_column, values)
+    .agg(*expr_list)
+  )
+
+  if len(expr_list) == 1:
+    for column in df.columns:
+      if column not in identifiers+[pivot_column]:
+        agg = aggs[0]
+        if agg['col'] != '*':
+          df = df.withColumnRenamed(column, f"{{column}}_{{agg['col']}}_{{agg['agg']}}")
+        else: 
+          df = df.withColumnRenamed(column, f"{{column}}_{{agg['agg']}}")
   
-  def pivot_table(df, identifiers, pivot_column, aggs):
-    
-    expr_list = [expr(f"{{fn['agg']}}({{fn['col']}}) AS {{fn['col']}}_{{fn['agg']}}") for fn in aggs if fn['col'] != '*']
-    expr_list += [expr(f"{{fn['agg']}}({{fn['col']}})") for fn in aggs if fn['col'] == '*']
-    
-    df = (df
-      .groupBy(identifiers)
-      .pivot(pivot_column)
-      .agg(*expr_list)
-    )
-
-    if len(expr_list) == 1:
-      for column in df.columns:
-        if column not in identifiers+[pivot_column]:
-          agg = aggs[0]
-          if agg['col'] != '*':
-            df = df.withColumnRenamed(column, f"{{column}}_{{agg['col']}}_{{agg['agg']}}")
-          else: 
-            df = df.withColumnRenamed(column, f"{{column}}_{{agg['agg']}}")
-    
-    return df
-  """
-  write_to_local_path(payload, output_path)
-
-def create_pivot_notebook_from_recipe(recipe, dss_project, output_path):
+  return df
+
+def _conditional_agg_name(value, fn):
+  name = "null" if value is None else str(value)
+  if fn['col'] == '*':
+    return f"{{name}}_{{fn['agg']}}"
+  return f"{{name}}_{{fn['col']}}_{{fn['agg']}}"
+
+def _conditional_agg(pivot_column, value, fn, alias):
+  condition = F.col(pivot_column).eqNullSafe(F.lit(value))
+  if fn['col'] == '*':
+    return F.count(F.when(condition, F.lit(1))).alias(alias)
+  agg_function = getattr(F, AGG_FUNCTIONS.get(fn['agg'], fn['agg']))
+  column = F.when(condition, F.col(fn['col']))
+  # the other pivot values are nulls here, they must not be picked by first/last
+  aggregated = agg_function(column, ignorenulls=True) if fn['agg'] in ("first", "last") else agg_function(column)
+  return aggregated.alias(alias)
+
+def pivot_tables(df, identifiers, pivots):
+  # pivots: [{{"pivot_column", "values", "aggs"}}], values is None when the recipe does not list them
+  missing_columns = list(dict.fromkeys(pivot['pivot_column'] for pivot in pivots if pivot['values'] is None))
+  if missing_columns:
+    # a single scan finds the values of every pivot column that has none
+    distinct_values = df.agg(*[F.collect_set(column).alias(column) for column in missing_columns]).first()
+    pivots = [{{**pivot, "values": pivot['values'] if pivot['values'] is not None else sorted(distinct_values[pivot['pivot_column']])}}
+              for pivot in pivots]
+
+  # a block without values (an empty input) adds no column
+  pivots = [pivot for pivot in pivots if pivot['values']]
+  if not pivots:
+    return df.select(*identifiers).distinct()
+  if len(pivots) == 1:
+    return pivot_table(df, identifiers, pivots[0]['pivot_column'], pivots[0]['aggs'], pivots[0]['values'])
+
+  # several pivot blocks are computed in the same aggregation with one conditional aggregate per value,
+  # a column already produced by an earlier block gets the number of its block appended
+  aggregates = []
+  aliases = set()
+  for index, pivot in enumerate(pivots):
+    for value in pivot['values']:
+      for fn in pivot['aggs']:
+        alias = _conditional_agg_name(value, fn)
+        if alias in aliases:
+          alias = f"{{alias}}_{{index + 1}}"
+        aliases.add(alias)
+        aggregates.append(_conditional_agg(pivot['pivot_column'], value, fn, alias))
+  return df.groupBy(identifiers).agg(*aggregates)
+"""
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
+
+def get_pivot_values(pivot_details):
+  # the values Dataiku pivots on when they are listed in the recipe, None when they are computed from the data
+  if pivot_details.get("valueLimit") != "EXPLICIT":
+    return None
+  return list(pivot_details.get("explicitValues") or []) or None
+
+def create_pivot_notebook_from_recipe(recipe, dss_project, runtime_dir, output_path=None, materialization=None, table_locations=None, partitioning=None,
+                                      metrics_table=None):
   pivot_payload = recipe.get_settings().get_json_payload()
   identifiers = pivot_payload['explicitIdentifiers']
   
@@ -254,30 +1028,50 @@ def create_pivot_notebook_from_recipe(recipe, dss_project, output_path):
     input_table_name += f"{recipe.project_key}_"
   input_table_name += recipe_input_name
   
+  input_table_location = (table_locations or {}).get(input_table_name.lower(), f"global_temp.{input_table_name}")
   output_table_name = f"{recipe.project_key}_" + recipe.get_settings().get_flat_output_refs()[0]
 
+  input_table_df = f"spark.table('{input_table_location}')"
+  runtime_names = ["pivot_tables"]
+  if partitioning:
+    # like in Dataiku, only the input partitions the recipe depends on are pivoted
+    input_table_df = f"filter_partitions({input_table_df}, {partitioning['inputs'].get(recipe_input_name)}, {_partition_values_payload(partitioning)})"
+    runtime_names += ["get_variables", "filter_partitions", "write_partitions"]
+  output_location = materialization["location"] if materialization else f"global_temp.{output_table_name}"
+  metrics_start, metrics_track, metrics_record = _task_metrics_payloads(metrics_table, recipe.project_key, recipe.name, "pivot", [output_location])
+
   payload = f"""
-%run ./pivot
+{_runtime_import_payload(runtime_dir, runtime_names + _metrics_runtime_names(metrics_table))}
 # COMMAND ----------\n
-identifiers = {identifiers}
+identifiers = {identifiers}{metrics_start}
+"""
+  if partitioning:
+    payload += f"""
 # COMMAND ----------\n
-input_table_df = spark.sql(f'select * from global_temp.{input_table_name}')
+{_add_parameter_payload(_partition_variables({}, partitioning))}
+"""
+  payload += f"""
+# COMMAND ----------\n
+input_table_df = {input_table_df}
 """
 
+  pivots = []
   for pivot_details in pivot_payload['pivots']:
     aggs = [{"agg": vc["$agg"], "col":vc["column"]} for vc in pivot_details['valueColumns']]
     if not len(aggs):
       aggs = [{"agg": "count", "col": "*"}]
+    pivots.append({"pivot_column": pivot_details['keyColumns'][0], "values": get_pivot_values(pivot_details), "aggs": aggs})
 
-    payload += f"""
+  payload += f"""
 # COMMAND ----------\n
-pivot_column = '{pivot_details['keyColumns'][0]}'
-aggs = {aggs}
-df = pivot_table(input_table_df, identifiers, pivot_column, aggs)
+{metrics_track}pivots = {pivots}
+df = pivot_tables(input_table_df, identifiers, pivots)
 """
   payload += f"""
 # COMMAND ----------\n
-df.createOrReplaceGlobalTempView('{output_table_name}')
+{metrics_track}{_write_output_payload("df", output_table_name, materialization, partitioning=partitioning)}{metrics_record}
 """
 
-  write_to_local_path(payload, output_path)
+  if output_path:
+    write_to_local_path(payload, output_path)
+  return payload
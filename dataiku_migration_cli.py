@@ -0,0 +1,71 @@
+import sys
+import json
+import argparse
+
+from migration_pipeline import load_settings, load_migration_manifest, validate_migrations, migrate_zones
+
+def _load(args):
+  settings = load_settings(args.config)
+  migrations = load_migration_manifest(args.manifest)
+  if args.only:
+    migrations = [migration for migration in migrations if f"{migration['project']}/{migration['zone']}" in args.only]
+  return settings, migrations
+
+def validate_command(args):
+  settings, migrations = _load(args)
+  errors = validate_migrations(migrations, settings)
+  for error in errors:
+    print(error)
+  print(f"{len(migrations)} migrations, {len(errors)} errors")
+  return 1 if errors else 0
+
+def list_command(args):
+  _, migrations = _load(args)
+  for migration in migrations:
+    overrides = f" (overrides {', '.join(sorted(migration['settings']))})" if migration["settings"] else ""
+    print(f"{migration['project']}/{migration['zone']}: {len(migration['entry_recipes'])} entry recipes{overrides}")
+  return 0
+
+def migrate_command(args):
+  settings, migrations = _load(args)
+  errors = validate_migrations(migrations, settings)
+  if errors:
+    for error in errors:
+      print(error)
+    return 1
+
+  results = migrate_zones(migrations, settings, zone_workers=args.zone_workers)
+  for result in results:
+    status = f"job {result['job_id']}" if "error" not in result else f"FAILED: {result['error']}"
+    print(f"{result['project']}/{result['zone']}: {status}")
+  if args.results:
+    with open(args.results, 'w') as fh:
+      json.dump(results, fh, indent=2, default=str)
+  return 1 if any("error" in result for result in results) else 0
+
+def build_parser():
+  parser = argparse.ArgumentParser(description="Migrate Dataiku project zones to Databricks jobs")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  commands = {
+    "validate": (validate_command, "Check the migration manifest and the settings without calling any API"),
+    "list": (list_command, "List the zones of the migration manifest"),
+    "migrate": (migrate_command, "Migrate every zone of the migration manifest"),
+  }
+  for name, (command, help_text) in commands.items():
+    subparser = subparsers.add_parser(name, help=help_text)
+    subparser.add_argument("manifest", help="JSON file listing the project, zone and entry recipes of each migration")
+    subparser.add_argument("--config", help="JSON file overriding the settings of config_properties.py")
+    subparser.add_argument("--only", nargs="+", help="Only these zones, as project/zone")
+    subparser.set_defaults(func=command)
+    if name == "migrate":
+      subparser.add_argument("--zone-workers", type=int, help="Zones migrated concurrently")
+      subparser.add_argument("--results", help="Write the job id or the error of each zone to this JSON file")
+  return parser
+
+def main(argv=None):
+  args = build_parser().parse_args(argv)
+  return args.func(args)
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,111 @@
+from dataiku_helper import get_runnable_recipes, get_computable_datasets, get_source_datasets
+
+DEFAULT_ZONE_ID = "default"
+
+class FlowIndex:
+  def __init__(self, project_key, recipes, datasets, zones):
+    self.project_key = project_key
+    self.recipes = recipes
+    self.datasets = datasets
+    self.zones = zones
+
+  def has_recipe(self, recipe_name):
+    return recipe_name in self.recipes
+
+  def get_recipe(self, recipe_name):
+    if recipe_name not in self.recipes:
+      raise Exception(f"Recipe {recipe_name} not found in the flow of {self.project_key}")
+    return self.recipes[recipe_name]
+
+  def get_dataset(self, dataset_name):
+    return self.datasets.get(dataset_name)
+
+  def get_recipe_type(self, recipe_name):
+    return self.get_recipe(recipe_name)["type"]
+
+  def get_recipe_zone(self, recipe_name):
+    return self.get_recipe(recipe_name)["zone"]
+
+  def get_zone_recipes(self, zone_name):
+    return list(self.zones.get(zone_name, []))
+
+  def get_upstream_recipes(self, recipe_name):
+    upstream_recipes = []
+    for dataset_name in self.get_recipe(recipe_name)["inputs"]:
+      dataset = self.datasets.get(dataset_name)
+      if dataset and dataset["managed"]:
+        upstream_recipes += [name for name in dataset["producers"] if name not in upstream_recipes]
+    return upstream_recipes
+
+  def get_downstream_recipes(self, recipe_name):
+    downstream_recipes = []
+    for dataset_name in self.get_recipe(recipe_name)["outputs"]:
+      dataset = self.datasets.get(dataset_name)
+      if dataset:
+        downstream_recipes += [name for name in dataset["consumers"] if name not in downstream_recipes]
+    return downstream_recipes
+
+  def get_cross_zone_upstream_recipes(self, recipe_name):
+    zone = self.get_recipe_zone(recipe_name)
+    return [name for name in self.get_upstream_recipes(recipe_name) if self.recipes[name]["zone"] != zone]
+
+  def get_recipe_source_datasets(self, recipe_name):
+    recipe = self.get_recipe(recipe_name)
+    input_datasets = [self.datasets[name]["raw"] for name in recipe["inputs"] if name in self.datasets]
+    return get_source_datasets(input_datasets, recipe["outputs"], recipe["type"], self.project_key)
+
+def _get_zone_membership(dss_flow):
+  zone_names = {}
+  object_zones = {}
+  for zone in dss_flow.list_zones():
+    zone_names[zone.id] = zone.name
+    for item in zone.items:
+      if hasattr(item, "recipe_name"):
+        object_zones[("RECIPE", item.recipe_name)] = zone.name
+      elif hasattr(item, "dataset_name"):
+        object_zones[("DATASET", item.dataset_name)] = zone.name
+
+  return zone_names.get(DEFAULT_ZONE_ID, "Default"), object_zones
+
+def build_flow_index(dss_project):
+  dss_flow = dss_project.get_flow()
+  nodes = dss_flow.get_graph().nodes
+  default_zone, object_zones = _get_zone_membership(dss_flow)
+  recipe_items = {item["name"]: item for item in dss_project.list_recipes()}
+  dataset_items = {item["name"]: dict(item) for item in dss_project.list_datasets()}
+
+  def node_ref(node_id):
+    return nodes[node_id]["ref"] if node_id in nodes else node_id
+
+  datasets = {}
+  for node in get_computable_datasets(nodes.values()):
+    raw = dataset_items.get(node["name"])
+    if raw is None:
+      # foreign (shared) datasets are not part of this project's definitions
+      continue
+    datasets[node["name"]] = {
+      "name": node["name"],
+      "type": raw["type"],
+      "managed": raw["managed"],
+      "zone": object_zones.get(("DATASET", node["name"]), default_zone),
+      "producers": [node_ref(pre) for pre in node["pre"]],
+      "consumers": [node_ref(suc) for suc in node["sucs"]],
+      "raw": raw,
+    }
+
+  recipes = {}
+  zones = {}
+  for node in get_runnable_recipes(nodes.values()):
+    item = recipe_items.get(node["name"], {})
+    zone = object_zones.get(("RECIPE", node["name"]), default_zone)
+    recipes[node["name"]] = {
+      "name": node["name"],
+      "type": item.get("type"),
+      "zone": zone,
+      "inputs": [node_ref(pre) for pre in node["pre"]],
+      "outputs": [node_ref(suc) for suc in node["sucs"]],
+      "version": item.get("versionTag", {}).get("versionNumber"),
+    }
+    zones.setdefault(zone, []).append(node["name"])
+
+  return FlowIndex(dss_project.project_key, recipes, datasets, zones)
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+def new_recipe_obj(recipe):
+  return {"recipe":recipe, "source_snowflake": False, "source_uploaded": False, "upstream_recipes": {}}
+
+def _link_upstream_recipes(recipe_obj, upstream_recipe_names, recipes_list, recipes_map, get_recipe):
+  new_recipe_objs = []
+  for upstream_recipe_name in upstream_recipe_names:
+    if upstream_recipe_name in recipes_map:
+      upstream_recipe_obj = recipes_map[upstream_recipe_name]
+    else:
+      upstream_recipe_obj = new_recipe_obj(get_recipe(upstream_recipe_name))
+      recipes_map[upstream_recipe_name] = upstream_recipe_obj
+      recipes_list.append(upstream_recipe_obj)
+      new_recipe_objs.append(upstream_recipe_obj)
+    recipe_obj["upstream_recipes"].setdefault(upstream_recipe_name, upstream_recipe_obj)
+  return new_recipe_objs
+
+def traverse_recipes(recipes_list, recipes_map, get_recipe, visit_recipe, max_workers=1):
+  # visit_recipe(recipe_obj) runs on the workers and returns the upstream recipe names,
+  # the frontier and recipes_map are only ever touched from the calling thread
+  if max_workers <= 1:
+    for recipe_obj in recipes_list:
+      _link_upstream_recipes(recipe_obj, visit_recipe(recipe_obj), recipes_list, recipes_map, get_recipe)
+    return recipes_list
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    frontier = {executor.submit(visit_recipe, recipe_obj): recipe_obj for recipe_obj in list(recipes_list)}
+    while frontier:
+      done, _ = wait(frontier, return_when=FIRST_COMPLETED)
+      for future in done:
+        recipe_obj = frontier.pop(future)
+        for upstream_recipe_obj in _link_upstream_recipes(recipe_obj, future.result(), recipes_list, recipes_map, get_recipe):
+          frontier[executor.submit(visit_recipe, upstream_recipe_obj)] = upstream_recipe_obj
+
+  return recipes_list
@@ -0,0 +1,128 @@
+def _task_dependencies(tasks):
+  dependencies = {}
+  for task in tasks:
+    task_dependencies = dependencies.setdefault(task["task_key"], [])
+    for dependency in task.get("depends_on", []):
+      if dependency["task_key"] not in task_dependencies:
+        task_dependencies.append(dependency["task_key"])
+
+  for task_key, task_dependencies in dependencies.items():
+    for dependency in task_dependencies:
+      if dependency not in dependencies:
+        raise Exception(f"Task {task_key} depends on unknown task {dependency}")
+  return dependencies
+
+def find_cycle(dependencies):
+  state = {}
+  for start in dependencies:
+    if start in state:
+      continue
+    path = []
+    stack = [(start, iter(dependencies[start]))]
+    state[start] = "visiting"
+    path.append(start)
+    while stack:
+      task_key, remaining = stack[-1]
+      dependency = next(remaining, None)
+      if dependency is None:
+        stack.pop()
+        path.pop()
+        state[task_key] = "done"
+      elif state.get(dependency) == "visiting":
+        return path[path.index(dependency):] + [dependency]
+      elif dependency not in state:
+        state[dependency] = "visiting"
+        path.append(dependency)
+        stack.append((dependency, iter(dependencies[dependency])))
+  return None
+
+def topological_order(dependencies):
+  cycle = find_cycle(dependencies)
+  if cycle:
+    raise Exception(f"Cycle detected in the job tasks: {' -> '.join(cycle)}")
+
+  dependents = {task_key: [] for task_key in dependencies}
+  remaining = {}
+  for task_key, task_dependencies in dependencies.items():
+    remaining[task_key] = len(task_dependencies)
+    for dependency in task_dependencies:
+      dependents[dependency].append(task_key)
+
+  order = [task_key for task_key, count in remaining.items() if count == 0]
+  for task_key in order:
+    for dependent in dependents[task_key]:
+      remaining[dependent] -= 1
+      if remaining[dependent] == 0:
+        order.append(dependent)
+  return order
+
+def transitive_reduction(dependencies):
+  order = topological_order(dependencies)
+  bits = {task_key: 1 << position for position, task_key in enumerate(order)}
+  ancestors = {}
+  reduced = {}
+  for task_key in order:
+    task_dependencies = dependencies[task_key]
+    reachable = {dependency: ancestors[dependency] for dependency in task_dependencies}
+    reduced[task_key] = [dependency for dependency in task_dependencies
+                         if not any(reachable[other] & bits[dependency] for other in task_dependencies if other != dependency)]
+    ancestors[task_key] = 0
+    for dependency in task_dependencies:
+      ancestors[task_key] |= bits[dependency] | ancestors[dependency]
+  return reduced
+
+def optimize_job_tasks(tasks):
+  dependencies = _task_dependencies(tasks)
+  reduced = transitive_reduction(dependencies)
+
+  optimized_tasks = []
+  removed_edges = []
+  for task in tasks:
+    kept = reduced[task["task_key"]]
+    removed_edges += [(dependency, task["task_key"]) for dependency in dependencies[task["task_key"]] if dependency not in kept]
+    optimized_tasks.append({**task, "depends_on": [{"task_key": dependency} for dependency in kept]})
+  return optimized_tasks, removed_edges
+
+def critical_path_report(tasks, durations=None):
+  # durations maps task keys to an estimated run time, every task weighs 1 without it
+  durations = durations or {}
+  dependencies = _task_dependencies(tasks)
+  order = topological_order(dependencies)
+
+  finish = {}
+  previous = {}
+  level = {}
+  for task_key in order:
+    start = 0
+    level[task_key] = 0
+    previous[task_key] = None
+    for dependency in dependencies[task_key]:
+      level[task_key] = max(level[task_key], level[dependency] + 1)
+      if finish[dependency] > start:
+        start = finish[dependency]
+        previous[task_key] = dependency
+    finish[task_key] = start + durations.get(task_key, 1)
+
+  critical_path = []
+  task_key = max(finish, key=finish.get) if finish else None
+  while task_key is not None:
+    critical_path.append(task_key)
+    task_key = previous[task_key]
+  critical_path.reverse()
+
+  width = {}
+  for task_level in level.values():
+    width[task_level] = width.get(task_level, 0) + 1
+
+  total_work = sum(durations.get(task_key, 1) for task_key in order)
+  critical_path_length = finish[critical_path[-1]] if critical_path else 0
+  return {
+    "task_count": len(order),
+    "edge_count": sum(len(task_dependencies) for task_dependencies in dependencies.values()),
+    "critical_path": critical_path,
+    "critical_path_length": critical_path_length,
+    "total_work": total_work,
+    "levels": len(width),
+    "max_parallelism": max(width.values()) if width else 0,
+    "average_parallelism": round(total_work / critical_path_length, 2) if critical_path_length else 0,
+  }
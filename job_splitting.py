@@ -0,0 +1,152 @@
+from job_optimizer import topological_order
+
+# Databricks rejects jobs with more tasks than this
+DEFAULT_MAX_TASKS_PER_JOB = 1000
+
+def _components(dependencies):
+  # weakly connected components, largest first, no dependency ever crosses two of them
+  parent = {name: name for name in dependencies}
+
+  def find(name):
+    while parent[name] != name:
+      parent[name] = parent[parent[name]]
+      name = parent[name]
+    return name
+
+  for name, upstream_names in dependencies.items():
+    for upstream_name in upstream_names:
+      parent[find(upstream_name)] = find(name)
+  components = {}
+  for name in dependencies:
+    components.setdefault(find(name), []).append(name)
+  return sorted(components.values(), key=len, reverse=True)
+
+def _local_order(dependencies, names):
+  # topological order following each chain as far as it goes, so that neighbours in the order are mostly connected
+  dependents = {name: [] for name in names}
+  remaining = {}
+  for name in names:
+    remaining[name] = len(dependencies[name])
+    for upstream_name in dependencies[name]:
+      dependents[upstream_name].append(name)
+  ready = [name for name in reversed(names) if remaining[name] == 0]
+  order = []
+  while ready:
+    name = ready.pop()
+    order.append(name)
+    for dependent in reversed(dependents[name]):
+      remaining[dependent] -= 1
+      if remaining[dependent] == 0:
+        ready.append(dependent)
+  return order
+
+def _crossing_edges(order, dependencies):
+  # crossing[p]: dependencies cut when the jobs are split before order[p]
+  position = {name: index for index, name in enumerate(order)}
+  delta = [0] * (len(order) + 2)
+  for name, upstream_names in dependencies.items():
+    for upstream_name in upstream_names:
+      delta[position[upstream_name] + 1] += 1
+      delta[position[name] + 1] -= 1
+  crossing = []
+  count = 0
+  for index in range(len(order) + 1):
+    count += delta[index]
+    crossing.append(count)
+  return crossing
+
+def plan_job_split(dependencies, registration_keys, max_tasks=None):
+  # Cuts the recipe tasks into sub-jobs of at most max_tasks tasks, their source registration tasks included.
+  # dependencies: {recipe: [upstream recipes]}, registration_keys: {recipe: registration tasks it needs}.
+  # The sub-jobs are consecutive slices of a topological order, so they only depend on earlier ones, and each cut is
+  # placed where the fewest dependencies cross it. Returns {recipe: sub-job index}
+  max_tasks = max_tasks or DEFAULT_MAX_TASKS_PER_JOB
+  if max_tasks < 2:
+    raise Exception(f"max_tasks_per_job must be at least 2, got {max_tasks}")
+  # a cycle is reported here with the recipes involved
+  topological_order(dependencies)
+
+  order = [name for component in _components(dependencies) for name in _local_order(dependencies, component)]
+  crossing = _crossing_edges(order, dependencies)
+  assignment = {}
+  start = 0
+  part = 0
+  while start < len(order):
+    keys = set()
+    end = start
+    while end < len(order):
+      next_keys = keys | set(registration_keys.get(order[end], ()))
+      if end > start and end - start + 1 + len(next_keys) > max_tasks:
+        break
+      keys = next_keys
+      end += 1
+    if end < len(order):
+      # the sub-job is filled at least by half, the cut with the fewest crossing dependencies wins
+      end = min(range(start + max(1, (end - start) // 2), end + 1), key=lambda position: (crossing[position], -position))
+    for name in order[start:end]:
+      assignment[name] = part
+    start = end
+    part += 1
+  return assignment
+
+def get_cross_job_outputs(assignment, dependencies):
+  # outputs read in another sub-job, the temp views of a job run are not visible to the others
+  return {upstream_name for name, upstream_names in dependencies.items() for upstream_name in upstream_names
+          if assignment[upstream_name] != assignment[name]}
+
+def get_sub_job_dependencies(assignment, dependencies):
+  sub_job_dependencies = {index: set() for index in set(assignment.values())}
+  for name, upstream_names in dependencies.items():
+    for upstream_name in upstream_names:
+      if assignment[upstream_name] != assignment[name]:
+        sub_job_dependencies[assignment[name]].add(assignment[upstream_name])
+  return {index: sorted(upstream_indexes) for index, upstream_indexes in sub_job_dependencies.items()}
+
+def split_job_tasks(tasks, assignment):
+  # Tasks of each sub-job. Registration tasks are repeated in every sub-job that waits on them, the ones nobody waits on
+  # go to the smallest one. Dependencies on tasks of another sub-job are dropped, the parent job orders the sub-jobs
+  sub_job_count = len(set(assignment.values())) or 1
+  task_parts = {task["task_key"]: assignment[task["task_key"]] for task in tasks if task["task_key"] in assignment}
+  registration_parts = {}
+  for task in tasks:
+    if task["task_key"] in task_parts:
+      for dependency in task.get("depends_on", []):
+        if dependency["task_key"] not in assignment:
+          registration_parts.setdefault(dependency["task_key"], set()).add(task_parts[task["task_key"]])
+
+  sub_jobs = [[] for _ in range(sub_job_count)]
+  unused_registrations = []
+  for task in tasks:
+    if task["task_key"] in task_parts:
+      part = task_parts[task["task_key"]]
+      sub_jobs[part].append({**task, "depends_on": [dependency for dependency in task.get("depends_on", [])
+                                                   if task_parts.get(dependency["task_key"], part) == part]})
+    elif task["task_key"] in registration_parts:
+      for part in sorted(registration_parts[task["task_key"]]):
+        sub_jobs[part].append(task)
+    else:
+      unused_registrations.append(task)
+  min(sub_jobs, key=len).extend(unused_registrations)
+  return sub_jobs
+
+def job_split_summary(sub_jobs, sub_job_dependencies, cross_job_outputs):
+  return {
+    "jobs": len(sub_jobs),
+    "tasks_per_job": [len(tasks) for tasks in sub_jobs],
+    "cross_job_outputs": len(cross_job_outputs),
+    "sub_job_dependencies": {index: upstream_indexes for index, upstream_indexes in sub_job_dependencies.items() if upstream_indexes},
+  }
+
+def sub_job_task_key(index):
+  return f"part_{index + 1}"
+
+def get_orchestration_tasks(sub_job_ids, sub_job_dependencies, parameters):
+  # Tasks of the parent job of a split zone, one run_job task per sub-job. The parameters of the run are passed on
+  job_parameters = {parameter["name"]: f"{{{{job.parameters.{parameter['name']}}}}}" for parameter in parameters}
+  return [{
+    "task_key": sub_job_task_key(index),
+    "depends_on": [{"task_key": sub_job_task_key(upstream_index)} for upstream_index in sub_job_dependencies.get(index, [])],
+    "run_job_task": {"job_id": job_id, "job_parameters": job_parameters},
+    "timeout_seconds": 0,
+    "description": f"Run sub-job {index + 1} of {len(sub_job_ids)}",
+  } for index, job_id in enumerate(sub_job_ids)]
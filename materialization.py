@@ -0,0 +1,47 @@
+from sql_rewrite import GLOBAL_TEMP_DATABASE
+
+VIEW = "view"
+CACHE = "cache"
+DELTA = "delta"
+
+# recipe types whose output code is generated by the migration, the others publish their own outputs
+PLANNED_RECIPE_TYPES = ("sql_query", "pivot")
+
+def choose_materialization(recipe_type, fan_out, cache_fan_out=2, delta_fan_out=3):
+  # a view is recomputed by each reader: fine for a single reader, wasteful beyond.
+  # A fan-out of None turns the cache or the Delta tables off
+  if recipe_type not in PLANNED_RECIPE_TYPES:
+    return VIEW
+  # pivot outputs are aggregates, small enough to stay cached whatever the number of readers
+  if recipe_type != "pivot" and delta_fan_out is not None and fan_out >= delta_fan_out:
+    return DELTA
+  if cache_fan_out is not None and fan_out >= cache_fan_out:
+    return CACHE
+  return VIEW
+
+def plan_materializations(recipes_map, flow_index, cache_fan_out=2, delta_fan_out=3, materialization_schema="dataiku_migration", forced_delta=()):
+  plan = {}
+  for recipe_name in recipes_map:
+    recipe = flow_index.get_recipe(recipe_name)
+    # only the migrated readers count, the others never run on Databricks
+    readers = [name for name in flow_index.get_downstream_recipes(recipe_name) if name in recipes_map]
+    materialization = DELTA if recipe_name in forced_delta else choose_materialization(recipe["type"], len(readers), cache_fan_out, delta_fan_out)
+    table_name = f"{flow_index.project_key}_{recipe['outputs'][0]}"
+    database_name = materialization_schema if materialization == DELTA else GLOBAL_TEMP_DATABASE
+    plan[recipe_name] = {
+      "materialization": materialization,
+      "table_name": table_name,
+      "location": f"{database_name}.{table_name}",
+      "fan_out": len(readers),
+    }
+  return plan
+
+def get_table_locations(plan):
+  # only the outputs that moved out of global_temp, keyed like the rewrite rules look them up
+  return {entry["table_name"].lower(): entry["location"] for entry in plan.values() if entry["materialization"] == DELTA}
+
+def materialization_summary(plan):
+  summary = {VIEW: 0, CACHE: 0, DELTA: 0}
+  for entry in plan.values():
+    summary[entry["materialization"]] += 1
+  return summary
@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+
+from dataiku_helper import mkdir_local
+
+# Bump whenever the generated notebook code changes, so every recipe is regenerated once
+GENERATOR_VERSION = 11
+
+def content_hash(*parts):
+  return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def recipe_source_hash(recipe, variables, flow_index):
+  input_datasets = [flow_index.get_dataset(name) for name in flow_index.get_recipe(recipe.name)["inputs"]]
+  return content_hash(GENERATOR_VERSION,
+                      recipe.get_settings().data,
+                      variables,
+                      [dataset["raw"] for dataset in input_datasets if dataset])
+
+class MigrationManifest:
+  def __init__(self, path, data=None):
+    self.path = path
+    data = data or {}
+    self.job_id = data.get("job_id")
+    self.recipes = data.get("recipes", {})
+    self.notebooks = data.get("notebooks", {})
+    self.files = data.get("files", {})
+    self.tasks = data.get("tasks", {})
+    self.job_clusters = data.get("job_clusters", {})
+    self.job_parameters = data.get("job_parameters")
+    # jobs of a zone split in several sub-jobs, the zone job then only runs them
+    self.sub_jobs = {job_name: MigrationManifest(None, sub_job) for job_name, sub_job in data.get("sub_jobs", {}).items()}
+
+  @classmethod
+  def load(cls, path):
+    if not os.path.exists(path):
+      return cls(path)
+    with open(path) as fh:
+      return cls(path, json.load(fh))
+
+  def is_recipe_unchanged(self, recipe_name, source_hash):
+    return self.recipes.get(recipe_name, {}).get("source_hash") == source_hash
+
+  def get_removed_recipes(self, recipe_names):
+    return [name for name in self.recipes if name not in recipe_names]
+
+  def skip_unchanged_outputs(self, workspace_output):
+    for relative_path, payload in list(workspace_output.notebooks.items()):
+      if self.notebooks.get(relative_path) == content_hash(payload):
+        del workspace_output.notebooks[relative_path]
+    for relative_path, content in list(workspace_output.files.items()):
+      if self.files.get(relative_path) == hashlib.sha256(content).hexdigest():
+        del workspace_output.files[relative_path]
+
+  def record_outputs(self, workspace_output):
+    for relative_path, payload in workspace_output.notebooks.items():
+      self.notebooks[relative_path] = content_hash(payload)
+    for relative_path, content in workspace_output.files.items():
+      self.files[relative_path] = hashlib.sha256(content).hexdigest()
+
+  def forget_notebook(self, relative_path):
+    self.notebooks.pop(relative_path, None)
+
+  def _diff(self, recorded, items, key):
+    hashes = {item[key]: content_hash(item) for item in items}
+    changed_items = [item for item in items if recorded.get(item[key]) != hashes[item[key]]]
+    removed_keys = [item_key for item_key in recorded if item_key not in hashes]
+    return changed_items, removed_keys
+
+  def diff_tasks(self, tasks):
+    return self._diff(self.tasks, tasks, "task_key")
+
+  def diff_job_clusters(self, job_clusters):
+    return self._diff(self.job_clusters, job_clusters, "job_cluster_key")
+
+  def is_job_parameters_unchanged(self, parameters):
+    return self.job_parameters == content_hash(parameters)
+
+  def record_job(self, job_id, tasks, job_clusters, parameters=None):
+    self.job_id = job_id
+    self.job_parameters = content_hash(parameters or [])
+    self.tasks = {task["task_key"]: content_hash(task) for task in tasks}
+    self.job_clusters = {job_cluster["job_cluster_key"]: content_hash(job_cluster) for job_cluster in job_clusters}
+
+  def get_sub_job(self, job_name):
+    return self.sub_jobs.setdefault(job_name, MigrationManifest(None))
+
+  def _job_state(self):
+    return {
+      "job_id": self.job_id,
+      "tasks": self.tasks,
+      "job_clusters": self.job_clusters,
+      "job_parameters": self.job_parameters,
+    }
+
+  def save(self):
+    mkdir_local(os.path.dirname(self.path))
+    tmp_path = self.path + ".tmp"
+    with open(tmp_path, 'w') as fh:
+      json.dump({
+        "job_id": self.job_id,
+        "recipes": self.recipes,
+        "notebooks": self.notebooks,
+        "files": self.files,
+        "tasks": self.tasks,
+        "job_clusters": self.job_clusters,
+        "job_parameters": self.job_parameters,
+        "sub_jobs": {job_name: sub_job._job_state() for job_name, sub_job in self.sub_jobs.items()},
+      }, fh, indent=2)
+    os.replace(tmp_path, self.path)
+
+def delete_job(w, job_id):
+  from databricks.sdk.errors import NotFound
+
+  try:
+    w.jobs.delete(job_id)
+    print(f"Deleted job {job_id}")
+  except NotFound:
+    pass
+
+def create_or_update_job(w, manifest, job_name, all_tasks, job_cluster_dicts, incremental=True, parameters=None):
+  from databricks.sdk.errors import NotFound
+  from databricks.sdk.service import jobs
+
+  parameters = parameters or []
+  job_id = manifest.job_id if incremental else None
+  if job_id is not None:
+    changed_tasks, removed_task_keys = manifest.diff_tasks(all_tasks)
+    changed_job_clusters, removed_job_cluster_keys = manifest.diff_job_clusters(job_cluster_dicts)
+    fields_to_remove = [f"tasks/{task_key}" for task_key in removed_task_keys]
+    fields_to_remove += [f"job_clusters/{job_cluster_key}" for job_cluster_key in removed_job_cluster_keys]
+    parameters_changed = not manifest.is_job_parameters_unchanged(parameters)
+    if parameters_changed and not parameters:
+      fields_to_remove.append("parameters")
+    try:
+      if changed_tasks or changed_job_clusters or fields_to_remove or parameters_changed:
+        # tasks and job clusters are merged by key, only the changed ones are sent. The other top-level fields, parameters
+        # included, are replaced as a whole: any change sends the full list, a dropped parameter is gone with it
+        w.jobs.update(job_id,
+                      new_settings=jobs.JobSettings(name=job_name,
+                                                    tasks=[jobs.Task.from_dict(task) for task in changed_tasks],
+                                                    job_clusters=[jobs.JobCluster.from_dict(job_cluster) for job_cluster in changed_job_clusters],
+                                                    parameters=[jobs.JobParameterDefinition.from_dict(parameter) for parameter in parameters] if parameters_changed and parameters else None),
+                      fields_to_remove=fields_to_remove)
+        print(f"Updated job {job_id}: {len(changed_tasks)} changed tasks, {len(removed_task_keys)} removed tasks")
+      else:
+        print(f"Job {job_id} is up to date")
+    except NotFound:
+      print(f"Job {job_id} no longer exists, creating a new one")
+      job_id = None
+
+  if job_id is None:
+    created_job = w.jobs.create(name=job_name,
+                                tasks=[jobs.Task.from_dict(task) for task in all_tasks],
+                                job_clusters=[jobs.JobCluster.from_dict(job_cluster) for job_cluster in job_cluster_dicts],
+                                parameters=[jobs.JobParameterDefinition.from_dict(parameter) for parameter in parameters])
+    job_id = created_job.job_id
+    print(f"Final Job {created_job}")
+
+  manifest.record_job(job_id, all_tasks, job_cluster_dicts, parameters)
+  return job_id
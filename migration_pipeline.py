@@ -0,0 +1,841 @@
+import os
+import json
+import time
+import functools
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dataiku_helper import *
+from flow_traversal import new_recipe_obj, traverse_recipes
+from workspace_output import WorkspaceOutput
+from migration_manifest import MigrationManifest, content_hash, recipe_source_hash, create_or_update_job, delete_job
+from job_optimizer import optimize_job_tasks, critical_path_report
+from migration_profile import MigrationProfile
+
+# Settings read from config_properties (or a JSON file for the command line), every zone can override them
+SETTING_NAMES = (
+  "dataiku_uri", "dataiku_token", "dbx_uri", "dbx_token", "dbx_output_dir", "local_output_root",
+  "dump_local_notebooks", "workspace_import_mode",
+  "metadata_cache_dir", "metadata_cache_ttl_seconds", "traversal_workers", "dataiku_max_calls_per_second",
+  "incremental_migration", "migration_manifest_dir", "transpile_cache_dir", "transpile_workers",
+  "snowflake_registration_mode", "snowflake_registration_group_size", "snowflake_pushdown",
+  "snowflake_source_sync", "snowflake_snapshot_schema",
+  "materialization_cache_fan_out", "materialization_delta_fan_out", "materialization_schema",
+  "uploaded_files_format", "snowflake_connection", "sql_fusion", "sql_lint", "sql_lint_fail_severity", "partition_processing", "job_clusters",
+  "cluster_sizing", "cluster_tiers", "max_tasks_per_job", "zone_workers", "runtime_metrics", "runtime_metrics_table",
+  "profile_output_dir", "profile_progress",
+)
+# Helper notebooks run with %run before the runtime module replaced them
+LEGACY_NOTEBOOKS = ("config", "transformations/pivot")
+REQUIRED_SETTINGS = ("dataiku_uri", "dataiku_token", "dbx_uri", "dbx_token", "dbx_output_dir")
+
+# Task registering the uploaded files of the zone
+UPLOADED_SOURCE_TASK_KEY = "REGISTER_UPLOADED_SOURCE_DATASETS"
+
+def snowflake_task_key(group_name):
+  return to_task_key(f"REGISTER_SNOWFLAKE_{group_name}")
+
+# Single worker cluster shared by every task: the global temp views only live on the cluster that created them
+DEFAULT_JOB_CLUSTER_KEY = "one_worker"
+DEFAULT_JOB_CLUSTERS = [
+    {
+        "job_cluster_key": DEFAULT_JOB_CLUSTER_KEY,
+        "new_cluster": {
+            "spark_version": "12.2.x-scala2.12",
+            "spark_conf": {
+                "spark.databricks.delta.preview.enabled": "true",
+                "spark.sql.caseSensitive": "true"
+            },
+            "node_type_id": "c4.2xlarge",
+            "custom_tags": {"ResourceClass": "SingleNode"},
+            "data_security_mode": "SINGLE_USER",
+            "runtime_engine": "STANDARD",
+            "aws_attributes":{
+              "ebs_volume_type":"GENERAL_PURPOSE_SSD",
+              "ebs_volume_count": 1,
+              "ebs_volume_size": 100
+            },
+            ## Seems theres a bug that won't allow for single node clusters
+            "num_workers": 1,
+        },
+    }
+]
+
+def settings_from_namespace(namespace):
+  return {name: namespace[name] for name in SETTING_NAMES if name in namespace}
+
+def load_settings(path=None):
+  # config_properties is a notebook, outside Databricks it is imported as a plain module
+  import config_properties
+  settings = settings_from_namespace(vars(config_properties))
+  if path:
+    with open(path) as fh:
+      settings.update(json.load(fh))
+  return settings
+
+def load_migration_manifest(path):
+  with open(path) as fh:
+    data = json.load(fh)
+  migrations = data["migrations"] if isinstance(data, dict) else data
+  return [{
+    "project": migration["project"],
+    "zone": migration["zone"],
+    "entry_recipes": migration.get("entry_recipes", []),
+    "settings": migration.get("settings", {}),
+  } for migration in migrations]
+
+def validate_migrations(migrations, settings):
+  errors = []
+  for name in REQUIRED_SETTINGS:
+    if not settings.get(name):
+      errors.append(f"Missing setting {name}")
+
+  seen = set()
+  for migration in migrations:
+    zone_key = (migration["project"], migration["zone"])
+    if not migration["project"] or not migration["zone"]:
+      errors.append(f"Migration {zone_key} needs both a project and a zone")
+    if not migration["entry_recipes"]:
+      errors.append(f"Migration {zone_key} has no entry recipes")
+    if zone_key in seen:
+      errors.append(f"Migration {zone_key} is listed more than once")
+    seen.add(zone_key)
+    unknown_settings = [name for name in migration["settings"] if name not in SETTING_NAMES]
+    if unknown_settings:
+      errors.append(f"Migration {zone_key} overrides unknown settings {unknown_settings}")
+  return errors
+
+def zone_settings(settings, project_name, zone_name, overrides=None, shared_output_dir=False):
+  zone_settings = {**settings, **(overrides or {})}
+  if shared_output_dir and "dbx_output_dir" not in (overrides or {}):
+    # several zones migrated together each get their own folder
+    zone_settings["dbx_output_dir"] = posixpath.join(settings["dbx_output_dir"], project_name, zone_name)
+  zone_settings["local_output_dir"] = os.path.join(zone_settings.get("local_output_root") or "/tmp", project_name, zone_name)
+  zone_settings["migration_manifest_path"] = os.path.join(zone_settings["migration_manifest_dir"], f"{project_name}_{zone_name}.json")
+  return zone_settings
+
+class SharedResources:
+  # One per process: the API clients, their connection pool and the metadata/transpile caches are shared by every zone
+  def __init__(self, settings, concurrent_zones=1, dss_client=None, dbx_ws_api=None, workspace_client=None):
+    self.settings = settings
+    self.pool_size = settings.get("traversal_workers", 8) * concurrent_zones
+    self._lock = threading.RLock()
+    # clients can be given upfront, e.g. the offline stand-ins of the benchmarks
+    self._dss_client = dss_client
+    self._dbx_ws_api = dbx_ws_api
+    self._workspace_client = workspace_client
+    self._transpile_cache = None
+    self.profile = MigrationProfile(progress=settings.get("profile_progress", False))
+    self._projects = {}
+    self._project_locks = {}
+    self._flow_indexes = {}
+    self._variables = {}
+
+  def dss_client(self):
+    with self._lock:
+      if self._dss_client is None:
+        import dataiku
+        dataiku.set_remote_dss(self.settings["dataiku_uri"], self.settings["dataiku_token"])
+        self._dss_client = dataiku.api_client()
+        configure_connection_pool(self._dss_client._session, self.pool_size, self.settings.get("dataiku_max_calls_per_second"),
+                                  profile=self.profile, api_name="dataiku")
+      return self._dss_client
+
+  def dbx_ws_api(self):
+    with self._lock:
+      if self._dbx_ws_api is None:
+        from databricks_cli.sdk.api_client import ApiClient
+        from databricks_cli.workspace.api import WorkspaceApi
+        dbx_api_client = ApiClient(host=self.settings["dbx_uri"], token=self.settings["dbx_token"])
+        configure_connection_pool(dbx_api_client.session, self.pool_size, profile=self.profile, api_name="databricks")
+        self._dbx_ws_api = WorkspaceApi(dbx_api_client)
+      return self._dbx_ws_api
+
+  def workspace_client(self):
+    with self._lock:
+      if self._workspace_client is None:
+        from databricks.sdk import WorkspaceClient
+        self._workspace_client = WorkspaceClient(host=self.settings["dbx_uri"], token=self.settings["dbx_token"])
+      return self._workspace_client
+
+  def transpile_cache(self):
+    with self._lock:
+      if self._transpile_cache is None:
+        from transpile_cache import TranspileCache
+        self._transpile_cache = TranspileCache(self.settings["transpile_cache_dir"])
+      return self._transpile_cache
+
+  def _project_lock(self, project_name):
+    # the flow of each project is loaded once, without blocking the zones of other projects
+    with self._lock:
+      return self._project_locks.setdefault(project_name, threading.Lock())
+
+  def get_project(self, project_name):
+    dss_client = self.dss_client()
+    with self._lock:
+      if project_name not in self._projects:
+        self._projects[project_name] = CachedDSSProject(
+          dss_client.get_project(project_name),
+          cache_dir=self.settings["metadata_cache_dir"],
+          ttl_seconds=self.settings["metadata_cache_ttl_seconds"])
+      return self._projects[project_name]
+
+  def get_flow_index(self, project_name):
+    # Zones of the same project share a single snapshot of its flow
+    from flow_index import build_flow_index
+
+    with self._project_lock(project_name):
+      if project_name not in self._flow_indexes:
+        self._flow_indexes[project_name] = build_flow_index(self.get_project(project_name))
+      return self._flow_indexes[project_name]
+
+  def get_variables(self, project_name):
+    with self._project_lock(project_name):
+      if project_name not in self._variables:
+        self._variables[project_name] = self.get_project(project_name).get_variables()['standard']
+      return self._variables[project_name]
+
+  def save_caches(self):
+    with self._lock:
+      for dss_project in self._projects.values():
+        with self.profile.timed_call("disk", "metadata_cache.save"):
+          dss_project.save_cache()
+
+  def write_profile(self):
+    if not self.settings.get("profile_output_dir"):
+      return None
+    paths = self.profile.write(self.settings["profile_output_dir"], f"migration_profile_{time.strftime('%Y%m%d_%H%M%S')}")
+    print(f"Migration profile written to {', '.join(paths)}")
+    return paths
+
+def profiled_phase(method):
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    with self.resources.profile.phase(method.__name__, scope=f"{self.project_name}/{self.zone_name}"):
+      return method(self, *args, **kwargs)
+  return wrapper
+
+class ZoneMigration:
+  # Migrates one project zone into one job, each phase is a method so the notebook can run them cell by cell
+  def __init__(self, resources, settings, project_name, zone_name, entry_recipe_names):
+    self.resources = resources
+    self.settings = settings
+    self.project_name = project_name
+    self.zone_name = zone_name
+    self.entry_recipe_names = entry_recipe_names
+    self.report = {"project": project_name, "zone": zone_name}
+
+  def log(self, message):
+    print(f"[{self.project_name}/{self.zone_name}] {message}")
+
+  @profiled_phase
+  def prepare(self):
+    settings = self.settings
+    profile = self.resources.profile
+    self.dss_project = self.resources.get_project(self.project_name)
+    self.flow_index = self.resources.get_flow_index(self.project_name)
+    self.variables = self.resources.get_variables(self.project_name)
+
+    # Generated notebooks are kept in memory and uploaded in bulk at the end of the run
+    self.workspace_output = WorkspaceOutput(settings["dbx_output_dir"],
+                                            local_dump_dir=settings["local_output_dir"] if settings["dump_local_notebooks"] else None)
+
+    # Manifest of the previous run, only what changed since then is regenerated and re-imported.
+    # An archive import replaces the whole tree, so it always runs a full migration
+    self.incremental = settings["incremental_migration"] and settings["workspace_import_mode"] == "batch"
+    # the generated notebooks record their run time and Spark metrics in this Delta table
+    self.metrics_table = settings.get("runtime_metrics_table") if settings.get("runtime_metrics") else None
+    if self.incremental:
+      self.manifest = MigrationManifest.load(settings["migration_manifest_path"])
+    else:
+      self.manifest = MigrationManifest(settings["migration_manifest_path"])
+
+    # The config, pivot and Snowflake helpers are one versioned module, the variables become job parameters
+    with profile.phase("runtime_module"):
+      from python_recipes import create_dataiku_compat_package
+      runtime_path = self.workspace_output.add_file(f"lib/v{RUNTIME_VERSION}/{RUNTIME_MODULE_NAME}.py", create_runtime_module().encode())
+      self.runtime_dir = posixpath.dirname(runtime_path)
+      for relative_path, payload in create_dataiku_compat_package().items():
+        self.workspace_output.add_file(f"lib/v{RUNTIME_VERSION}/{relative_path}", payload.encode())
+
+  def visit_recipe(self, recipe_obj):
+    recipe = recipe_obj["recipe"]
+    recipe_source_datasets = self.flow_index.get_recipe_source_datasets(recipe.name)
+    recipe_obj["source_datasets"] = recipe_source_datasets
+    recipe_obj["source_snowflake"] = len(recipe_source_datasets["Snowflake"]) > 0
+    recipe_obj["source_uploaded"] = len(recipe_source_datasets["UploadedFiles"]) > 0
+    recipe_obj["source_hash"] = recipe_source_hash(recipe, self.variables, self.flow_index)
+    recipe_obj["sql_recipe"] = is_sql_recipe(recipe)
+    self.resources.profile.increment("recipes_visited", report_every=100)
+    # notebooks are generated after the traversal, once the materialization of every output is known
+    return self.flow_index.get_upstream_recipes(recipe.name)
+
+  @profiled_phase
+  def traverse(self):
+    self.recipes_list = [new_recipe_obj(self.dss_project.get_recipe(recipe_name)) for recipe_name in self.entry_recipe_names]
+    self.recipes_map = {recipe["recipe"].name: recipe for recipe in self.recipes_list}
+    traverse_recipes(self.recipes_list, self.recipes_map, self.dss_project.get_recipe, self.visit_recipe,
+                     max_workers=self.settings["traversal_workers"])
+
+    self.snowflake_source_datasets = {}
+    self.uploaded_source_datasets = {}
+    for recipe_obj in self.recipes_list:
+      self.snowflake_source_datasets = {**self.snowflake_source_datasets, **recipe_obj["source_datasets"]["Snowflake"]}
+      self.uploaded_source_datasets = {**self.uploaded_source_datasets, **recipe_obj["source_datasets"]["UploadedFiles"]}
+    with self.resources.profile.timed_call("disk", "metadata_cache.save"):
+      self.dss_project.save_cache()
+    self.log(f"Traversed {len(self.recipes_list)} recipes")
+
+  @profiled_phase
+  def size_clusters(self):
+    # Tasks run on a few clusters sized from the Dataiku metrics of their datasets and their last build durations
+    self.cluster_sizing = None
+    self.dataset_metrics = None
+    self.job_durations = None
+    if not self.settings.get("cluster_sizing"):
+      return
+    from cluster_sizing import get_dataset_metrics, get_job_durations, plan_cluster_sizing, sizing_summary
+
+    dataset_names = list(dict.fromkeys(dataset_name for recipe_name in self.recipes_map
+                                       for dataset_name in self.flow_index.get_recipe(recipe_name)["inputs"] + self.flow_index.get_recipe(recipe_name)["outputs"]))
+    self.dataset_metrics = get_dataset_metrics(self.dss_project, dataset_names, max_workers=self.settings["traversal_workers"])
+    self.job_durations = get_job_durations(self.dss_project)
+    self.cluster_sizing = plan_cluster_sizing(self.recipes_map, self.flow_index, self.dataset_metrics, self.job_durations, self.settings.get("cluster_tiers"))
+    self.report["cluster_sizing"] = {"summary": sizing_summary(self.cluster_sizing), "recipes": self.cluster_sizing}
+    self.log(f"Cluster sizing: {self.report['cluster_sizing']['summary']}")
+
+  @profiled_phase
+  def plan_partitioning(self):
+    # Partitioned Dataiku datasets are built one partition per run, the partition is a job parameter
+    self.partitioning_plan = {}
+    self.source_partition_filters = {}
+    if not self.settings.get("partition_processing"):
+      return
+    from partitioning import plan_partitioning, get_source_partition_filters, partitioning_summary
+
+    self.partitioning_plan = plan_partitioning(self.recipes_map, self.flow_index)
+    if not self.partitioning_plan:
+      return
+    self.source_partition_filters = get_source_partition_filters(self.snowflake_source_datasets, self.recipes_map, self.partitioning_plan)
+    self.report["partitioning"] = {"summary": partitioning_summary(self.partitioning_plan, self.source_partition_filters),
+                                   "recipes": self.partitioning_plan}
+    self.log(f"Partitioning: {self.report['partitioning']['summary']}")
+
+  @profiled_phase
+  def plan_job_split(self):
+    # Zones with more tasks than max_tasks_per_job are split into sub-jobs, run one after the other by a parent job
+    from job_splitting import plan_job_split, get_cross_job_outputs, get_sub_job_dependencies
+
+    snowflake_groups = group_snowflake_source_datasets(self.snowflake_source_datasets, self.settings["snowflake_registration_mode"],
+                                                       self.settings["snowflake_registration_group_size"])
+    dataset_groups = {dataset_name: group_name for group_name, dataset_names in snowflake_groups.items() for dataset_name in dataset_names}
+    dependencies = {}
+    registration_keys = {}
+    for recipe_obj in self.recipes_list:
+      if recipe_obj["source_uploaded"]:
+        continue
+      recipe_name = recipe_obj["recipe"].name
+      upstream_objs = list(recipe_obj["upstream_recipes"].values())
+      dependencies[recipe_name] = [upstream_obj["recipe"].name for upstream_obj in upstream_objs if not upstream_obj["source_uploaded"]]
+      # the registration tasks build_tasks makes the recipe wait on, each sub-job registers its own sources
+      keys = {snowflake_task_key(dataset_groups[dataset_name]) for dataset_name in recipe_obj["source_datasets"]["Snowflake"]}
+      if any(upstream_obj["source_uploaded"] for upstream_obj in upstream_objs):
+        keys.add(UPLOADED_SOURCE_TASK_KEY)
+      if not (upstream_objs or recipe_obj["source_snowflake"]):
+        keys |= {snowflake_task_key(group_name) for group_name in snowflake_groups} | {UPLOADED_SOURCE_TASK_KEY}
+      registration_keys[recipe_name] = {self.registration_task_key(key, self.recipe_cluster_key(recipe_name)) for key in keys}
+
+    self.job_split = plan_job_split(dependencies, registration_keys, self.settings.get("max_tasks_per_job"))
+    self.cross_job_outputs = get_cross_job_outputs(self.job_split, dependencies)
+    self.sub_job_dependencies = get_sub_job_dependencies(self.job_split, dependencies)
+    if len(self.sub_job_dependencies) > 1:
+      self.log(f"Job split: {len(self.sub_job_dependencies)} sub-jobs, {len(self.cross_job_outputs)} outputs read across sub-jobs")
+
+  def default_cluster_key(self):
+    # smallest cluster in use, it registers the sources nobody reads
+    if self.cluster_sizing is None:
+      return DEFAULT_JOB_CLUSTER_KEY
+    from cluster_sizing import DEFAULT_CLUSTER_TIERS
+    used_keys = {entry["job_cluster_key"] for entry in self.cluster_sizing.values()}
+    tiers = self.settings.get("cluster_tiers") or DEFAULT_CLUSTER_TIERS
+    return next((tier["job_cluster_key"] for tier in tiers if tier["job_cluster_key"] in used_keys), tiers[0]["job_cluster_key"])
+
+  def get_cross_cluster_outputs(self):
+    if self.cluster_sizing is None:
+      return set()
+    from cluster_sizing import get_cross_cluster_outputs
+    return get_cross_cluster_outputs(self.cluster_sizing, self.recipes_map, self.flow_index)
+
+  @profiled_phase
+  def plan_materialization(self):
+    from materialization import plan_materializations, get_table_locations, materialization_summary
+
+    # Outputs read by several recipes are cached or written to Delta instead of being recomputed by each reader
+    self.materialization_plan = plan_materializations(self.recipes_map, self.flow_index,
+                                                      cache_fan_out=self.settings["materialization_cache_fan_out"],
+                                                      delta_fan_out=self.settings["materialization_delta_fan_out"],
+                                                      materialization_schema=self.settings["materialization_schema"],
+                                                      # partitions of earlier runs are kept in the Delta tables
+                                                      forced_delta=self.get_cross_cluster_outputs() | set(self.partitioning_plan) | self.cross_job_outputs)
+    self.table_locations = get_table_locations(self.materialization_plan)
+    self.report["materialization"] = {"summary": materialization_summary(self.materialization_plan), "outputs": self.materialization_plan}
+    self.log(f"Materialization: {self.report['materialization']['summary']}")
+
+    for recipe_name, recipe_obj in self.recipes_map.items():
+      # the generated code also depends on where the outputs are written and the inputs are read from
+      recipe_obj["generation_hash"] = content_hash(recipe_obj["source_hash"], self.materialization_plan[recipe_name], self.table_locations,
+                                                   self.partitioning_plan.get(recipe_name), self.metrics_table)
+      recipe_obj["pending"] = not self.manifest.is_recipe_unchanged(recipe_name, recipe_obj["generation_hash"])
+
+  @profiled_phase
+  def plan_fusion(self):
+    # Chains of SQL recipes whose intermediate outputs have a single reader run as one query in the task of the last one
+    self.fusion_groups = {}
+    self.fused_into = {}
+    if self.settings.get("sql_fusion"):
+      from sql_fusion import find_fusion_groups
+      self.fusion_groups = find_fusion_groups(self.recipes_map, self.flow_index, self.materialization_plan)
+    for head_name, group in self.fusion_groups.items():
+      for recipe_name in group[:-1]:
+        self.fused_into[recipe_name] = head_name
+
+    for head_name, group in self.fusion_groups.items():
+      head_obj = self.recipes_map[head_name]
+      head_obj["generation_hash"] = content_hash(head_obj["generation_hash"], [self.recipes_map[name]["generation_hash"] for name in group])
+      head_obj["pending"] = not self.manifest.is_recipe_unchanged(head_name, head_obj["generation_hash"])
+      for recipe_name in group[:-1]:
+        recipe_obj = self.recipes_map[recipe_name]
+        # a member is regenerated on its own as soon as it leaves the group
+        recipe_obj["generation_hash"] = content_hash(recipe_obj["generation_hash"], "fused_into", head_name)
+        recipe_obj["pending"] = False
+
+    self.report["sql_fusion"] = {"fused_recipes": len(self.fused_into), "groups": self.fusion_groups}
+    if self.fusion_groups:
+      self.log(f"Fused {len(self.fused_into)} SQL recipes into {len(self.fusion_groups)} queries")
+
+  def get_dataset_locations(self, recipe_obj):
+    # where a Python recipe reads its inputs and publishes its outputs on Databricks, by Dataiku dataset name
+    recipe = self.flow_index.get_recipe(recipe_obj["recipe"].name)
+    dataset_locations = {}
+    for dataset_name in recipe["inputs"] + recipe["outputs"]:
+      if dataset_name in recipe_obj["source_datasets"]["Snowflake"]:
+        dataset_locations[dataset_name] = f"global_temp.{recipe_obj['source_datasets']['Snowflake'][dataset_name]['table_name']}"
+      elif dataset_name in self.uploaded_source_datasets:
+        dataset_locations[dataset_name] = f"global_temp.{self.uploaded_source_datasets[dataset_name]['table_name'].upper()}"
+      else:
+        table_name = f"{self.flow_index.project_key}_{dataset_name}"
+        dataset_locations[dataset_name] = self.table_locations.get(table_name.lower(), f"global_temp.{table_name}")
+    return dataset_locations
+
+  @profiled_phase
+  def generate_recipe_notebooks(self):
+    from transpile_cache import transpile_queries
+
+    conversion_timings = {}
+    # Every SQL recipe is transpiled (unchanged ones are cache hits), the source pushdown analysis needs all of them
+    self.converted_queries = transpile_queries({recipe_obj["recipe"].name: recipe_obj["recipe"].get_settings().get_payload()
+                                                for recipe_obj in self.recipes_list if recipe_obj["sql_recipe"]},
+                                               self.resources.transpile_cache(),
+                                               max_workers=self.settings["transpile_workers"],
+                                               table_locations=self.table_locations,
+                                               timings=conversion_timings)
+    # the fused queries are transpiled on top, the pushdown analysis keeps working on the queries of each recipe
+    self.fused_queries = {}
+    pending_groups = {head_name: group for head_name, group in self.fusion_groups.items() if self.recipes_map[head_name]["pending"]}
+    if pending_groups:
+      from sql_fusion import fuse_queries
+      output_tables = {recipe_name: entry["table_name"] for recipe_name, entry in self.materialization_plan.items()}
+      self.fused_queries = transpile_queries({head_name: fuse_queries(group,
+                                                                      {name: self.recipes_map[name]["recipe"].get_settings().get_payload() for name in group},
+                                                                      output_tables)
+                                              for head_name, group in pending_groups.items()},
+                                             self.resources.transpile_cache(),
+                                             max_workers=self.settings["transpile_workers"],
+                                             table_locations=self.table_locations,
+                                             timings=conversion_timings)
+    for recipe_name, seconds in conversion_timings.items():
+      self.resources.profile.record_conversion(recipe_name, seconds, scope=f"{self.project_name}/{self.zone_name}")
+
+    for recipe_obj in self.recipes_list:
+      if not recipe_obj["pending"]:
+        continue
+      recipe = recipe_obj["recipe"]
+      recipe_output_path = f"transformations/{recipe.name}"
+      if recipe_obj["sql_recipe"]:
+        self.workspace_output.add_notebook(recipe_output_path,
+                                           create_notebook_from_recipe(recipe, self.variables, self.runtime_dir,
+                                                                       converted_query=self.fused_queries.get(recipe.name, self.converted_queries[recipe.name]),
+                                                                       materialization=self.materialization_plan[recipe.name],
+                                                                       partitioning=self.partitioning_plan.get(recipe.name),
+                                                                       metrics_table=self.metrics_table))
+      elif is_python_recipe(recipe):
+        from python_recipes import rewrite_dataiku_imports
+        recipe_code, unsupported_imports = rewrite_dataiku_imports(recipe.get_settings().get_payload())
+        if unsupported_imports:
+          self.report.setdefault("python_recipes", {})[recipe.name] = {"unsupported_imports": unsupported_imports}
+          self.log(f"Python recipe {recipe.name} keeps unsupported dataiku imports: {unsupported_imports}")
+        self.workspace_output.add_notebook(recipe_output_path,
+                                           create_pyspark_notebook_from_recipe(recipe, self.variables, self.runtime_dir,
+                                                                               self.get_dataset_locations(recipe_obj),
+                                                                               recipe_code=recipe_code,
+                                                                               partitioning=self.partitioning_plan.get(recipe.name),
+                                                                               metrics_table=self.metrics_table))
+      elif is_pivot_recipe(recipe):
+        self.workspace_output.add_notebook(recipe_output_path,
+                                           create_pivot_notebook_from_recipe(recipe, self.dss_project, self.runtime_dir,
+                                                                             materialization=self.materialization_plan[recipe.name],
+                                                                             table_locations=self.table_locations,
+                                                                             partitioning=self.partitioning_plan.get(recipe.name),
+                                                                             metrics_table=self.metrics_table))
+
+  @profiled_phase
+  def lint_sql(self):
+    # Patterns carried over from Snowflake that run badly on Spark, with the size of what they read when the metrics are known
+    self.sql_lint_findings = {}
+    if not self.settings.get("sql_lint"):
+      return
+    from sql_lint import SEVERITIES, build_table_graph, lint_queries, lint_summary, findings_at_or_above
+    fail_severity = self.settings.get("sql_lint_fail_severity")
+    if fail_severity and fail_severity not in SEVERITIES:
+      raise Exception(f"Unknown sql_lint_fail_severity {fail_severity}, expected one of {SEVERITIES}")
+
+    table_graph = build_table_graph(self.recipes_map, self.flow_index, self.materialization_plan, self.uploaded_source_datasets, self.dataset_metrics)
+    self.sql_lint_findings = lint_queries(self.converted_queries, table_graph)
+    lint_report = json.dumps(self.sql_lint_findings, indent=2, default=str).encode()
+    self.workspace_output.add_file("reports/sql_lint.json", lint_report)
+    self.report["sql_lint"] = {"summary": lint_summary(self.sql_lint_findings), "findings": "reports/sql_lint.json"}
+    self.log(f"SQL lint: {self.report['sql_lint']['summary']}")
+
+    failing = findings_at_or_above(self.sql_lint_findings, fail_severity) if fail_severity else {}
+    if failing:
+      # the run stops before the upload, the findings are uploaded on their own
+      self.workspace_output.upload_file(self.resources.dbx_ws_api(), "reports/sql_lint.json", lint_report)
+      raise Exception(f"SQL lint found {sum(len(findings) for findings in failing.values())} findings at or above {fail_severity} "
+                      f"in {', '.join(sorted(failing))}, see reports/sql_lint.json")
+
+  @profiled_phase
+  def create_snowflake_source_notebooks(self):
+    settings = self.settings
+    if settings["snowflake_pushdown"]:
+      from source_pushdown import apply_source_pushdown
+      apply_source_pushdown(self.snowflake_source_datasets, self.recipes_list, self.converted_queries)
+    for dataset_name, partitions in self.source_partition_filters.items():
+      self.snowflake_source_datasets[dataset_name]["partitions"] = partitions
+    if settings.get("snowflake_source_sync"):
+      # synced tables are registered from a Delta snapshot holding every column, the pushdown does not apply to them
+      from source_sync import get_source_sync, source_sync_summary
+      source_sync = get_source_sync(self.snowflake_source_datasets, settings["snowflake_source_sync"], settings.get("snowflake_snapshot_schema"))
+      for dataset_name, sync in source_sync.items():
+        self.snowflake_source_datasets[dataset_name]["sync"] = sync
+      self.report["snowflake_source_sync"] = {"summary": source_sync_summary(source_sync), "tables": source_sync}
+      self.log(f"Snowflake source sync: {self.report['snowflake_source_sync']['summary']}")
+
+    # One registration task per table (or group of tables), so each recipe only waits on its own sources
+    self.snowflake_registration_tasks = {}
+    self.snowflake_dataset_tasks = {}
+    snowflake_registration_groups = group_snowflake_source_datasets(self.snowflake_source_datasets,
+                                                                    settings["snowflake_registration_mode"],
+                                                                    settings["snowflake_registration_group_size"])
+
+    for group_name, dataset_names in snowflake_registration_groups.items():
+      if settings["snowflake_registration_mode"] == "single":
+        output_path = os.path.join("datasets", "snowflake_source_datasets")
+      else:
+        output_path = os.path.join("datasets", "snowflake", group_name)
+      task_key = snowflake_task_key(group_name)
+      self.snowflake_registration_tasks[task_key] = self.workspace_output.add_notebook(
+        output_path,
+        create_snowflake_source_dataset_notebook([self.snowflake_source_datasets[name] for name in dataset_names],
+                                                 settings["snowflake_connection"], self.runtime_dir,
+                                                 metrics_table=self.metrics_table, project_key=self.flow_index.project_key, task_name=task_key))
+      for dataset_name in dataset_names:
+        self.snowflake_dataset_tasks[dataset_name] = task_key
+
+  @profiled_phase
+  def create_uploaded_source_notebook(self):
+    uploaded_files_format = self.settings["uploaded_files_format"]
+    prefix = "file:/Workspace"
+    file_format = 'parquet' if uploaded_files_format == "parquet" else 'xlsx'
+    uploaded_datasets_paths = []
+    for dataset in self.uploaded_source_datasets.values():
+      relative_path = os.path.join("datasets", "files", dataset["dataset_name"])+"."+file_format
+      uploaded_dataset_path = {
+        "path": prefix + self.workspace_output.workspace_path(relative_path),
+        "table_name": dataset["table_name"]
+      }
+      if uploaded_files_format == "parquet":
+        # The uploaded data is converted once here, unchanged files are skipped by the manifest at upload time
+        source_dataset = self.dss_project.get_dataset(dataset["source_dataset_name"])
+        self.workspace_output.add_file(relative_path, export_dataset_to_parquet(source_dataset))
+        uploaded_dataset_path["schema"] = get_spark_schema_ddl(source_dataset.get_schema())
+      uploaded_datasets_paths.append(uploaded_dataset_path)
+
+    self.uploaded_source_datasets_dbx_import_path = self.workspace_output.add_notebook(
+      os.path.join("datasets", "uploaded_source_datasets"),
+      create_uploaded_source_dataset_notebook(uploaded_datasets_paths, file_format=uploaded_files_format, runtime_dir=self.runtime_dir,
+                                              metrics_table=self.metrics_table, project_key=self.flow_index.project_key,
+                                              task_name=UPLOADED_SOURCE_TASK_KEY))
+
+  @profiled_phase
+  def create_metrics_report(self):
+    # Notebook comparing the metrics recorded by the runs of the job with the last Dataiku build of the same recipes
+    if not self.metrics_table:
+      return
+    from cluster_sizing import get_job_durations
+    from runtime_metrics import build_metrics_baseline, baseline_summary
+
+    job_durations = self.job_durations if self.job_durations is not None else get_job_durations(self.dss_project)
+    baseline = build_metrics_baseline(self.recipes_map, self.flow_index, self.fusion_groups, self.fused_into, job_durations, self.dataset_metrics,
+                                      UPLOADED_SOURCE_TASK_KEY)
+    self.workspace_output.add_notebook(os.path.join("reports", "runtime_comparison"),
+                                       create_runtime_metrics_report_notebook(self.runtime_dir, self.metrics_table, baseline))
+    self.report["runtime_metrics"] = {"table": self.metrics_table, "report_notebook": "reports/runtime_comparison",
+                                      "baseline": baseline_summary(baseline)}
+    self.log(f"Runtime metrics: {self.report['runtime_metrics']['baseline']}")
+
+  @profiled_phase
+  def upload(self):
+    dbx_ws_api = self.resources.dbx_ws_api()
+    removed_recipes = self.manifest.get_removed_recipes(self.recipes_map)
+    for recipe_name in removed_recipes:
+      recipe_output_path = f"transformations/{recipe_name}"
+      try:
+        dbx_ws_api.delete(self.workspace_output.workspace_path(recipe_output_path), is_recursive=False)
+      except Exception as e:
+        self.log(f"Could not delete the notebook of removed recipe {recipe_name}: {e}")
+      self.manifest.forget_notebook(recipe_output_path)
+    # recipes fused since the previous run no longer have a notebook of their own, nor do the former helper notebooks
+    for recipe_output_path in [f"transformations/{recipe_name}" for recipe_name in self.fused_into] + list(LEGACY_NOTEBOOKS):
+      if recipe_output_path in self.manifest.notebooks:
+        try:
+          dbx_ws_api.delete(self.workspace_output.workspace_path(recipe_output_path), is_recursive=False)
+        except Exception as e:
+          self.log(f"Could not delete the stale notebook {recipe_output_path}: {e}")
+        self.manifest.forget_notebook(recipe_output_path)
+
+    self.manifest.skip_unchanged_outputs(self.workspace_output)
+    self.log(f"Uploading {len(self.workspace_output.notebooks)} notebooks and {len(self.workspace_output.files)} files, {len(removed_recipes)} removed recipes")
+    self.workspace_output.upload(dbx_ws_api, mode=self.settings["workspace_import_mode"], max_workers=self.settings["traversal_workers"])
+    self.manifest.record_outputs(self.workspace_output)
+
+  def recipe_cluster_key(self, recipe_name):
+    if self.cluster_sizing is None:
+      return DEFAULT_JOB_CLUSTER_KEY
+    return self.cluster_sizing[recipe_name]["job_cluster_key"]
+
+  def registration_task_key(self, task_key, job_cluster_key):
+    # Sized clusters each register the sources they read, temp views are not shared between clusters
+    if self.cluster_sizing is None:
+      return task_key
+    return to_task_key(f"{task_key}_{job_cluster_key.upper()}")
+
+  @profiled_phase
+  def build_tasks(self):
+    recipe_tasks = []
+    registration_clusters = {}
+
+    def registration_dependency(task_key, job_cluster_key):
+      registration_clusters.setdefault(task_key, []).append(job_cluster_key)
+      return {"task_key": self.registration_task_key(task_key, job_cluster_key)}
+
+    for recipe_obj in self.recipes_list:
+      recipe = recipe_obj["recipe"]
+      if recipe.name in self.fused_into:
+        continue
+      job_cluster_key = self.recipe_cluster_key(recipe.name)
+      dbx_import_path = self.workspace_output.workspace_path(f"transformations/{recipe.name}")
+      dependencies = []
+      # a fused task waits on the sources and upstream tasks of every recipe of its group
+      group_objs = [self.recipes_map[name] for name in self.fusion_groups.get(recipe.name, [recipe.name])]
+
+      # Adding Source Datasets Registration depedency for all recipes
+      for task_key in dict.fromkeys(self.snowflake_dataset_tasks[dataset_name] for group_obj in group_objs for dataset_name in group_obj["source_datasets"]["Snowflake"]):
+        dependencies.append(registration_dependency(task_key, job_cluster_key))
+
+      recipe_dependencies = [dependency for group_obj in group_objs for dependency in group_obj['upstream_recipes'].values()
+                             if dependency['recipe'].name not in self.fused_into]
+
+      for dependency in recipe_dependencies:
+        # if the the upstream recipe is for uploading file, connect this recipe to the upload files notebook
+        if dependency["source_uploaded"]:
+          dependencies.append(registration_dependency(UPLOADED_SOURCE_TASK_KEY, job_cluster_key))
+        else:
+          dependencies.append({"task_key": dependency['recipe'].name})
+
+      if not (len(recipe_dependencies) or any(group_obj["source_snowflake"] or group_obj["source_uploaded"] for group_obj in group_objs)):
+        dependencies += [registration_dependency(task_key, job_cluster_key) for task_key in self.snowflake_registration_tasks]
+        dependencies.append(registration_dependency(UPLOADED_SOURCE_TASK_KEY, job_cluster_key))
+
+      if not recipe_obj["source_uploaded"]:
+        recipe_tasks.append({
+                    "task_key": recipe.name,
+                    "depends_on": dependencies,
+                    "notebook_task": {
+                        "notebook_path": dbx_import_path,
+                        "source": "WORKSPACE"
+                    },
+                    "job_cluster_key": job_cluster_key,
+                    "timeout_seconds": 0,
+                    "description": recipe.name
+                })
+
+    self.tasks = []
+    # Adding the Source Dataset Registrartion
+    registration_tasks = [(task_key, notebook_path, "Register the source Datasets from Snowflake")
+                          for task_key, notebook_path in self.snowflake_registration_tasks.items()]
+    registration_tasks.append((UPLOADED_SOURCE_TASK_KEY, self.uploaded_source_datasets_dbx_import_path,
+                               "Register the source Datasets from uploaded files"))
+    for task_key, notebook_path, description in registration_tasks:
+      job_cluster_keys = list(dict.fromkeys(registration_clusters.get(task_key, []))) or [self.default_cluster_key()]
+      for job_cluster_key in job_cluster_keys:
+        self.tasks.append({
+                    "task_key": self.registration_task_key(task_key, job_cluster_key),
+                    "depends_on": [],
+                    "notebook_task": {
+                        "notebook_path": notebook_path,
+                        "source": "WORKSPACE"
+                    },
+                    "job_cluster_key": job_cluster_key,
+                    "timeout_seconds": 0,
+                    "description": description
+                })
+    self.tasks += recipe_tasks
+
+  def task_durations(self):
+    # The last Dataiku build of the recipes of each task, the tasks with no build (the source registrations among them)
+    # weigh the median of the others. Empty when Dataiku has no build, every task then weighs 1
+    from cluster_sizing import get_job_durations, get_task_durations
+
+    if self.job_durations is None:
+      self.job_durations = get_job_durations(self.dss_project)
+    task_recipes = {recipe_name: self.fusion_groups.get(recipe_name, [recipe_name]) for recipe_name, recipe_obj in self.recipes_map.items()
+                    if recipe_name not in self.fused_into and not recipe_obj["source_uploaded"]}
+    measured = get_task_durations(task_recipes, self.flow_index, self.job_durations)
+    if not measured:
+      return {}
+    median = sorted(measured.values())[len(measured) // 2]
+    return {task["task_key"]: measured.get(task["task_key"], median) for task in self.tasks}
+
+  @profiled_phase
+  def optimize_tasks(self):
+    self.tasks, removed_edges = optimize_job_tasks(self.tasks)
+    durations = self.task_durations()
+    job_dag_report = critical_path_report(self.tasks, durations)
+    job_dag_report["removed_edges"] = removed_edges
+    # seconds of the last Dataiku builds, or a number of tasks
+    job_dag_report["weighted_by"] = "dataiku_durations" if durations else "task_count"
+    self.report["job_dag"] = job_dag_report
+
+    self.log(f"Removed {len(removed_edges)} redundant dependencies")
+    unit = "seconds in Dataiku" if durations else "tasks"
+    self.log(f"Critical path ({round(job_dag_report['critical_path_length'], 1)} {unit}): {' -> '.join(job_dag_report['critical_path'])}")
+    self.log(f"Max parallelism: {job_dag_report['max_parallelism']}, average parallelism: {job_dag_report['average_parallelism']}")
+
+  @profiled_phase
+  def split_tasks(self):
+    self.sub_jobs = [self.tasks]
+    if len(self.sub_job_dependencies) < 2:
+      return
+    from job_splitting import split_job_tasks, job_split_summary
+    self.sub_jobs = split_job_tasks(self.tasks, self.job_split)
+    self.report["job_split"] = {"summary": job_split_summary(self.sub_jobs, self.sub_job_dependencies, self.cross_job_outputs),
+                                "recipes": self.job_split}
+    self.log(f"Job split: {self.report['job_split']['summary']}")
+
+  def get_job_parameters(self):
+    from partitioning import get_partition_parameters
+    parameters = {**self.variables, **get_partition_parameters(self.partitioning_plan)}
+    if self.metrics_table:
+      # the metrics are keyed by the ids of the job run, a sub-job gets the ids of its parent run
+      parameters.update(RUNTIME_METRICS_PARAMETERS)
+    return get_job_parameters(parameters)
+
+  @profiled_phase
+  def create_job(self):
+    self.log("Creating the final job")
+    job_clusters = self.settings.get("job_clusters") or DEFAULT_JOB_CLUSTERS
+    if self.cluster_sizing is not None:
+      from cluster_sizing import get_job_clusters
+      # the tiers are applied on top of the first configured cluster
+      job_clusters = get_job_clusters(job_clusters[0]["new_cluster"], {task["job_cluster_key"] for task in self.tasks},
+                                      self.settings.get("cluster_tiers"))
+    workspace_client = self.resources.workspace_client()
+    parameters = self.get_job_parameters()
+    tasks = self.tasks
+    sub_job_names = [f"{self.zone_name} - part {index + 1}" for index in range(len(self.sub_jobs))] if len(self.sub_jobs) > 1 else []
+    if sub_job_names:
+      from job_splitting import get_orchestration_tasks
+      sub_job_ids = []
+      for sub_job_name, sub_job_tasks in zip(sub_job_names, self.sub_jobs):
+        cluster_keys = {task["job_cluster_key"] for task in sub_job_tasks}
+        with self.resources.profile.timed_call("databricks-sdk", "jobs.create_or_update"):
+          sub_job_ids.append(create_or_update_job(workspace_client, self.manifest.get_sub_job(sub_job_name), sub_job_name, sub_job_tasks,
+                                                  [job_cluster for job_cluster in job_clusters if job_cluster["job_cluster_key"] in cluster_keys],
+                                                  incremental=self.incremental, parameters=parameters))
+      self.report["job_split"]["job_ids"] = dict(zip(sub_job_names, sub_job_ids))
+      # the zone job only runs the sub-jobs in order
+      tasks = get_orchestration_tasks(sub_job_ids, self.sub_job_dependencies, parameters)
+      job_clusters = []
+    for sub_job_name in [name for name in self.manifest.sub_jobs if name not in sub_job_names]:
+      if self.incremental:
+        delete_job(workspace_client, self.manifest.sub_jobs[sub_job_name].job_id)
+      del self.manifest.sub_jobs[sub_job_name]
+
+    # the jobs API goes through the SDK's own session, the call is timed as a whole
+    with self.resources.profile.timed_call("databricks-sdk", "jobs.create_or_update"):
+      self.job_id = create_or_update_job(workspace_client, self.manifest, self.zone_name, tasks, job_clusters,
+                                         incremental=self.incremental, parameters=parameters)
+
+    self.manifest.recipes = {recipe_name: {"source_hash": recipe_obj["generation_hash"]} for recipe_name, recipe_obj in self.recipes_map.items()}
+    with self.resources.profile.timed_call("disk", "manifest.save"):
+      self.manifest.save()
+
+  @profiled_phase
+  def write_report(self):
+    self.report["job_id"] = self.job_id
+    self.workspace_output.upload_file(self.resources.dbx_ws_api(), "reports/migration_report.json",
+                                      json.dumps(self.report, indent=2, default=str).encode())
+
+  def run(self):
+    self.prepare()
+    self.traverse()
+    self.size_clusters()
+    self.plan_partitioning()
+    self.plan_job_split()
+    self.plan_materialization()
+    self.plan_fusion()
+    self.generate_recipe_notebooks()
+    self.lint_sql()
+    self.create_snowflake_source_notebooks()
+    self.create_uploaded_source_notebook()
+    self.create_metrics_report()
+    self.upload()
+    self.build_tasks()
+    self.optimize_tasks()
+    self.split_tasks()
+    self.create_job()
+    self.write_report()
+    return self.job_id
+
+def migrate_zones(migrations, settings, zone_workers=None, resources=None):
+  zone_workers = zone_workers or settings.get("zone_workers") or 1
+  resources = resources or SharedResources(settings, concurrent_zones=min(zone_workers, len(migrations)) or 1)
+
+  def migrate(migration):
+    zone_migration = ZoneMigration(resources,
+                                   zone_settings(settings, migration["project"], migration["zone"], migration["settings"],
+                                                 shared_output_dir=len(migrations) > 1),
+                                   migration["project"], migration["zone"], migration["entry_recipes"])
+    try:
+      return {"project": migration["project"], "zone": migration["zone"], "job_id": zone_migration.run()}
+    except Exception as e:
+      zone_migration.log(f"Migration failed: {e}")
+      return {"project": migration["project"], "zone": migration["zone"], "error": str(e)}
+
+  try:
+    with ThreadPoolExecutor(max_workers=zone_workers) as executor:
+      return list(executor.map(migrate, migrations))
+  finally:
+    resources.save_caches()
+    resources.write_profile()
@@ -0,0 +1,168 @@
+import os
+import re
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from dataiku_helper import mkdir_local
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# path segments following these are object names, they are folded so calls group per endpoint
+COLLECTION_SEGMENTS = {"projects", "recipes", "datasets", "zones", "managedfolders", "scenarios", "connections"}
+NUMERIC_SEGMENT = re.compile(r"^\d+$")
+
+def endpoint_name(method, url):
+  path = re.sub(r"^\w+://[^/]+", "", url).split("?", 1)[0]
+  segments = []
+  previous = None
+  for segment in path.strip("/").split("/"):
+    if previous in COLLECTION_SEGMENTS or NUMERIC_SEGMENT.match(segment):
+      segments.append("*")
+    else:
+      segments.append(segment)
+    previous = segment
+  return f"{method} /{'/'.join(segments)}"
+
+def _percentile(sorted_values, fraction):
+  if not sorted_values:
+    return 0
+  return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def _timing_summary(durations):
+  ordered = sorted(durations)
+  total = sum(ordered)
+  return {
+    "count": len(ordered),
+    "total_seconds": round(total, 4),
+    "mean_ms": round(total / len(ordered) * 1000, 2) if ordered else 0,
+    "p50_ms": round(_percentile(ordered, 0.5) * 1000, 2),
+    "p95_ms": round(_percentile(ordered, 0.95) * 1000, 2),
+    "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0,
+  }
+
+def _histogram(durations):
+  histogram = {f"<={bound}ms": 0 for bound in LATENCY_BUCKETS_MS}
+  histogram[f">{LATENCY_BUCKETS_MS[-1]}ms"] = 0
+  for duration in durations:
+    milliseconds = duration * 1000
+    bucket = next((f"<={bound}ms" for bound in LATENCY_BUCKETS_MS if milliseconds <= bound), f">{LATENCY_BUCKETS_MS[-1]}ms")
+    histogram[bucket] += 1
+  return histogram
+
+class MigrationProfile:
+  # Wall time per phase, latency per external API endpoint and per SQL conversion, shared by every zone of a run
+  def __init__(self, progress=False, slowest_conversions=20):
+    self.progress_enabled = progress
+    self.slowest_conversions = slowest_conversions
+    self.started = time.perf_counter()
+    self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self.phases = {}
+    self.calls = {}
+    self.errors = {}
+    self.conversions = []
+    self.counters = {}
+
+  def progress(self, message):
+    if self.progress_enabled:
+      print(f"[{time.perf_counter() - self.started:8.1f}s] {message}", flush=True)
+
+  @contextmanager
+  def phase(self, name, scope=None):
+    # nested phases are recorded under their parent, e.g. prepare/runtime_module
+    stack = getattr(self._local, "stack", None)
+    if stack is None:
+      stack = self._local.stack = []
+    stack.append(name)
+    phase_name = "/".join(stack)
+    label = f"{scope} {phase_name}" if scope else phase_name
+    self.progress(f"{label} started")
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      duration = time.perf_counter() - started
+      stack.pop()
+      with self._lock:
+        self.phases.setdefault(phase_name, []).append(duration)
+      self.progress(f"{label} done in {duration:.2f}s")
+
+  def record_call(self, api, endpoint, seconds, failed=False):
+    with self._lock:
+      self.calls.setdefault(api, {}).setdefault(endpoint, []).append(seconds)
+      if failed:
+        self.errors.setdefault(api, {}).setdefault(endpoint, 0)
+        self.errors[api][endpoint] += 1
+
+  def record_http(self, api, method, url, seconds, failed=False):
+    self.record_call(api, endpoint_name(method, url), seconds, failed)
+
+  @contextmanager
+  def timed_call(self, api, endpoint):
+    started = time.perf_counter()
+    failed = True
+    try:
+      yield
+      failed = False
+    finally:
+      self.record_call(api, endpoint, time.perf_counter() - started, failed)
+
+  def record_conversion(self, recipe_name, seconds, scope=None):
+    with self._lock:
+      self.conversions.append({"recipe": recipe_name, "scope": scope, "seconds": round(seconds, 4)})
+
+  def increment(self, counter, step=1, report_every=None):
+    with self._lock:
+      self.counters[counter] = self.counters.get(counter, 0) + step
+      value = self.counters[counter]
+    if report_every and value % report_every == 0:
+      self.progress(f"{counter}: {value}")
+
+  def to_dict(self):
+    with self._lock:
+      apis = {}
+      for api, endpoints in self.calls.items():
+        durations = [duration for endpoint_durations in endpoints.values() for duration in endpoint_durations]
+        apis[api] = {
+          **_timing_summary(durations),
+          "errors": sum(self.errors.get(api, {}).values()),
+          "histogram": _histogram(durations),
+          "endpoints": {endpoint: {**_timing_summary(endpoint_durations), "errors": self.errors.get(api, {}).get(endpoint, 0)}
+                        for endpoint, endpoint_durations in sorted(endpoints.items())},
+        }
+      return {
+        "started_at": self.started_at,
+        "wall_seconds": round(time.perf_counter() - self.started, 3),
+        "phases": {name: _timing_summary(durations) for name, durations in self.phases.items()},
+        "apis": apis,
+        "conversions": _timing_summary([conversion["seconds"] for conversion in self.conversions]),
+        "slowest_conversions": sorted(self.conversions, key=lambda conversion: conversion["seconds"], reverse=True)[:self.slowest_conversions],
+        "counters": dict(self.counters),
+      }
+
+  def csv_rows(self, profile=None):
+    profile = profile or self.to_dict()
+    rows = [{"kind": "phase", "name": name, **summary} for name, summary in profile["phases"].items()]
+    for api, summary in profile["apis"].items():
+      rows += [{"kind": f"api:{api}", "name": endpoint, **endpoint_summary} for endpoint, endpoint_summary in summary["endpoints"].items()]
+    rows += [{"kind": "conversion", "name": conversion["recipe"], "count": 1, "total_seconds": conversion["seconds"]}
+             for conversion in profile["slowest_conversions"]]
+    return rows
+
+  def write(self, output_dir, name="migration_profile"):
+    mkdir_local(output_dir)
+    profile = self.to_dict()
+    json_path = os.path.join(output_dir, f"{name}.json")
+    with open(json_path, 'w') as fh:
+      json.dump(profile, fh, indent=2)
+
+    csv_path = os.path.join(output_dir, f"{name}.csv")
+    fieldnames = ["kind", "name", "count", "total_seconds", "mean_ms", "p50_ms", "p95_ms", "max_ms", "errors"]
+    with open(csv_path, 'w', newline="") as fh:
+      writer = csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+      writer.writeheader()
+      writer.writerows(self.csv_rows(profile))
+    return json_path, csv_path
@@ -0,0 +1,91 @@
+from source_pushdown import _to_snowflake_column
+
+# Dataiku's own variable for the partition being built, the migrated queries keep using ${DKU_DST_<dimension>}
+PARTITION_PARAMETER_PREFIX = "DKU_DST_"
+
+def get_partition_dimensions(dataset_raw):
+  return [dimension["name"] for dimension in (dataset_raw.get("partitioning") or {}).get("dimensions") or []]
+
+def partition_parameter(dimension):
+  return f"{PARTITION_PARAMETER_PREFIX}{dimension}"
+
+def _input_dependencies(recipe, flow_index):
+  # {input dataset: dependencies}, one dependency per partition dimension of the input
+  dependencies = {}
+  for role in recipe.get_settings().data["recipe"].get("inputs", {}).values():
+    for item in role.get("items", []):
+      dataset = flow_index.get_dataset(item["ref"])
+      input_dimensions = get_partition_dimensions(dataset["raw"]) if dataset else []
+      if not input_dimensions or not item.get("deps"):
+        continue
+      dependencies[item["ref"]] = [{
+        "column": dependency.get("idim") or input_dimensions[min(position, len(input_dimensions) - 1)],
+        "output_dimension": dependency.get("odim"),
+        "func": dependency.get("func"),
+        "granularity": dependency.get("params", {}).get("granularity", "DAY"),
+        "from": dependency.get("params", {}).get("fromOffset", 0),
+        "to": dependency.get("params", {}).get("toOffset", 0),
+      } for position, dependency in enumerate(item["deps"])]
+  return dependencies
+
+def plan_partitioning(recipes_map, flow_index):
+  # Recipes building a partitioned dataset only compute the partition given as job parameter and replace it in a Delta table.
+  # Their partitioned inputs are filtered on the partitions the Dataiku dependencies read
+  plan = {}
+  for recipe_name, recipe_obj in recipes_map.items():
+    output_name = flow_index.get_recipe(recipe_name)["outputs"][0]
+    output = flow_index.get_dataset(output_name)
+    dimensions = get_partition_dimensions(output["raw"]) if output else []
+    if not dimensions:
+      continue
+    inputs = _input_dependencies(recipe_obj["recipe"], flow_index)
+    for dependencies in inputs.values():
+      for dependency in dependencies:
+        # a single output dimension is the one every dependency refers to
+        dependency["output_dimension"] = dependency["output_dimension"] or dimensions[0]
+    plan[recipe_name] = {
+      "output": output_name,
+      "dimensions": dimensions,
+      "parameters": {dimension: partition_parameter(dimension) for dimension in dimensions},
+      "inputs": inputs,
+      # partitions of earlier runs this one reads, they have to be built (backfilled) first
+      "reads_previous_partitions": any(dependency["func"] == "time_range" for dependencies in inputs.values() for dependency in dependencies),
+    }
+  return plan
+
+def get_partition_parameters(partitioning_plan):
+  # job parameters, empty means every partition (a full rebuild)
+  return {parameter: "" for entry in partitioning_plan.values() for parameter in entry["parameters"].values()}
+
+def get_source_partition_filters(snowflake_source_datasets, recipes_map, partitioning_plan):
+  # A Snowflake source only read through equals dependencies is registered with the partition of the run only.
+  # Returns {dataset name: {Snowflake column: job parameter}}
+  readers = {}
+  for recipe_name, recipe_obj in recipes_map.items():
+    for dataset_name in recipe_obj["source_datasets"]["Snowflake"]:
+      readers.setdefault(dataset_name, []).append(recipe_name)
+
+  source_filters = {}
+  for dataset_name in snowflake_source_datasets:
+    filters = None
+    for recipe_name in readers.get(dataset_name, []):
+      dependencies = partitioning_plan.get(recipe_name, {}).get("inputs", {}).get(dataset_name)
+      if not dependencies or any(dependency["func"] != "equals" for dependency in dependencies):
+        filters = None
+        break
+      reader_filters = {_to_snowflake_column(dependency["column"]): partition_parameter(dependency["output_dimension"]) for dependency in dependencies}
+      if filters is not None and filters != reader_filters:
+        filters = None
+        break
+      filters = reader_filters
+    if filters:
+      source_filters[dataset_name] = filters
+  return source_filters
+
+def partitioning_summary(partitioning_plan, source_filters):
+  return {
+    "partitioned_recipes": len(partitioning_plan),
+    "parameters": sorted(get_partition_parameters(partitioning_plan)),
+    "filtered_sources": sorted(source_filters),
+    "reading_previous_partitions": sorted(recipe_name for recipe_name, entry in partitioning_plan.items() if entry["reads_previous_partitions"]),
+  }
@@ -0,0 +1,251 @@
+import ast
+
+from dataiku_helper import RUNTIME_MODULE_NAME, COMPAT_PACKAGE_NAME, DATAIKU_COLUMN_TYPES
+
+# dataiku modules the compatibility package implements, other imports are left as they are and reported
+COMPAT_MODULES = {
+  "dataiku": COMPAT_PACKAGE_NAME,
+  "dataiku.spark": f"{COMPAT_PACKAGE_NAME}.spark",
+  "dataiku.pandasutils": f"{COMPAT_PACKAGE_NAME}.pandasutils",
+}
+COMPAT_NAMES = {
+  "dataiku": {"Dataset", "Folder", "get_custom_variables", "default_project_key", "dku_flow_variables", "spark", "pandasutils"},
+  "dataiku.spark": {"get_dataframe", "write_with_schema", "write_dataframe", "write_schema_from_dataframe"},
+  "dataiku.pandasutils": set(),
+}
+
+def _rewrite_import(node):
+  if isinstance(node, ast.ImportFrom):
+    if node.level or node.module not in COMPAT_MODULES:
+      return None
+    if any(alias.name not in COMPAT_NAMES[node.module] for alias in node.names):
+      return None
+    return ast.ImportFrom(module=COMPAT_MODULES[node.module], names=node.names, level=0)
+
+  if not any(alias.name in COMPAT_MODULES for alias in node.names):
+    return None
+  names = []
+  for alias in node.names:
+    if alias.name not in COMPAT_MODULES:
+      names.append(alias)
+    elif alias.asname:
+      names.append(ast.alias(name=COMPAT_MODULES[alias.name], asname=alias.asname))
+    else:
+      # `import dataiku.spark` binds dataiku too, the package imports its spark module itself
+      names.append(ast.alias(name=COMPAT_PACKAGE_NAME, asname="dataiku"))
+  return ast.Import(names=names)
+
+def _is_dataiku_import(node):
+  if isinstance(node, ast.ImportFrom):
+    return not node.level and node.module is not None and node.module.split(".")[0] == "dataiku"
+  return any(alias.name.split(".")[0] == "dataiku" for alias in node.names)
+
+def rewrite_dataiku_imports(code):
+  # Returns the code importing the compatibility package instead of dataiku, and the dataiku imports left unchanged
+  try:
+    tree = ast.parse(code)
+  except SyntaxError as e:
+    return code, [f"not parsed: {e}"]
+
+  line_offsets = [0]
+  for line in code.splitlines(keepends=True):
+    line_offsets.append(line_offsets[-1] + len(line))
+
+  def offset(lineno, col_offset):
+    # ast columns are utf-8 byte offsets
+    line = code[line_offsets[lineno - 1]:line_offsets[lineno]]
+    return line_offsets[lineno - 1] + len(line.encode()[:col_offset].decode())
+
+  replacements = []
+  unsupported = []
+  for node in ast.walk(tree):
+    if not isinstance(node, (ast.Import, ast.ImportFrom)) or not _is_dataiku_import(node):
+      continue
+    rewritten = _rewrite_import(node)
+    if rewritten is None:
+      unsupported.append(ast.get_source_segment(code, node))
+      continue
+    replacements.append((offset(node.lineno, node.col_offset), offset(node.end_lineno, node.end_col_offset), ast.unparse(rewritten)))
+
+  for start, end, text in sorted(replacements, reverse=True):
+    code = code[:start] + text + code[end:]
+  return code, unsupported
+
+def create_dataiku_compat_package():
+  # {relative path: source} of the package standing in for the dataiku module in migrated Python recipes
+  spark_column_types = ", ".join(f'"{column_type}": "{spark_type}"' for column_type, (_, spark_type) in DATAIKU_COLUMN_TYPES.items())
+  init_payload = f"""# Stand-in for the dataiku module in migrated Python recipes, generated by the Dataiku migration.
+# Datasets are the global temp views and Delta tables of the migrated job, pandas conversions go through Arrow
+import pandas as pd
+from pyspark.sql import functions as F
+
+from {RUNTIME_MODULE_NAME} import get_variables, filter_partitions, write_partitions
+
+_context = {{}}
+# DKU_DST_<dimension> of the partition the recipe builds
+dku_flow_variables = {{}}
+# Spark type of each Dataiku column type, the other types are stored as strings like in the uploaded files
+SPARK_COLUMN_TYPES = {{{spark_column_types}}}
+
+def configure(spark, dbutils, project_key, dataset_locations, variable_defaults, partitioning=None):
+  # partitioning: {{"parameters": {{dimension: job parameter}}, "inputs": {{dataset: dependencies}}, "outputs": [datasets]}}
+  spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+  spark.conf.set("spark.sql.execution.arrow.pyspark.fallback.enabled", "true")
+  partitioning = partitioning or {{"parameters": {{}}, "inputs": {{}}, "outputs": []}}
+  partition_values = dict(zip(partitioning["parameters"], get_variables(dbutils, {{parameter: "" for parameter in partitioning["parameters"].values()}})))
+  dku_flow_variables.update({{partitioning["parameters"][dimension]: value for dimension, value in partition_values.items()}})
+  _context.update({{
+    "spark": spark,
+    "project_key": project_key,
+    "dataset_locations": dataset_locations,
+    "variables": dict(zip(variable_defaults, get_variables(dbutils, variable_defaults))),
+    "partitioning": partitioning,
+    "partition_values": partition_values,
+  }})
+
+def default_project_key():
+  return _context["project_key"]
+
+def get_custom_variables(project_key=None, typed=False):
+  return dict(_context["variables"])
+
+def _spark():
+  return _context["spark"]
+
+def _sample(df, sampling="head", limit=None, ratio=None, columns=None):
+  if columns:
+    df = df.select(*columns)
+  if sampling == "random" and ratio:
+    df = df.sample(fraction=ratio)
+  if limit:
+    df = df.limit(limit)
+  return df
+
+class Dataset:
+  def __init__(self, name, project_key=None, ignore_flow=False):
+    if "." in name:
+      project_key, name = name.split(".", 1)
+    self.name = name
+    self.project_key = project_key or default_project_key()
+    location = _context["dataset_locations"].get(name)
+    if location is None:
+      location = f"global_temp.{{self.project_key}}_{{name}}"
+    self.location = location
+    # [(column, Spark type)] set by write_schema, the dataframes written afterwards are cast to it
+    self.schema = None
+
+  def get_spark_dataframe(self):
+    # like in Dataiku, a partitioned input only has the partitions the recipe depends on
+    return filter_partitions(_spark().table(self.location), _context["partitioning"]["inputs"].get(self.name), _context["partition_values"])
+
+  def get_dataframe(self, columns=None, sampling="head", sampling_column=None, limit=None, ratio=None, **kwargs):
+    return _sample(self.get_spark_dataframe(), sampling, limit, ratio, columns).toPandas()
+
+  def iter_dataframes(self, chunksize=10000, sampling="head", sampling_column=None, limit=None, ratio=None, columns=None, **kwargs):
+    # each Spark partition is fetched with one Arrow transfer (toPandas) and cut into chunks, the driver never holds
+    # more than a partition. The input is persisted so that it is computed once for all the partitions
+    df = _sample(self.get_spark_dataframe(), sampling, limit, ratio, columns).persist()
+    try:
+      for partition_id in range(df.rdd.getNumPartitions()):
+        partition = df.where(F.spark_partition_id() == partition_id).toPandas()
+        for start in range(0, len(partition), chunksize):
+          yield partition.iloc[start:start + chunksize].reset_index(drop=True)
+    finally:
+      df.unpersist()
+
+  def iter_rows(self, **kwargs):
+    for row in self.get_spark_dataframe().toLocalIterator(prefetchPartitions=True):
+      yield row.asDict()
+
+  def read_schema(self, **kwargs):
+    return [{{"name": field.name, "type": field.dataType.simpleString()}} for field in self.get_spark_dataframe().schema.fields]
+
+  def write_schema(self, schema, **kwargs):
+    columns = schema["columns"] if isinstance(schema, dict) else schema
+    self.schema = [(column["name"], SPARK_COLUMN_TYPES.get(column["type"], "STRING")) for column in columns]
+
+  def write_schema_from_dataframe(self, df, **kwargs):
+    self.schema = [(field.name, field.dataType) for field in _to_spark(df).schema.fields]
+
+  def write_with_schema(self, df, **kwargs):
+    # the schema comes from the dataframe, a schema written before is replaced
+    self.schema = None
+    self.write_spark_dataframe(_to_spark(df))
+
+  def write_dataframe(self, df, **kwargs):
+    self.write_spark_dataframe(_to_spark(df))
+
+  def write_spark_dataframe(self, df):
+    if self.schema is not None:
+      missing = [name for name, _ in self.schema if name not in df.columns]
+      if missing:
+        raise Exception(f"The dataframe written to {{self.name}} misses the columns {{missing}} of its schema")
+      df = df.select(*[df[name].cast(column_type).alias(name) for name, column_type in self.schema])
+    database_name, table_name = self.location.split(".", 1)
+    if self.name in _context["partitioning"]["outputs"]:
+      write_partitions(_spark(), df, self.location, _context["partition_values"])
+    elif database_name == "global_temp":
+      df.createOrReplaceGlobalTempView(table_name)
+    else:
+      df.write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable(self.location)
+
+  def get_writer(self):
+    return DatasetWriter(self)
+
+class DatasetWriter:
+  # chunks are converted to Spark as they are written and published together on close
+  def __init__(self, dataset):
+    self.dataset = dataset
+    self.chunks = []
+
+  def write_dataframe(self, df):
+    self.chunks.append(_to_spark(df))
+
+  def close(self):
+    if self.chunks:
+      df = self.chunks[0]
+      for chunk in self.chunks[1:]:
+        df = df.unionByName(chunk)
+      self.dataset.write_spark_dataframe(df)
+    self.chunks = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+
+def _to_spark(df):
+  if isinstance(df, pd.DataFrame):
+    return _spark().createDataFrame(df)
+  return df
+
+class Folder:
+  def __init__(self, *args, **kwargs):
+    raise Exception("Managed folders are not migrated, the recipe has to be ported by hand")
+
+from . import spark, pandasutils
+"""
+  spark_payload = f"""# Stand-in for dataiku.spark
+from {COMPAT_PACKAGE_NAME} import Dataset, _to_spark
+
+def get_dataframe(sql_context, dataset):
+  return dataset.get_spark_dataframe()
+
+def write_with_schema(dataset, df, delete_first=True, **kwargs):
+  dataset.write_with_schema(df)
+
+def write_dataframe(dataset, df, delete_first=True, **kwargs):
+  dataset.write_spark_dataframe(_to_spark(df))
+
+def write_schema_from_dataframe(dataset, df):
+  dataset.write_schema_from_dataframe(df)
+"""
+  # imported by the default Dataiku recipe template, its helpers are not ported
+  pandasutils_payload = "# Stand-in for dataiku.pandasutils\n"
+  return {
+    f"{COMPAT_PACKAGE_NAME}/__init__.py": init_payload,
+    f"{COMPAT_PACKAGE_NAME}/spark.py": spark_payload,
+    f"{COMPAT_PACKAGE_NAME}/pandasutils.py": pandasutils_payload,
+  }
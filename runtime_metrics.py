@@ -0,0 +1,41 @@
+from cluster_sizing import get_recipe_duration
+
+def _baseline_entry(project_key, task_name, recipe_names, output_names, flow_index, job_durations, dataset_metrics):
+  durations = [duration for duration in (get_recipe_duration(name, flow_index, job_durations) for name in recipe_names) if duration is not None]
+  metrics = [dataset_metrics[output_name] for output_name in output_names if dataset_metrics.get(output_name)]
+  return {
+    "project_key": project_key,
+    "task_name": task_name,
+    "recipes": recipe_names,
+    # only when every recipe of the task has been built by Dataiku
+    "dataiku_seconds": round(sum(durations), 3) if len(durations) == len(recipe_names) else None,
+    "dataiku_records": sum(entry["records"] or 0 for entry in metrics) if metrics else None,
+    "dataiku_bytes": sum(entry["bytes"] or 0 for entry in metrics) if metrics else None,
+  }
+
+def build_metrics_baseline(recipes_map, flow_index, fusion_groups, fused_into, job_durations, dataset_metrics=None, uploaded_task_name=None):
+  # The last Dataiku build of each task of the job, for the comparison with the metrics the task records on Databricks.
+  # A fused task adds up the builds of the recipes it runs, the records and bytes are those of the outputs.
+  # The recipes reading uploaded files are all replaced by the single uploaded_task_name registration task
+  dataset_metrics = dataset_metrics or {}
+  baseline = []
+  uploaded_recipe_names = []
+  for recipe_name, recipe_obj in recipes_map.items():
+    if recipe_obj["source_uploaded"]:
+      uploaded_recipe_names.append(recipe_name)
+      continue
+    if recipe_name in fused_into:
+      continue
+    baseline.append(_baseline_entry(flow_index.project_key, recipe_name, fusion_groups.get(recipe_name, [recipe_name]),
+                                    flow_index.get_recipe(recipe_name)["outputs"], flow_index, job_durations, dataset_metrics))
+  if uploaded_task_name and uploaded_recipe_names:
+    output_names = [output_name for name in uploaded_recipe_names for output_name in flow_index.get_recipe(name)["outputs"]]
+    baseline.append(_baseline_entry(flow_index.project_key, uploaded_task_name, uploaded_recipe_names, output_names, flow_index,
+                                    job_durations, dataset_metrics))
+  return baseline
+
+def baseline_summary(baseline):
+  return {
+    "tasks": len(baseline),
+    "with_dataiku_duration": sum(1 for entry in baseline if entry["dataiku_seconds"] is not None),
+  }
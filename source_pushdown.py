@@ -0,0 +1,114 @@
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.scope import traverse_scope
+
+from sql_rewrite import GLOBAL_TEMP_DATABASE, SAFE_IDENTIFIER, KEYWORDS
+
+def _is_hoistable(predicate, alias, single_source):
+  if predicate.find(exp.Subquery, exp.Select, exp.AggFunc, exp.Window):
+    return False
+  columns = list(predicate.find_all(exp.Column))
+  if not columns:
+    return False
+  for column in columns:
+    if column.table != alias and not (single_source and not column.table):
+      return False
+  # f-string fields only exist in the recipe notebooks, not in the source registration
+  return "{" not in predicate.sql(dialect="databricks")
+
+def _to_snowflake_predicate(predicate):
+  predicate = predicate.copy()
+  for column in predicate.find_all(exp.Column):
+    column.set("table", None)
+  return predicate.sql(dialect="snowflake")
+
+def _to_snowflake_column(column_name):
+  quoted = not SAFE_IDENTIFIER.match(column_name) or column_name.upper() in KEYWORDS
+  return exp.to_identifier(column_name, quoted=quoted).sql(dialect="snowflake")
+
+def analyze_table_usage(converted_query, table_names):
+  # Returns, per referenced source table, one entry per reference with the columns it reads
+  # (None when every column may be needed) and the predicates that can be evaluated on the table alone
+  usage = {}
+  scopes = traverse_scope(sqlglot.parse_one(converted_query, read="databricks"))
+  correlated = any(scope.is_correlated_subquery for scope in scopes)
+
+  for scope in scopes:
+    selected_sources = scope.selected_sources
+    single_source = len(selected_sources) == 1
+    joins = scope.expression.args.get("joins") or []
+    has_outer_join = any(join.side for join in joins)
+    # USING / NATURAL join keys and ${var} placeholders never show up in scope.columns
+    hidden_columns = (any(join.args.get("using") or (join.args.get("method") or "").upper() == "NATURAL" for join in joins)
+                      or any(isinstance(node, exp.Placeholder) or (isinstance(node, exp.Identifier) and "{" in node.name)
+                             for node in scope.expression.find_all(exp.Placeholder, exp.Identifier)))
+    projections = scope.expression.expressions if isinstance(scope.expression, exp.Select) else None
+    star = projections is None or any(isinstance(projection, exp.Star) for projection in projections)
+    star_tables = {projection.table for projection in projections or [] if isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star)}
+    where = scope.expression.args.get("where") if isinstance(scope.expression, exp.Select) else None
+    conjuncts = list(where.this.flatten()) if where and isinstance(where.this, exp.And) else ([where.this] if where else [])
+    unqualified = [column for column in scope.columns if not column.table]
+
+    for alias, (node, source) in selected_sources.items():
+      if not isinstance(source, exp.Table) or source.db.lower() != GLOBAL_TEMP_DATABASE or source.name.lower() not in table_names:
+        continue
+
+      reference = {"columns": set(), "predicates": []}
+      if correlated or star or hidden_columns or alias in star_tables or (unqualified and not single_source):
+        reference["columns"] = None
+      else:
+        for column in scope.columns:
+          if column.table == alias or (single_source and not column.table):
+            reference["columns"].add(column.name)
+
+      if not (correlated or has_outer_join):
+        reference["predicates"] = [_to_snowflake_predicate(conjunct) for conjunct in conjuncts
+                                   if _is_hoistable(conjunct, alias, single_source)]
+
+      usage.setdefault(source.name.lower(), []).append(reference)
+
+  return usage
+
+def _combine_references(references):
+  if any(reference is None for reference in references):
+    return None, None
+
+  columns = set()
+  for reference in references:
+    if reference["columns"] is None:
+      columns = None
+      break
+    columns |= reference["columns"]
+
+  # only predicates shared by every reference can be applied before all of them
+  predicates = references[0]["predicates"]
+  for reference in references[1:]:
+    predicates = [predicate for predicate in predicates if predicate in reference["predicates"]]
+
+  return ([_to_snowflake_column(column) for column in sorted(columns)] if columns else None), (" AND ".join(f"({predicate})" for predicate in predicates) or None)
+
+def apply_source_pushdown(snowflake_source_datasets, recipes_list, converted_queries):
+  # references are combined per table, several Dataiku datasets may point to the same Snowflake table
+  references = {}
+  for recipe_obj in recipes_list:
+    table_names = {snowflake_source_datasets[dataset_name]["table_name"].lower() for dataset_name in recipe_obj["source_datasets"]["Snowflake"]}
+    if not table_names:
+      continue
+
+    recipe_name = recipe_obj["recipe"].name
+    if recipe_name not in converted_queries:
+      # non SQL recipes read the whole table
+      for table_name in table_names:
+        references.setdefault(table_name, []).append(None)
+      continue
+
+    table_usage = analyze_table_usage(converted_queries[recipe_name], table_names)
+    for table_name in table_names:
+      references.setdefault(table_name, []).extend(table_usage.get(table_name, [None]))
+
+  for dataset in snowflake_source_datasets.values():
+    columns, predicate = _combine_references(references.get(dataset["table_name"].lower(), [None]))
+    dataset["columns"] = columns
+    dataset["predicate"] = predicate
+
+  return snowflake_source_datasets
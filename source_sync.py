@@ -0,0 +1,46 @@
+import re
+
+# Default schema of the Delta snapshots of the synced Snowflake tables
+DEFAULT_SNAPSHOT_SCHEMA = "dataiku_migration_snapshots"
+
+def _snapshot_table(snapshot_schema, source):
+  name = re.sub(r"\W", "_", f"{source['database_name']}_{source['schema_name']}_{source['table_name']}")
+  return f"{snapshot_schema}.{name}".lower()
+
+def _validate_sync_settings(table_name, table_settings):
+  unknown = set(table_settings) - {"key_columns", "watermark_column", "change_tracking"}
+  if unknown:
+    raise Exception(f"Unknown snowflake_source_sync settings for {table_name}: {sorted(unknown)}")
+  if bool(table_settings.get("watermark_column")) == bool(table_settings.get("change_tracking")):
+    raise Exception(f"snowflake_source_sync of {table_name} needs either a watermark_column or change_tracking")
+  if table_settings.get("change_tracking") and not table_settings.get("key_columns"):
+    raise Exception(f"snowflake_source_sync of {table_name} needs key_columns to apply the tracked changes")
+
+def get_source_sync(snowflake_source_datasets, sync_settings, snapshot_schema=None):
+  # Snowflake sources kept as Delta snapshots updated with the changed rows only, sync_settings is keyed by Snowflake table name.
+  # Returns {dataset name: {"snapshot", "key_columns", "watermark_column", "change_tracking"}}
+  settings_by_table = {table_name.upper(): table_settings for table_name, table_settings in (sync_settings or {}).items()}
+  for table_name, table_settings in settings_by_table.items():
+    _validate_sync_settings(table_name, table_settings)
+
+  source_sync = {}
+  for dataset_name, source in snowflake_source_datasets.items():
+    table_settings = settings_by_table.get(source["table_name"].upper())
+    if table_settings is None:
+      continue
+    source_sync[dataset_name] = {
+      "snapshot": _snapshot_table(snapshot_schema or DEFAULT_SNAPSHOT_SCHEMA, source),
+      "key_columns": list(table_settings.get("key_columns") or []),
+      "watermark_column": table_settings.get("watermark_column"),
+      "change_tracking": bool(table_settings.get("change_tracking")),
+    }
+  return source_sync
+
+def source_sync_summary(source_sync):
+  return {
+    "synced_tables": len(source_sync),
+    "watermark": sorted(dataset_name for dataset_name, sync in source_sync.items() if sync["watermark_column"]),
+    "change_tracking": sorted(dataset_name for dataset_name, sync in source_sync.items() if sync["change_tracking"]),
+    # without a key the new rows are appended, updated rows are duplicated
+    "append_only": sorted(dataset_name for dataset_name, sync in source_sync.items() if not sync["key_columns"]),
+  }
@@ -0,0 +1,96 @@
+import sqlglot
+from sqlglot import exp
+
+from sql_rewrite import protect_variables, _cte_names_in_scope
+
+FUSED_CTE_PREFIX = "fused_"
+
+def find_fusion_groups(recipes_map, flow_index, materialization_plan=None):
+  # An SQL recipe is fused into its reader when that reader is its only migrated consumer and is an SQL recipe too.
+  # Returns {head recipe: [members in dependency order, head last]} for the groups of at least two recipes
+  materialization_plan = materialization_plan or {}
+  # recipes reading uploaded files have no task of their own, they are left alone
+  sql_recipes = {name for name, recipe_obj in recipes_map.items() if recipe_obj["sql_recipe"] and not recipe_obj["source_uploaded"]}
+  fused_into = {}
+  for recipe_name in sql_recipes:
+    if len(flow_index.get_recipe(recipe_name)["outputs"]) != 1:
+      continue
+    # cached or Delta outputs are materialized on purpose, they stay separate tasks
+    if materialization_plan.get(recipe_name, {}).get("materialization", "view") != "view":
+      continue
+    readers = [name for name in flow_index.get_downstream_recipes(recipe_name) if name in recipes_map]
+    if len(readers) == 1 and readers[0] in sql_recipes:
+      fused_into[recipe_name] = readers[0]
+
+  def head_of(recipe_name):
+    while recipe_name in fused_into:
+      recipe_name = fused_into[recipe_name]
+    return recipe_name
+
+  members = {}
+  for recipe_name in fused_into:
+    members.setdefault(head_of(recipe_name), set()).add(recipe_name)
+
+  groups = {}
+  for head, group_members in members.items():
+    ordered = []
+    def visit(recipe_name):
+      for upstream_name in flow_index.get_upstream_recipes(recipe_name):
+        if upstream_name in group_members and upstream_name not in ordered:
+          visit(upstream_name)
+      ordered.append(recipe_name)
+    visit(head)
+    groups[head] = ordered
+  return groups
+
+def _rename_tables(query, mapping, qualified=False):
+  # references keep their original name as alias, so qualified columns still resolve
+  for table in list(query.find_all(exp.Table)):
+    if not isinstance(table.this, exp.Identifier) or (table.args.get("db") and not qualified):
+      continue
+    new_name = mapping.get(table.name.lower())
+    if new_name is None or table.name in _cte_names_in_scope(table):
+      continue
+    if not table.alias:
+      table.set("alias", exp.TableAlias(this=exp.to_identifier(table.name)))
+    table.set("this", exp.to_identifier(new_name))
+    table.set("db", None)
+    table.set("catalog", None)
+
+def _rename_ctes(query, suffix):
+  # CTEs of the inlined queries end up next to each other, their names are made unique per recipe
+  mapping = {}
+  for cte in query.find_all(exp.CTE):
+    new_name = f"{cte.alias}__{suffix}"
+    mapping[cte.alias.lower()] = new_name
+    cte.set("alias", exp.TableAlias(this=exp.to_identifier(new_name)))
+  if not mapping:
+    return
+  for table in list(query.find_all(exp.Table)):
+    if not table.args.get("db") and table.name.lower() in mapping:
+      if not table.alias:
+        table.set("alias", exp.TableAlias(this=exp.to_identifier(table.name)))
+      table.set("this", exp.to_identifier(mapping[table.name.lower()]))
+
+def fuse_queries(group, queries, output_tables):
+  # group is ordered upstream first and ends with the head, queries are the Snowflake queries of the recipes and
+  # output_tables the table each recipe publishes. Returns one Snowflake query with the upstream recipes as CTEs
+  cte_names = {output_tables[recipe_name].lower(): f"{FUSED_CTE_PREFIX}{output_tables[recipe_name]}" for recipe_name in group[:-1]}
+
+  parsed = {}
+  for position, recipe_name in enumerate(group):
+    query = sqlglot.parse_one(protect_variables(queries[recipe_name]), read="snowflake")
+    if recipe_name != group[-1]:
+      _rename_ctes(query, position)
+    _rename_tables(query, cte_names, qualified=True)
+    parsed[recipe_name] = query
+
+  head = parsed[group[-1]]
+  ctes = [exp.CTE(this=parsed[recipe_name], alias=exp.TableAlias(this=exp.to_identifier(cte_names[output_tables[recipe_name].lower()])))
+          for recipe_name in group[:-1]]
+  existing_with = head.args.get("with_")
+  if existing_with is not None:
+    head.set("with_", exp.With(expressions=ctes + existing_with.expressions, recursive=existing_with.args.get("recursive")))
+  else:
+    head.set("with_", exp.With(expressions=ctes))
+  return head.sql(dialect="snowflake")
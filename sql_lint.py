@@ -0,0 +1,267 @@
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.scope import traverse_scope
+
+from sql_rewrite import GLOBAL_TEMP_DATABASE
+
+SEVERITIES = ("info", "warning", "error")
+# Inputs below the first bound make a finding informational, above the second one it is escalated
+IMPACT_THRESHOLDS = {
+  "records": (1_000_000, 100_000_000),
+  "bytes": (1024 ** 3, 100 * 1024 ** 3),
+}
+# A SELECT * over a source with more columns than this reads columns nobody uses
+WIDE_SOURCE_COLUMNS = 30
+SQL_SNIPPET_LENGTH = 200
+
+LINT_RULES = []
+
+def lint_rule(rule):
+  LINT_RULES.append(rule)
+  return rule
+
+def build_table_graph(recipes_map, flow_index, materialization_plan, uploaded_source_datasets=None, dataset_metrics=None):
+  # What each table read by the converted queries stands for, keyed by lower-case table name like the rewrite rules
+  dataset_metrics = dataset_metrics or {}
+
+  def node(dataset_name, kind, location, **extra):
+    dataset = flow_index.get_dataset(dataset_name) or {}
+    columns = dataset.get("raw", {}).get("schema", {}).get("columns")
+    metrics = dataset_metrics.get(dataset_name) or {}
+    return {"dataset": dataset_name, "kind": kind, "location": location,
+            "columns": [column["name"] for column in columns] if columns else None,
+            "records": metrics.get("records"), "bytes": metrics.get("bytes"), **extra}
+
+  table_graph = {}
+  for recipe_name, recipe_obj in recipes_map.items():
+    for dataset_name, source in recipe_obj["source_datasets"]["Snowflake"].items():
+      table_graph[source["table_name"].lower()] = node(dataset_name, "snowflake_source", f"{GLOBAL_TEMP_DATABASE}.{source['table_name']}")
+    entry = materialization_plan[recipe_name]
+    output_name = flow_index.get_recipe(recipe_name)["outputs"][0]
+    table_graph[entry["table_name"].lower()] = node(output_name, "recipe_output", entry["location"],
+                                                    recipe=recipe_name, materialization=entry["materialization"])
+  for dataset_name, source in (uploaded_source_datasets or {}).items():
+    table_graph[source["table_name"].lower()] = node(dataset_name, "uploaded_file", f"{GLOBAL_TEMP_DATABASE}.{source['table_name'].upper()}")
+  return table_graph
+
+def _qualify_schema(table_graph):
+  schema = {}
+  for entry in table_graph.values():
+    if entry["columns"]:
+      database_name, table_name = entry["location"].split(".", 1)
+      schema.setdefault(database_name, {})[table_name] = {column: "STRING" for column in entry["columns"]}
+  return schema
+
+def _impact_level(records, size):
+  levels = []
+  for value, (low, high) in ((records, IMPACT_THRESHOLDS["records"]), (size, IMPACT_THRESHOLDS["bytes"])):
+    if value is not None:
+      levels.append("low" if value < low else "high" if value >= high else "medium")
+  if not levels:
+    return "unknown"
+  return max(levels, key=("low", "medium", "high").index)
+
+def _severity(base, impact_level):
+  # measured inputs move the finding one level down when small and one level up when large
+  position = SEVERITIES.index(base)
+  if impact_level == "low":
+    position = 0
+  elif impact_level == "high":
+    position = min(position + 1, len(SEVERITIES) - 1)
+  return SEVERITIES[position]
+
+def _source_tables(scope, alias=None):
+  # physical tables behind a source of the scope (all of them when alias is None), through CTEs and subqueries
+  tables = []
+  sources = scope.sources if alias is None else {alias: scope.sources.get(alias)}
+  for source in sources.values():
+    if isinstance(source, exp.Table):
+      tables.append(source)
+    elif source is not None and hasattr(source, "sources"):
+      tables += _source_tables(source)
+  return tables
+
+def _estimate(tables, context):
+  # upper bound of the rows and bytes read, None when a table has no metrics
+  records = size = 0
+  for table in tables:
+    entry = context["table_graph"].get(table.name.lower())
+    if entry is None or entry["records"] is None:
+      records = None
+    elif records is not None:
+      records += entry["records"]
+    if entry is None or entry["bytes"] is None:
+      size = None
+    elif size is not None:
+      size += entry["bytes"]
+  return records, size
+
+def _finding(rule, base_severity, message, node, tables, context, records=None, size=None, estimate=True):
+  if estimate:
+    records, size = _estimate(tables, context)
+  impact_level = _impact_level(records, size)
+  sql = node.sql(dialect="databricks")
+  return {
+    "rule": rule,
+    "severity": _severity(base_severity, impact_level),
+    "message": message,
+    "sql": sql if len(sql) <= SQL_SNIPPET_LENGTH else f"{sql[:SQL_SNIPPET_LENGTH]}...",
+    "tables": sorted({table.name for table in tables}),
+    "impact": {"level": impact_level, "records": records, "bytes": size},
+  }
+
+def _conjuncts(condition):
+  if condition is None:
+    return []
+  return list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+
+@lint_rule
+def cross_join(scope, context):
+  select = scope.expression
+  if not isinstance(select, exp.Select):
+    return []
+  where_conjuncts = _conjuncts(select.args.get("where") and select.args["where"].this)
+  findings = []
+  for join in select.args.get("joins") or []:
+    if not isinstance(join.this, (exp.Table, exp.Subquery)) or join.args.get("on") or join.args.get("using"):
+      continue
+    if join.kind not in ("", "CROSS", None) or join.side:
+      continue
+    alias = join.this.alias_or_name
+    # FROM a, b WHERE a.k = b.k (a CROSS JOIN once converted) is planned as an inner join
+    if any(isinstance(conjunct, exp.EQ) and all(isinstance(side, exp.Column) for side in (conjunct.left, conjunct.right))
+           and {conjunct.left.table, conjunct.right.table} != {alias} and alias in {conjunct.left.table, conjunct.right.table, ""}
+           for conjunct in where_conjuncts):
+      continue
+    right_tables = _source_tables(scope, alias)
+    left_tables = [table for name in scope.selected_sources if name != alias for table in _source_tables(scope, name)]
+    right_records, _ = _estimate(right_tables, context)
+    left_records, _ = _estimate(left_tables, context)
+    records = right_records * left_records if right_records is not None and left_records is not None else None
+    findings.append(_finding("cross_join", "warning", f"{alias} is joined without a condition, every row is paired with every row of the other sources",
+                             join, left_tables + right_tables, context, records=records, estimate=False))
+  return findings
+
+@lint_rule
+def select_star(scope, context):
+  select = scope.expression
+  if not isinstance(select, exp.Select):
+    return []
+  star = any(isinstance(projection, exp.Star) for projection in select.expressions)
+  star_tables = {projection.table for projection in select.expressions if isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star)}
+  findings = []
+  for alias, (node, source) in scope.selected_sources.items():
+    if not isinstance(source, exp.Table) or not (star or alias in star_tables):
+      continue
+    entry = context["table_graph"].get(source.name.lower())
+    if entry is None:
+      continue
+    if entry["columns"] and len(entry["columns"]) > WIDE_SOURCE_COLUMNS:
+      findings.append(_finding("select_star", "warning", f"SELECT * reads the {len(entry['columns'])} columns of {entry['dataset']}",
+                               select, [source], context))
+    elif entry["columns"] is None and entry["kind"] == "snowflake_source":
+      # every column of the Snowflake table is registered, the pushdown cannot prune them
+      findings.append(_finding("select_star", "info", f"SELECT * over the Snowflake source {entry['dataset']} of unknown width reads all of its columns",
+                               select, [source], context))
+  return findings
+
+@lint_rule
+def distinct(scope, context):
+  select = scope.expression
+  if not isinstance(select, exp.Select) or not select.args.get("distinct"):
+    return []
+  finding = _finding("distinct", "warning", "DISTINCT shuffles and compares every selected column of its input, deduplicate on the keys or upstream",
+                     select, _source_tables(scope), context)
+  # only large inputs are worth it, without metrics the size of the input is not known
+  if finding["impact"]["level"] == "unknown":
+    finding["severity"] = "info"
+  return [finding]
+
+def _wrapped_columns(side):
+  # columns of a comparison side hidden behind a function
+  if not isinstance(side, exp.Func):
+    return []
+  return list(side.find_all(exp.Column))
+
+@lint_rule
+def function_on_key(scope, context):
+  select = scope.expression
+  if not isinstance(select, exp.Select):
+    return []
+  conditions = [("join", join.args.get("on")) for join in select.args.get("joins") or []]
+  conditions.append(("filter", select.args.get("where") and select.args["where"].this))
+  findings = []
+  for kind, condition in conditions:
+    for conjunct in _conjuncts(condition):
+      if not isinstance(conjunct, (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+        continue
+      # one finding per condition, UPPER(a.k) = UPPER(b.k) wraps both sides
+      sides = [side for side in (conjunct.left, conjunct.right) if _wrapped_columns(side)]
+      if not sides:
+        continue
+      columns = [column for side in sides for column in _wrapped_columns(side)]
+      tables = [table for column in columns for table in _source_tables(scope, column.table)] if all(column.table for column in columns) else _source_tables(scope)
+      tables = list({id(table): table for table in tables}.values())
+      wrapped = " and ".join(side.sql(dialect="databricks") for side in sides)
+      message = (f"{wrapped} {'are' if len(sides) > 1 else 'is'} computed for every row before the join, join on the stored column" if kind == "join" else
+                 f"{wrapped} in the filter prevents data skipping and partition pruning, compare the stored column")
+      findings.append(_finding("function_on_key", "warning", message, conjunct, tables, context))
+  return findings
+
+@lint_rule
+def correlated_subquery(scope, context):
+  # unqualified columns are only external for lack of a schema, they are not counted
+  external_columns = sorted({column.sql(dialect="databricks") for column in scope.external_columns if column.table})
+  if not scope.is_correlated_subquery or not external_columns:
+    return []
+  select = scope.expression
+  tables = _source_tables(scope)
+  if isinstance(select.parent, (exp.Exists, exp.In)) or isinstance(select.parent.parent, (exp.Exists, exp.In)):
+    # planned as a semi join
+    return [_finding("correlated_subquery", "info", f"EXISTS / IN subquery correlated on {', '.join(external_columns)}, Spark runs it as a semi join",
+                     select, tables, context)]
+  if not select.find(exp.AggFunc):
+    # Spark only decorrelates aggregated scalar subqueries
+    return [_finding("correlated_subquery", "error", "Correlated scalar subquery without aggregate, Spark rejects it", select, tables, context)]
+  return [_finding("correlated_subquery", "warning",
+                   f"Scalar subquery correlated on {', '.join(external_columns)} is aggregated and joined back for every reference, compute it once with a join",
+                   select, tables, context)]
+
+def lint_query(converted_query, table_graph, schema=None):
+  # Findings of every rule on one converted query, schema is the qualify schema of the table graph
+  try:
+    expression = sqlglot.parse_one(converted_query, read="databricks")
+  except Exception as e:
+    return [{"rule": "not_parsed", "severity": "info", "message": str(e).splitlines()[0], "sql": None, "tables": [],
+             "impact": {"level": "unknown", "records": None, "bytes": None}}]
+  try:
+    expression = qualify(expression, dialect="databricks", schema=schema, expand_stars=False, validate_qualify_columns=False,
+                         quote_identifiers=False, identify=False)
+  except Exception:
+    # columns are left unqualified, the rules fall back to every table of the scope
+    pass
+  context = {"table_graph": table_graph}
+  return [finding for scope in traverse_scope(expression) for rule in LINT_RULES for finding in rule(scope, context)]
+
+def lint_queries(converted_queries, table_graph):
+  schema = _qualify_schema(table_graph)
+  findings = {}
+  for recipe_name, converted_query in converted_queries.items():
+    recipe_findings = lint_query(converted_query, table_graph, schema)
+    if recipe_findings:
+      findings[recipe_name] = recipe_findings
+  return findings
+
+def lint_summary(findings):
+  summary = {severity: 0 for severity in SEVERITIES}
+  for recipe_findings in findings.values():
+    for finding in recipe_findings:
+      summary[finding["severity"]] += 1
+  summary["recipes"] = len(findings)
+  return summary
+
+def findings_at_or_above(findings, severity):
+  return {recipe_name: [finding for finding in recipe_findings if SEVERITIES.index(finding["severity"]) >= SEVERITIES.index(severity)]
+          for recipe_name, recipe_findings in findings.items()
+          if any(SEVERITIES.index(finding["severity"]) >= SEVERITIES.index(severity) for finding in recipe_findings)}
@@ -0,0 +1,101 @@
+import re
+
+from sqlglot import exp
+from sqlglot.dialects.databricks import Databricks
+
+# Bump whenever a rule changes its output, it is part of the transpile cache key
+REWRITE_RULES_VERSION = 1
+
+GLOBAL_TEMP_DATABASE = "global_temp"
+SAFE_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+KEYWORDS = frozenset(word for keyword in Databricks.Tokenizer.KEYWORDS for word in keyword.split())
+DATAIKU_VARIABLE = re.compile(r"\$\{(\w+)\}")
+VARIABLE_PLACEHOLDER = re.compile(r"__dku_var_(\w+?)__")
+DATE_PARTS = {
+  "YEARS": "YEAR",
+  "QUARTERS": "QUARTER",
+  "MONTHS": "MONTH",
+  "WEEKS": "WEEK",
+  "DAYS": "DAY",
+  "HOURS": "HOUR",
+  "MINUTES": "MINUTE",
+  "SECONDS": "SECOND",
+  "MILLISECONDS": "MILLISECOND",
+  "MICROSECONDS": "MICROSECOND",
+}
+
+REWRITE_RULES = {}
+
+def rewrite_rule(*expression_types):
+  def register(rule):
+    for expression_type in expression_types:
+      REWRITE_RULES.setdefault(expression_type, []).append(rule)
+    return rule
+  return register
+
+def rewrite_rules_key():
+  return [REWRITE_RULES_VERSION, sorted({f"{rule.__module__}.{rule.__name__}" for rules in REWRITE_RULES.values() for rule in rules})]
+
+def protect_variables(query):
+  # ${var} is not valid SQL outside of string literals, it is parsed as a plain identifier instead
+  if "${" not in query:
+    return query
+  return DATAIKU_VARIABLE.sub(r"__dku_var_\1__", query)
+
+def _to_fstring_text(text):
+  # the query ends up in a raw f-string (backslashes are kept): literal braces are escaped and variables become f-string fields
+  return VARIABLE_PLACEHOLDER.sub(r"{\1}", text.replace("{", "{{").replace("}", "}}"))
+
+def _cte_names_in_scope(node):
+  cte_names = set()
+  ancestor = node.parent
+  while ancestor is not None:
+    if isinstance(ancestor, exp.Query):
+      cte_names.update(cte.alias for cte in ancestor.ctes)
+    ancestor = ancestor.parent
+  return cte_names
+
+@rewrite_rule(exp.Table)
+def qualify_global_temp_table(table, context):
+  if not isinstance(table.this, exp.Identifier) or table.name in _cte_names_in_scope(table):
+    return table
+  # outputs materialized as Delta tables are read from their schema instead of global_temp
+  location = context.get("table_locations", {}).get(table.name.lower(), f"{GLOBAL_TEMP_DATABASE}.{table.name}")
+  database_name, table_name = location.split(".", 1)
+  table.set("catalog", None)
+  table.set("db", exp.to_identifier(database_name))
+  if table_name != table.name:
+    table.set("this", exp.to_identifier(table_name))
+  return table
+
+@rewrite_rule(exp.DateAdd, exp.DateSub, exp.DateDiff, exp.DateTrunc, exp.TimestampAdd, exp.TimestampSub, exp.TimestampDiff, exp.TimestampTrunc)
+def normalize_date_part(node, context):
+  unit = node.args.get("unit")
+  if unit is not None and unit.name.upper() in DATE_PARTS:
+    node.set("unit", exp.var(DATE_PARTS[unit.name.upper()]))
+  return node
+
+@rewrite_rule(exp.Identifier)
+def normalize_identifier(identifier, context):
+  name = identifier.this
+  if "__dku_var_" in name or "{" in name or "}" in name:
+    name = _to_fstring_text(name)
+    identifier.set("this", name)
+    identifier.set("quoted", False)
+  elif identifier.quoted and SAFE_IDENTIFIER.match(name) and name.upper() not in KEYWORDS:
+    identifier.set("quoted", False)
+  return identifier
+
+@rewrite_rule(exp.Literal)
+def substitute_literal_variables(literal, context):
+  if literal.is_string:
+    literal.set("this", _to_fstring_text(literal.this))
+  return literal
+
+def _apply_rules(node, context):
+  for rule in REWRITE_RULES.get(type(node), ()):
+    node = rule(node, context)
+  return node
+
+def apply_rewrite_rules(expression, context=None):
+  return expression.transform(_apply_rules, context or {}, copy=False)
@@ -0,0 +1,20 @@
+from cluster_sizing import DEFAULT_CLUSTER_TIERS, choose_cluster_tier
+
+def _load(input_bytes=0, records=0, duration_seconds=None):
+  return {"input_bytes": input_bytes, "output_bytes": 0, "records": records, "duration_seconds": duration_seconds, "measured": True}
+
+def test_small_load_gets_the_smallest_tier():
+  assert choose_cluster_tier(_load(input_bytes=1024, records=100, duration_seconds=5), DEFAULT_CLUSTER_TIERS) == "small"
+
+def test_record_count_alone_moves_to_a_larger_tier():
+  # a SQL table without size metric, only its record count is known
+  assert choose_cluster_tier(_load(records=200 * 1000 ** 2), DEFAULT_CLUSTER_TIERS) == "medium"
+  assert choose_cluster_tier(_load(records=2 * 1000 ** 3), DEFAULT_CLUSTER_TIERS) == "large"
+
+def test_bytes_and_duration_move_to_a_larger_tier():
+  assert choose_cluster_tier(_load(input_bytes=2 * 1024 ** 3), DEFAULT_CLUSTER_TIERS) == "medium"
+  assert choose_cluster_tier(_load(duration_seconds=2 * 60 * 60), DEFAULT_CLUSTER_TIERS) == "large"
+
+def test_tiers_without_a_record_limit():
+  tiers = [{"job_cluster_key": "only", "max_bytes": None, "max_duration_seconds": None, "new_cluster": {}}]
+  assert choose_cluster_tier(_load(records=10 ** 12), tiers) == "only"
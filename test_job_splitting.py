@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from job_splitting import (plan_job_split, get_cross_job_outputs, get_sub_job_dependencies, split_job_tasks, sub_job_task_key,
+                           get_orchestration_tasks)
+
+def _random_flow(components=3, size=40, seed=1):
+  generator = random.Random(seed)
+  dependencies = {}
+  for component in range(components):
+    names = [f"c{component}_{index}" for index in range(size)]
+    for index, name in enumerate(names):
+      dependencies[name] = generator.sample(names[:index], min(index, generator.randint(0, 2)))
+  return dependencies
+
+def _tasks(dependencies, registration_key):
+  tasks = [{"task_key": name, "depends_on": [{"task_key": upstream_name} for upstream_name in upstream_names] + [{"task_key": registration_key}]}
+           for name, upstream_names in dependencies.items()]
+  return tasks + [{"task_key": registration_key, "depends_on": []}, {"task_key": "REGISTER_UNUSED", "depends_on": []}]
+
+def test_small_flow_is_not_split():
+  assert plan_job_split({"a": [], "b": ["a"]}, {}, 1000) == {"a": 0, "b": 0}
+
+def test_sub_jobs_only_depend_on_earlier_ones():
+  dependencies = _random_flow()
+  assignment = plan_job_split(dependencies, {name: {"REGISTER"} for name in dependencies}, 30)
+  assert len(set(assignment.values())) > 1
+  for name, upstream_names in dependencies.items():
+    for upstream_name in upstream_names:
+      assert assignment[upstream_name] <= assignment[name]
+  for index, upstream_indexes in get_sub_job_dependencies(assignment, dependencies).items():
+    assert all(upstream_index < index for upstream_index in upstream_indexes)
+
+def test_sub_jobs_fit_the_task_limit():
+  dependencies = _random_flow()
+  assignment = plan_job_split(dependencies, {name: {"REGISTER"} for name in dependencies}, 30)
+  sub_jobs = split_job_tasks(_tasks(dependencies, "REGISTER"), assignment)
+  assert all(len(tasks) <= 30 for tasks in sub_jobs)
+  # every recipe task runs once, the registration task runs in every sub-job
+  task_keys = [task["task_key"] for tasks in sub_jobs for task in tasks]
+  assert sorted(key for key in task_keys if key in dependencies) == sorted(dependencies)
+  assert task_keys.count("REGISTER") == len(sub_jobs)
+  assert task_keys.count("REGISTER_UNUSED") == 1
+
+def test_dependencies_across_sub_jobs_are_dropped():
+  dependencies = _random_flow()
+  assignment = plan_job_split(dependencies, {}, 30)
+  cross_job_outputs = get_cross_job_outputs(assignment, dependencies)
+  assert cross_job_outputs
+  for tasks in split_job_tasks(_tasks(dependencies, "REGISTER"), assignment):
+    task_keys = {task["task_key"] for task in tasks}
+    for task in tasks:
+      assert all(dependency["task_key"] in task_keys for dependency in task["depends_on"])
+
+def test_invalid_limit_and_cycle():
+  with pytest.raises(Exception):
+    plan_job_split({"a": []}, {}, 1)
+  with pytest.raises(Exception):
+    plan_job_split({"a": ["b"], "b": ["a"]}, {}, 10)
+
+def test_orchestration_tasks_pass_the_parameters_on():
+  tasks = get_orchestration_tasks([11, 12], {0: [], 1: [0]}, [{"name": "v1", "default": "x"}])
+  assert [task["task_key"] for task in tasks] == [sub_job_task_key(0), sub_job_task_key(1)]
+  assert tasks[1]["depends_on"] == [{"task_key": sub_job_task_key(0)}]
+  assert tasks[1]["run_job_task"] == {"job_id": 12, "job_parameters": {"v1": "{{job.parameters.v1}}"}}
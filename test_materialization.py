@@ -0,0 +1,13 @@
+from materialization import VIEW, CACHE, DELTA, choose_materialization
+
+def test_fan_out_thresholds():
+  assert choose_materialization("sql_query", 1, 2, 3) == VIEW
+  assert choose_materialization("sql_query", 2, 2, 3) == CACHE
+  assert choose_materialization("sql_query", 3, 2, 3) == DELTA
+  assert choose_materialization("pivot", 5, 2, 3) == CACHE
+  assert choose_materialization("python", 5, 2, 3) == VIEW
+
+def test_disabled_thresholds():
+  assert choose_materialization("sql_query", 10, None, None) == VIEW
+  assert choose_materialization("sql_query", 10, 2, None) == CACHE
+  assert choose_materialization("sql_query", 10, None, 3) == DELTA
@@ -0,0 +1,119 @@
+import types
+
+from databricks.sdk.errors import NotFound
+
+from migration_manifest import MigrationManifest, content_hash, create_or_update_job
+
+def _task(task_key, notebook_path=None, depends_on=()):
+  return {"task_key": task_key, "depends_on": [{"task_key": key} for key in depends_on],
+          "notebook_task": {"notebook_path": notebook_path or f"/out/{task_key}", "source": "WORKSPACE"}}
+
+CLUSTERS = [{"job_cluster_key": "one_worker", "new_cluster": {"num_workers": 1}}]
+
+class FakeJobs:
+  def __init__(self, missing=False):
+    self.missing = missing
+    self.created = []
+    self.updated = []
+
+  def create(self, **kwargs):
+    self.created.append(kwargs)
+    return types.SimpleNamespace(job_id=100 + len(self.created))
+
+  def update(self, job_id, new_settings=None, fields_to_remove=None):
+    if self.missing:
+      raise NotFound(f"Job {job_id} does not exist")
+    self.updated.append((job_id, new_settings, fields_to_remove))
+
+def _workspace(missing=False):
+  return types.SimpleNamespace(jobs=FakeJobs(missing))
+
+def test_first_run_creates_the_job():
+  manifest = MigrationManifest(None)
+  w = _workspace()
+  assert create_or_update_job(w, manifest, "zone", [_task("a"), _task("b", depends_on=["a"])], CLUSTERS) == 101
+  assert len(w.jobs.created[0]["tasks"]) == 2
+  assert set(manifest.tasks) == {"a", "b"}
+
+def test_unchanged_job_is_not_updated():
+  manifest = MigrationManifest(None)
+  tasks = [_task("a"), _task("b", depends_on=["a"])]
+  create_or_update_job(_workspace(), manifest, "zone", tasks, CLUSTERS)
+  w = _workspace()
+  assert create_or_update_job(w, manifest, "zone", tasks, CLUSTERS) == 101
+  assert w.jobs.created == [] and w.jobs.updated == []
+
+def test_only_changed_tasks_are_sent_and_removed_tasks_are_removed():
+  manifest = MigrationManifest(None)
+  create_or_update_job(_workspace(), manifest, "zone", [_task("a"), _task("b", depends_on=["a"]), _task("c")], CLUSTERS)
+  w = _workspace()
+  create_or_update_job(w, manifest, "zone", [_task("a"), _task("b", "/out/b_v2", depends_on=["a"])], CLUSTERS)
+  job_id, new_settings, fields_to_remove = w.jobs.updated[0]
+  assert job_id == 101
+  assert [task.task_key for task in new_settings.tasks] == ["b"]
+  assert fields_to_remove == ["tasks/c"]
+  assert set(manifest.tasks) == {"a", "b"}
+
+def test_removed_parameters_are_removed():
+  manifest = MigrationManifest(None)
+  create_or_update_job(_workspace(), manifest, "zone", [_task("a")], CLUSTERS, parameters=[{"name": "v1", "default": "x"}])
+  w = _workspace()
+  create_or_update_job(w, manifest, "zone", [_task("a")], CLUSTERS, parameters=[])
+  assert w.jobs.updated[0][2] == ["parameters"]
+
+def test_dropped_parameter_is_replaced_by_the_full_list():
+  # parameters are not merged by name like the tasks, the list sent replaces the one of the job
+  manifest = MigrationManifest(None)
+  create_or_update_job(_workspace(), manifest, "zone", [_task("a")], CLUSTERS,
+                       parameters=[{"name": "v1", "default": "x"}, {"name": "v2", "default": "y"}])
+  w = _workspace()
+  create_or_update_job(w, manifest, "zone", [_task("a")], CLUSTERS, parameters=[{"name": "v2", "default": "y"}])
+  _, new_settings, fields_to_remove = w.jobs.updated[0]
+  assert [parameter.as_dict() for parameter in new_settings.parameters] == [{"name": "v2", "default": "y"}]
+  assert new_settings.tasks == [] and fields_to_remove == []
+  assert manifest.is_job_parameters_unchanged([{"name": "v2", "default": "y"}])
+
+def test_deleted_job_is_created_again():
+  manifest = MigrationManifest(None)
+  create_or_update_job(_workspace(), manifest, "zone", [_task("a")], CLUSTERS)
+  w = _workspace(missing=True)
+  assert create_or_update_job(w, manifest, "zone", [_task("a"), _task("b")], CLUSTERS) == 101
+  assert len(w.jobs.created[0]["tasks"]) == 2
+
+def test_not_incremental_always_creates():
+  manifest = MigrationManifest(None)
+  create_or_update_job(_workspace(), manifest, "zone", [_task("a")], CLUSTERS)
+  w = _workspace()
+  create_or_update_job(w, manifest, "zone", [_task("a")], CLUSTERS, incremental=False)
+  assert len(w.jobs.created) == 1
+
+def test_unchanged_outputs_are_skipped():
+  manifest = MigrationManifest(None)
+  output = types.SimpleNamespace(notebooks={"transformations/a": "payload a"}, files={"lib/runtime.py": b"runtime"})
+  manifest.record_outputs(output)
+  output = types.SimpleNamespace(notebooks={"transformations/a": "payload a", "transformations/b": "payload b"},
+                                 files={"lib/runtime.py": b"runtime v2"})
+  manifest.skip_unchanged_outputs(output)
+  assert list(output.notebooks) == ["transformations/b"]
+  assert list(output.files) == ["lib/runtime.py"]
+
+def test_removed_recipes():
+  manifest = MigrationManifest(None, {"recipes": {"a": {"source_hash": "1"}, "b": {"source_hash": "2"}}})
+  assert manifest.get_removed_recipes({"a": {}}) == ["b"]
+  assert manifest.is_recipe_unchanged("a", "1")
+  assert not manifest.is_recipe_unchanged("a", "3")
+
+def test_save_and_load(tmp_path):
+  path = str(tmp_path / "manifests" / "zone.json")
+  manifest = MigrationManifest(path, {"recipes": {"a": {"source_hash": "1"}}})
+  manifest.record_job(7, [_task("a")], CLUSTERS, [{"name": "v1", "default": "x"}])
+  manifest.get_sub_job("zone - part 1").record_job(8, [_task("b")], CLUSTERS)
+  manifest.save()
+
+  loaded = MigrationManifest.load(path)
+  assert loaded.job_id == 7
+  assert loaded.recipes == {"a": {"source_hash": "1"}}
+  assert loaded.tasks == {"a": content_hash(_task("a"))}
+  assert loaded.is_job_parameters_unchanged([{"name": "v1", "default": "x"}])
+  assert loaded.sub_jobs["zone - part 1"].job_id == 8
+  assert MigrationManifest.load(str(tmp_path / "missing.json")).job_id is None
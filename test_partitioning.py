@@ -0,0 +1,114 @@
+import sys
+import types
+
+import pytest
+
+from dataiku_helper import create_runtime_module
+from partitioning import get_partition_parameters, get_source_partition_filters
+
+def _recipes(*readers):
+  return {recipe_name: {"source_datasets": {"Snowflake": {dataset_name: {}}}} for recipe_name, dataset_name in readers}
+
+def _plan(recipe_name, dataset_name, *dependencies):
+  return {recipe_name: {"parameters": {"day": "DKU_DST_day"}, "inputs": {dataset_name: list(dependencies)}, "reads_previous_partitions": False}}
+
+EQUALS = {"func": "equals", "column": "day", "output_dimension": "day"}
+TIME_RANGE = {"func": "time_range", "column": "day", "output_dimension": "day"}
+
+def test_partition_parameters_default_to_a_full_rebuild():
+  assert get_partition_parameters(_plan("r1", "SRC", EQUALS)) == {"DKU_DST_day": ""}
+
+def test_source_read_through_equals_is_filtered():
+  filters = get_source_partition_filters({"SRC": {}}, _recipes(("r1", "SRC")), _plan("r1", "SRC", EQUALS))
+  assert filters == {"SRC": {"day": "DKU_DST_day"}}
+
+def test_source_read_through_a_time_range_is_not_filtered():
+  assert get_source_partition_filters({"SRC": {}}, _recipes(("r1", "SRC")), _plan("r1", "SRC", TIME_RANGE)) == {}
+
+def test_source_with_an_unpartitioned_reader_is_not_filtered():
+  recipes = _recipes(("r1", "SRC"), ("r2", "SRC"))
+  assert get_source_partition_filters({"SRC": {}}, recipes, _plan("r1", "SRC", EQUALS)) == {}
+
+class FakeWriter:
+  def __init__(self, df):
+    self.df = df
+    self.calls = {"options": {}}
+
+  def format(self, name):
+    return self
+
+  def partitionBy(self, *columns):
+    self.calls["partition_by"] = list(columns)
+    return self
+
+  def mode(self, mode):
+    self.calls["mode"] = mode
+    return self
+
+  def option(self, key, value):
+    self.calls["options"][key] = value
+    return self
+
+  def saveAsTable(self, location):
+    self.calls["columns"] = self.df.columns
+    self.df.saved.append(self.calls)
+
+class FakeDataFrame:
+  def __init__(self, columns, saved=None):
+    self.columns = columns
+    self.saved = [] if saved is None else saved
+
+  def withColumn(self, name, value):
+    return FakeDataFrame(self.columns + [name], self.saved)
+
+  @property
+  def write(self):
+    return FakeWriter(self)
+
+@pytest.fixture
+def runtime(monkeypatch):
+  # the runtime module only needs pyspark for F.lit here
+  functions = types.ModuleType("pyspark.sql.functions")
+  functions.lit = lambda value: value
+  functions.expr = None
+  sql = types.ModuleType("pyspark.sql")
+  sql.functions = functions
+  monkeypatch.setitem(sys.modules, "pyspark", types.ModuleType("pyspark"))
+  monkeypatch.setitem(sys.modules, "pyspark.sql", sql)
+  monkeypatch.setitem(sys.modules, "pyspark.sql.functions", functions)
+  namespace = {}
+  exec(create_runtime_module(), namespace)
+  return namespace
+
+def _spark(table_exists):
+  return types.SimpleNamespace(catalog=types.SimpleNamespace(tableExists=lambda location: table_exists))
+
+def test_full_rebuild_is_partitioned_on_every_dimension(runtime):
+  df = FakeDataFrame(["a", "day"])
+  runtime["write_partitions"](_spark(True), df, "db.t", {"day": ""})
+  assert df.saved[0]["partition_by"] == ["day"]
+  assert df.saved[0]["options"] == {"overwriteSchema": "true"}
+
+def test_full_rebuild_needs_the_dimension_columns(runtime):
+  with pytest.raises(Exception):
+    runtime["write_partitions"](_spark(True), FakeDataFrame(["a"]), "db.t", {"day": ""})
+
+def test_dimension_without_column_nor_value_is_rejected(runtime):
+  with pytest.raises(Exception):
+    runtime["write_partitions"](_spark(True), FakeDataFrame(["a"]), "db.t", {"day": "2024-01-01", "country": ""})
+
+def test_partition_run_replaces_its_partition(runtime):
+  df = FakeDataFrame(["a"])
+  runtime["write_partitions"](_spark(True), df, "db.t", {"day": "it's"})
+  assert df.saved[0]["columns"] == ["a", "day"]
+  assert df.saved[0]["partition_by"] == ["day"]
+  assert df.saved[0]["options"] == {"replaceWhere": "`day` = 'it\\'s'"}
+
+def test_first_partition_run_creates_the_table(runtime):
+  df = FakeDataFrame(["a"])
+  runtime["write_partitions"](_spark(False), df, "db.t", {"day": "2024-01-01"})
+  assert df.saved[0]["columns"] == ["a", "day"]
+  assert df.saved[0]["options"] == {"overwriteSchema": "true"}
+
+def test_partition_predicate_escapes_values(runtime):
+  assert runtime["partition_predicate"]({"func": "equals", "column": "day", "output_dimension": "day"}, {"day": "a'b"}) == "`day` = 'a\\'b'"
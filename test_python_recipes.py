@@ -0,0 +1,35 @@
+import ast
+
+import pytest
+
+from python_recipes import rewrite_dataiku_imports, create_dataiku_compat_package
+
+@pytest.mark.parametrize("code, rewritten", [
+  ("import dataiku\nx = 1", "import dataiku_compat as dataiku\nx = 1"),
+  ("import dataiku.spark as dkuspark", "import dataiku_compat.spark as dkuspark"),
+  ("import dataiku.spark", "import dataiku_compat as dataiku"),
+  ("import os, dataiku", "import os, dataiku_compat as dataiku"),
+  ("from dataiku import Dataset, get_custom_variables", "from dataiku_compat import Dataset, get_custom_variables"),
+  ("from dataiku.spark import get_dataframe", "from dataiku_compat.spark import get_dataframe"),
+  # the offsets are in characters, not in utf-8 bytes
+  ('x = "é"; import dataiku', 'x = "é"; import dataiku_compat as dataiku'),
+])
+def test_supported_imports_are_rewritten(code, rewritten):
+  assert rewrite_dataiku_imports(code) == (rewritten, [])
+
+@pytest.mark.parametrize("code", ["from dataiku import insights", "import dataiku.scenario"])
+def test_unsupported_imports_are_kept_and_reported(code):
+  assert rewrite_dataiku_imports(code) == (code, [code])
+
+@pytest.mark.parametrize("code", ["import dataikuapi", "from .dataiku import x"])
+def test_other_imports_are_left_alone(code):
+  assert rewrite_dataiku_imports(code) == (code, [])
+
+def test_code_that_does_not_parse_is_reported():
+  code, unsupported = rewrite_dataiku_imports("def f(:")
+  assert code == "def f(:"
+  assert unsupported[0].startswith("not parsed")
+
+def test_compat_package_is_valid_python():
+  for source in create_dataiku_compat_package().values():
+    ast.parse(source)
@@ -0,0 +1,52 @@
+from source_pushdown import analyze_table_usage, apply_source_pushdown
+
+def test_columns_and_predicates_of_a_single_table():
+  usage = analyze_table_usage("SELECT a, b FROM global_temp.src WHERE c > 1 AND a = 'x'", {"src"})
+  assert usage == {"src": [{"columns": {"a", "b", "c"}, "predicates": ["c > 1", "a = 'x'"]}]}
+
+def test_columns_of_joined_tables_by_alias():
+  usage = analyze_table_usage("SELECT s.x, o.y FROM global_temp.src s JOIN global_temp.other o ON s.id = o.id", {"src", "other"})
+  assert usage["src"][0]["columns"] == {"x", "id"}
+  assert usage["other"][0]["columns"] == {"y", "id"}
+
+def test_using_join_reads_every_column():
+  # the USING key is not a column of the scope, pruning would drop the join key
+  usage = analyze_table_usage("SELECT a.x, b.y FROM global_temp.src a JOIN global_temp.other b USING (id)", {"src", "other"})
+  assert usage["src"][0]["columns"] is None
+  assert usage["other"][0]["columns"] is None
+
+def test_natural_join_reads_every_column():
+  usage = analyze_table_usage("SELECT a.x FROM global_temp.src a NATURAL JOIN global_temp.other b", {"src", "other"})
+  assert usage["src"][0]["columns"] is None
+
+def test_variable_placeholder_reads_every_column():
+  usage = analyze_table_usage("SELECT x, {col} FROM global_temp.src", {"src"})
+  assert usage["src"][0]["columns"] is None
+
+def test_variable_in_predicate_is_not_pushed_down():
+  usage = analyze_table_usage("SELECT x FROM global_temp.src WHERE y = '{v1}' AND z > 1", {"src"})
+  assert usage["src"][0]["predicates"] == ["z > 1"]
+
+def test_star_and_outer_join():
+  assert analyze_table_usage("SELECT * FROM global_temp.src", {"src"})["src"][0]["columns"] is None
+  usage = analyze_table_usage("SELECT s.x FROM global_temp.src s LEFT JOIN global_temp.other o ON s.id = o.id WHERE s.x > 1",
+                              {"src", "other"})
+  assert usage["src"][0]["predicates"] == []
+
+def test_apply_source_pushdown_combines_references():
+  class Recipe:
+    def __init__(self, name):
+      self.name = name
+
+  datasets = {"SRC": {"table_name": "SRC"}}
+  recipes_list = [{"recipe": Recipe("r1"), "source_datasets": {"Snowflake": ["SRC"]}},
+                  {"recipe": Recipe("r2"), "source_datasets": {"Snowflake": ["SRC"]}}]
+  apply_source_pushdown(datasets, recipes_list, {"r1": "SELECT a FROM global_temp.src WHERE a > 1",
+                                                 "r2": "SELECT b FROM global_temp.src WHERE a > 1"})
+  assert datasets["SRC"]["columns"] == ["a", "b"]
+  assert datasets["SRC"]["predicate"] == "(a > 1)"
+
+  # a Python recipe reads the whole table
+  apply_source_pushdown(datasets, recipes_list, {"r1": "SELECT a FROM global_temp.src"})
+  assert datasets["SRC"]["columns"] is None
+  assert datasets["SRC"]["predicate"] is None
@@ -0,0 +1,19 @@
+from sql_lint import lint_query
+
+def _rules(findings):
+  return [finding["rule"] for finding in findings]
+
+def test_function_on_both_join_keys_is_one_finding():
+  findings = lint_query("SELECT a.x FROM global_temp.s a JOIN global_temp.t b ON UPPER(a.k) = UPPER(b.k)", {})
+  assert _rules(findings) == ["function_on_key"]
+  assert findings[0]["tables"] == ["s", "t"]
+
+def test_function_on_filter_key():
+  findings = lint_query("SELECT x FROM global_temp.s WHERE LOWER(z) = 'q'", {})
+  assert _rules(findings) == ["function_on_key"]
+
+def test_plain_join_has_no_finding():
+  assert lint_query("SELECT a.x FROM global_temp.s a JOIN global_temp.t b ON a.k = b.k", {}) == []
+
+def test_cross_join():
+  assert "cross_join" in _rules(lint_query("SELECT a.x FROM global_temp.s a CROSS JOIN global_temp.t b", {}))
@@ -0,0 +1,56 @@
+import types
+
+from dataiku_helper import convert_snowflake_to_databricks_query, create_notebook_from_recipe
+
+def _convert(query, table_locations=None):
+  return " ".join(convert_snowflake_to_databricks_query(query, table_locations).split())
+
+def test_tables_are_read_from_global_temp_or_their_location():
+  assert _convert("select a from P_o1") == "SELECT a FROM global_temp.P_o1"
+  assert _convert("select a from P_o1", {"p_o1": "dataiku_migration.P_o1"}) == "SELECT a FROM dataiku_migration.P_o1"
+
+def test_ctes_are_not_qualified():
+  assert _convert("with c as (select 1 a) select a from c") == "WITH c AS ( SELECT 1 AS a ) SELECT a FROM c"
+
+def test_variables_become_fstring_fields():
+  converted = _convert("select ${v1} as a from P_o1 where s = '${v2}' and t = '{x}'")
+  assert converted == "SELECT {v1} AS a FROM global_temp.P_o1 WHERE s = '{v2}' AND t = '{{x}}'"
+
+def test_safe_quoted_identifiers_are_unquoted():
+  assert _convert('select "col", "select" from P_o1') == "SELECT col, `select` FROM global_temp.P_o1"
+
+def test_date_parts_are_singular():
+  assert "DATEADD(DAY, 1, y)" in _convert("select dateadd(days, 1, y) from P_o1")
+
+class _Settings:
+  def get_flat_output_refs(self):
+    return ["o1"]
+
+class _Recipe:
+  project_key = "P"
+  name = "r1"
+
+  def get_settings(self):
+    return _Settings()
+
+def _run_notebook_query(converted_query, variables):
+  # runs the recipe function of the generated notebook and returns the query it passes to spark.sql
+  payload = create_notebook_from_recipe(_Recipe(), variables, "/lib", converted_query=converted_query)
+  function_cell = next(cell for cell in payload.split("# COMMAND ----------") if "def r1():" in cell)
+  queries = []
+
+  class Spark:
+    def sql(self, query):
+      queries.append(query)
+      return types.SimpleNamespace(createOrReplaceGlobalTempView=lambda name: None)
+
+  exec(function_cell + "\nr1()", {"spark": Spark(), **variables})
+  return " ".join(queries[0].split())
+
+def test_generated_notebook_keeps_quote_escapes_and_regexes():
+  converted_query = convert_snowflake_to_databricks_query("select 'it''s' a, regexp_like(x, '\\\\d+') b from T")
+  assert _run_notebook_query(converted_query, {}) == "SELECT 'it\\'s' AS a, REGEXP_LIKE(x, '\\\\d+') AS b FROM global_temp.T"
+
+def test_generated_notebook_substitutes_variables():
+  converted_query = convert_snowflake_to_databricks_query("select a from T where s = '${v1}' and t = '{x}'")
+  assert _run_notebook_query(converted_query, {"v1": "value"}) == "SELECT a FROM global_temp.T WHERE s = 'value' AND t = '{x}'"
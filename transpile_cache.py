@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import sqlglot
+
+from dataiku_helper import convert_snowflake_to_databricks_query, mkdir_local
+from sql_rewrite import rewrite_rules_key
+
+def transpile_settings(table_locations=None):
+  return {"read": "snowflake", "write": "databricks", "sqlglot": sqlglot.__version__, "rules": rewrite_rules_key(),
+          "table_locations": table_locations or {}}
+
+def normalize_query(query):
+  # only line endings and surrounding blanks, whitespace inside literals is significant
+  return query.replace("\r\n", "\n").strip()
+
+class TranspileCache:
+  def __init__(self, cache_dir=None):
+    self.cache_dir = cache_dir
+    self._memory = {}
+    self._lock = threading.Lock()
+
+  def key(self, query, settings):
+    return hashlib.sha256(json.dumps([normalize_query(query), settings], sort_keys=True).encode()).hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key[:2], f"{key}.sql")
+
+  def get(self, key):
+    with self._lock:
+      if key in self._memory:
+        return self._memory[key]
+    if self.cache_dir and os.path.exists(self._path(key)):
+      with open(self._path(key)) as fh:
+        value = fh.read()
+      with self._lock:
+        self._memory[key] = value
+      return value
+    return None
+
+  def put(self, key, value):
+    with self._lock:
+      self._memory[key] = value
+    if self.cache_dir:
+      path = self._path(key)
+      mkdir_local(os.path.dirname(path))
+      tmp_path = f"{path}.{os.getpid()}.tmp"
+      with open(tmp_path, 'w') as fh:
+        fh.write(value)
+      os.replace(tmp_path, path)
+
+def _timed_convert(query, table_locations=None):
+  started = time.perf_counter()
+  converted_query = convert_snowflake_to_databricks_query(query, table_locations=table_locations)
+  return converted_query, time.perf_counter() - started
+
+def transpile_queries(queries, cache, max_workers=None, table_locations=None, timings=None):
+  # timings, when given, receives the conversion time of every query that missed the cache
+  settings = transpile_settings(table_locations)
+  convert = partial(_timed_convert, table_locations=table_locations)
+  converted_queries = {}
+  misses = {}
+  for name, query in queries.items():
+    key = cache.key(query, settings)
+    converted_query = cache.get(key)
+    if converted_query is not None:
+      converted_queries[name] = converted_query
+    else:
+      misses.setdefault(key, (query, []))[1].append(name)
+
+  if not misses:
+    return converted_queries
+
+  keys = list(misses)
+  miss_queries = [misses[key][0] for key in keys]
+  if max_workers == 1 or len(keys) == 1:
+    results = [convert(query) for query in miss_queries]
+  else:
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      results = list(executor.map(convert, miss_queries, chunksize=4))
+
+  for key, (converted_query, seconds) in zip(keys, results):
+    cache.put(key, converted_query)
+    for name in misses[key][1]:
+      converted_queries[name] = converted_query
+      if timings is not None:
+        timings[name] = seconds
+
+  return converted_queries
@@ -0,0 +1,125 @@
+import io
+import os
+import re
+import json
+import uuid
+import base64
+import zipfile
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dataiku_helper import write_to_local_path
+
+COMMAND_SEPARATOR = re.compile(r"^# COMMAND ----------\n", re.MULTILINE)
+
+class WorkspaceOutput:
+  def __init__(self, dbx_output_dir, local_dump_dir=None):
+    self.dbx_output_dir = dbx_output_dir
+    self.local_dump_dir = local_dump_dir
+    self.notebooks = {}
+    self.files = {}
+    self._lock = threading.Lock()
+
+  def workspace_path(self, relative_path):
+    return posixpath.join(self.dbx_output_dir, relative_path)
+
+  def add_notebook(self, relative_path, payload):
+    with self._lock:
+      self.notebooks[relative_path] = payload
+    return self.workspace_path(relative_path)
+
+  def add_file(self, relative_path, content):
+    with self._lock:
+      self.files[relative_path] = content
+    return self.workspace_path(relative_path)
+
+  def dump_local(self):
+    for relative_path, payload in {**self.notebooks, **self.files}.items():
+      write_to_local_path(payload, os.path.join(self.local_dump_dir, relative_path))
+
+  def _leaf_directories(self, relative_paths):
+    directories = {posixpath.dirname(self.workspace_path(path)) for path in relative_paths}
+    return [directory for directory in directories
+            if not any(other.startswith(directory + "/") for other in directories)]
+
+  def build_dbc_archive(self):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+      for relative_path, payload in self.notebooks.items():
+        commands = [command.strip("\n") for command in COMMAND_SEPARATOR.split(payload)]
+        notebook = {
+          "version": "NotebookV1",
+          "origId": uuid.uuid4().int >> 80,
+          "name": posixpath.basename(relative_path),
+          "language": "python",
+          "commands": [{
+            "version": "CommandV1",
+            "origId": uuid.uuid4().int >> 80,
+            "guid": str(uuid.uuid4()),
+            "subtype": "command",
+            "commandType": "auto",
+            "position": float(position + 1),
+            "command": command,
+          } for position, command in enumerate(commands) if command.strip()],
+          "dashboards": [],
+          "guid": str(uuid.uuid4()),
+          "globalVars": {},
+          "iPythonMetadata": None,
+          "inputWidgets": {},
+        }
+        archive.writestr(f"{relative_path}.python", json.dumps(notebook))
+    return buffer.getvalue()
+
+  def _import(self, dbx_ws_api, dbx_import_path, content, fmt, language, overwrite):
+    dbx_ws_api.client.import_workspace(dbx_import_path,
+                                       fmt,
+                                       language,
+                                       base64.b64encode(content).decode(),
+                                       overwrite)
+
+  def upload_file(self, dbx_ws_api, relative_path, content, overwrite=True):
+    dbx_import_path = self.workspace_path(relative_path)
+    dbx_ws_api.mkdirs(posixpath.dirname(dbx_import_path))
+    self._import(dbx_ws_api, dbx_import_path, content, "auto", None, overwrite)
+    if self.local_dump_dir:
+      write_to_local_path(content, os.path.join(self.local_dump_dir, relative_path))
+    return dbx_import_path
+
+  def upload_archive(self, dbx_ws_api, overwrite=True):
+    # A DBC import cannot overwrite, the output directory is replaced as a whole
+    if overwrite:
+      try:
+        dbx_ws_api.delete(self.dbx_output_dir, is_recursive=True)
+      except Exception:
+        pass
+    dbx_ws_api.mkdirs(posixpath.dirname(self.dbx_output_dir))
+    self._import(dbx_ws_api, self.dbx_output_dir, self.build_dbc_archive(), "DBC", None, False)
+    self.upload_batch(dbx_ws_api, overwrite=overwrite, include_notebooks=False)
+
+  def upload_batch(self, dbx_ws_api, overwrite=True, max_workers=8, include_notebooks=True):
+    uploads = [(path, content, "auto", None) for path, content in self.files.items()]
+    if include_notebooks:
+      uploads += [(path, payload.encode(), "auto", "PYTHON") for path, payload in self.notebooks.items()]
+    if not uploads:
+      return
+
+    for directory in self._leaf_directories([upload[0] for upload in uploads]):
+      dbx_ws_api.mkdirs(directory)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      futures = [executor.submit(self._import, dbx_ws_api, self.workspace_path(path), content, fmt, language, overwrite)
+                 for path, content, fmt, language in uploads]
+      for future in futures:
+        future.result()
+
+  def upload(self, dbx_ws_api, mode="batch", overwrite=True, max_workers=8):
+    if self.local_dump_dir:
+      self.dump_local()
+
+    if mode == "archive":
+      self.upload_archive(dbx_ws_api, overwrite=overwrite)
+    elif mode == "batch":
+      self.upload_batch(dbx_ws_api, overwrite=overwrite, max_workers=max_workers)
+    else:
+      raise Exception(f"Unknown workspace import mode {mode}")